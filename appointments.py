@@ -0,0 +1,527 @@
+import argparse
+import bisect
+import itertools
+import logging
+import math
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+from models import Location
+
+logger = logging.getLogger("vet_system.appointments")
+
+SLOT_MINUTES = 30
+HOLD_SECONDS = 300
+# Journal entries are written at least this often, or as soon as this many pile up
+FLUSH_INTERVAL = 1.0
+FLUSH_BATCH = 5000
+# Score points added for a doctor with a free slot inside the horizon, when ranking boosts availability
+AVAILABILITY_BONUS = 0.5
+AVAILABILITY_HORIZON = 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS slots (
+    doctor TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    booking_id TEXT,
+    customer TEXT,
+    PRIMARY KEY (doctor, start)
+) WITHOUT ROWID;
+"""
+
+
+class AppointmentError(Exception):
+    pass
+
+
+class SlotUnavailable(AppointmentError):
+    pass
+
+
+class HoldExpired(AppointmentError):
+    pass
+
+
+def doctor_key(doctor) -> str:
+    # Stable across reloads and compaction, unlike doctor ids
+    return f"{doctor.name}|{doctor.contact}"
+
+
+@dataclass
+class Hold:
+    __slots__ = ("hold_id", "doctor", "start", "expires_at", "customer")
+
+    hold_id: str
+    doctor: str
+    start: int
+    expires_at: float
+    customer: Optional[str]
+
+
+@dataclass
+class Booking:
+    __slots__ = ("booking_id", "doctor", "start", "customer")
+
+    booking_id: str
+    doctor: str
+    start: int
+    customer: Optional[str]
+
+
+class _DoctorSlots:
+    # One doctor's slots, every field is guarded by lock
+    __slots__ = ("lock", "free", "held", "booked")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Sorted slot start times (epoch seconds) nobody holds or booked
+        self.free: List[int] = []
+        self.held: Dict[int, Hold] = {}
+        self.booked: Dict[int, Booking] = {}
+
+    def earliest_free(self, now: float) -> float:
+        i = bisect.bisect_left(self.free, now)
+        return self.free[i] if i < len(self.free) else math.inf
+
+
+class TimerWheel:
+    """Hashed timer wheel, scheduling and cancelling are O(1) and one thread fires due keys.
+
+    Deadlines more than one revolution away wait in their bucket until they are due.
+    """
+
+    def __init__(self, callback: Callable[[List[str]], None], tick: float = 1.0, buckets: int = 512):
+        self.tick = tick
+        self._callback = callback
+        self._buckets: List[Dict[str, float]] = [{} for _ in range(buckets)]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _bucket(self, deadline: float) -> Dict[str, float]:
+        # The first tick that ends after the deadline, so its bucket is never visited too early
+        return self._buckets[(int(deadline // self.tick) + 1) % len(self._buckets)]
+
+    def schedule(self, key: str, deadline: float):
+        with self._lock:
+            self._bucket(deadline)[key] = deadline
+
+    def cancel(self, key: str, deadline: float):
+        with self._lock:
+            self._bucket(deadline).pop(key, None)
+
+    def start(self) -> "TimerWheel":
+        self._thread = threading.Thread(target=self._run, name="vet-timer-wheel", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        last = int(time.time() // self.tick)
+        while not self._stop.wait(self.tick):
+            now = time.time()
+            current = int(now // self.tick)
+            due = []
+            with self._lock:
+                # Every bucket passed since the last turn, at most one revolution
+                for position in range(max(last, current - len(self._buckets)) + 1, current + 1):
+                    bucket = self._buckets[position % len(self._buckets)]
+                    expired = [key for key, deadline in bucket.items() if deadline <= now]
+                    for key in expired:
+                        del bucket[key]
+                    due.extend(expired)
+            last = current
+            if due:
+                try:
+                    self._callback(due)
+                except Exception:
+                    logger.exception("Timer callback failed")
+
+
+class AppointmentInventory:
+    """Appointment slots per doctor, safe for many concurrent reservations.
+
+    Each doctor's slots have their own lock, so reservations for different doctors
+    never contend. Holds expire on a timer wheel. Slot changes are journaled and
+    written to SQLite in batches by a background thread.
+    """
+
+    def __init__(self, path: Optional[str] = None, hold_seconds: float = HOLD_SECONDS,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.hold_seconds = hold_seconds
+        self._doctors: Dict[str, _DoctorSlots] = {}
+        self._create_lock = threading.Lock()
+        self._holds: Dict[str, Hold] = {}
+        self._bookings: Dict[str, Booking] = {}
+        # Subscriber token -> doctor keys changed since it last looked
+        self._changes: Dict[int, Set[str]] = {}
+        self._changes_lock = threading.Lock()
+        self._tokens = itertools.count()
+
+        # (doctor, start) -> (state, booking id, customer), the newest write per slot wins
+        self._journal: Dict[tuple, tuple] = {}
+        self._journal_lock = threading.Lock()
+        self._flush_now = threading.Event()
+        self._stop = threading.Event()
+        self._connection = None
+        self._flusher = None
+        if path is not None:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.execute("PRAGMA synchronous = NORMAL")
+            self._connection.executescript(_SCHEMA)
+            self._load()
+            self._flusher = threading.Thread(target=self._flush_loop, args=(flush_interval,),
+                                             name="vet-appointments-flush", daemon=True)
+            self._flusher.start()
+        self._wheel = TimerWheel(self._expire).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._wheel.stop()
+        if self._flusher is not None:
+            self._stop.set()
+            self._flush_now.set()
+            self._flusher.join()
+            # Whatever was journaled while the last batch was being written
+            self.flush()
+            self._connection.close()
+            self._flusher = None
+
+    def _load(self):
+        rows = self._connection.execute("SELECT doctor, start, state, booking_id, customer FROM slots")
+        count = 0
+        for doctor, start, state, booking_id, customer in rows:
+            slots = self._slots(doctor, create=True)
+            if state == "booked":
+                booking = slots.booked[start] = Booking(booking_id, doctor, start, customer)
+                self._bookings[booking_id] = booking
+            else:
+                slots.free.append(start)
+            count += 1
+        for slots in self._doctors.values():
+            slots.free.sort()
+        logger.info("Loaded %d appointment slots for %d doctors from %s", count, len(self._doctors), self.path)
+
+    def _slots(self, doctor: str, create: bool = False) -> Optional[_DoctorSlots]:
+        slots = self._doctors.get(doctor)
+        if slots is None and create:
+            with self._create_lock:
+                slots = self._doctors.setdefault(doctor, _DoctorSlots())
+        return slots
+
+    def _changed(self, doctor: str, *journal):
+        with self._changes_lock:
+            for keys in self._changes.values():
+                keys.add(doctor)
+        if self._connection is not None:
+            with self._journal_lock:
+                for start, state, booking_id, customer in journal:
+                    self._journal[(doctor, start)] = (state, booking_id, customer)
+                if len(self._journal) >= FLUSH_BATCH:
+                    self._flush_now.set()
+
+    # Schedules
+
+    def open_slots(self, doctor: str, starts: Iterable[int]) -> int:
+        """Publishes free slots, returns how many were new."""
+        slots = self._slots(doctor, create=True)
+        added = []
+        with slots.lock:
+            for start in sorted(set(int(start) for start in starts)):
+                i = bisect.bisect_left(slots.free, start)
+                if (i < len(slots.free) and slots.free[i] == start) or start in slots.held or start in slots.booked:
+                    continue
+                slots.free.insert(i, start)
+                added.append(start)
+        if added:
+            self._changed(doctor, *((start, "free", None, None) for start in added))
+        return len(added)
+
+    def open_day(self, doctor: str, day_start: float, opens: float = 9, closes: float = 17,
+                 slot_minutes: int = SLOT_MINUTES) -> int:
+        # Slots from `opens` to `closes` o'clock on the day starting at day_start (epoch seconds)
+        step = slot_minutes * 60
+        return self.open_slots(doctor, range(int(day_start + opens * 3600), int(day_start + closes * 3600), step))
+
+    def close_slots(self, doctor: str, starts: Iterable[int]) -> int:
+        # Withdraws free slots, held and booked ones are left alone
+        slots = self._slots(doctor)
+        if slots is None:
+            return 0
+        removed = []
+        with slots.lock:
+            for start in set(int(start) for start in starts):
+                i = bisect.bisect_left(slots.free, start)
+                if i < len(slots.free) and slots.free[i] == start:
+                    del slots.free[i]
+                    removed.append(start)
+        if removed:
+            self._changed(doctor, *((start, "closed", None, None) for start in removed))
+        return len(removed)
+
+    def free_slots(self, doctor: str, after: Optional[float] = None, limit: int = 20) -> List[int]:
+        slots = self._slots(doctor)
+        if slots is None:
+            return []
+        after = time.time() if after is None else after
+        with slots.lock:
+            i = bisect.bisect_left(slots.free, after)
+            return slots.free[i:i + limit]
+
+    def earliest_free(self, doctor: str, now: Optional[float] = None) -> float:
+        # inf when the doctor has no free slot ahead, or no schedule at all
+        slots = self._slots(doctor)
+        if slots is None:
+            return math.inf
+        with slots.lock:
+            return slots.earliest_free(time.time() if now is None else now)
+
+    def has_schedule(self, doctor: str) -> bool:
+        return doctor in self._doctors
+
+    # Reservations
+
+    def hold(self, doctor: str, start: int, customer: Optional[str] = None) -> Hold:
+        """Reserves one slot for hold_seconds, until confirm() books it or release() gives it back."""
+        slots = self._slots(doctor)
+        if slots is None:
+            raise SlotUnavailable(f"{doctor} has no appointment schedule")
+        start = int(start)
+        now = time.time()
+        with slots.lock:
+            i = bisect.bisect_left(slots.free, start)
+            if i == len(slots.free) or slots.free[i] != start:
+                raise SlotUnavailable(f"slot {start} of {doctor} is not free")
+            if start < now:
+                raise SlotUnavailable(f"slot {start} of {doctor} has already started")
+            del slots.free[i]
+            hold = Hold(uuid.uuid4().hex, doctor, start, now + self.hold_seconds, customer)
+            slots.held[start] = hold
+        self._holds[hold.hold_id] = hold
+        self._wheel.schedule(hold.hold_id, hold.expires_at)
+        self._changed(doctor)
+        return hold
+
+    def hold_next(self, doctor: str, after: Optional[float] = None, within: Optional[float] = None,
+                  customer: Optional[str] = None) -> Hold:
+        # Holds the earliest free slot from `after` (now by default), at most `within` seconds later
+        after = time.time() if after is None else after
+        for start in self.free_slots(doctor, after, limit=8):
+            if within is not None and start > after + within:
+                break
+            try:
+                return self.hold(doctor, start, customer)
+            except SlotUnavailable:
+                # Taken between the listing and the hold, try the next one
+                continue
+        raise SlotUnavailable(f"{doctor} has no free slot available")
+
+    def confirm(self, hold_id: str, customer: Optional[str] = None) -> Booking:
+        hold = self._holds.pop(hold_id, None)
+        if hold is None:
+            raise HoldExpired(f"hold {hold_id} expired or was released")
+        self._wheel.cancel(hold_id, hold.expires_at)
+        slots = self._doctors[hold.doctor]
+        with slots.lock:
+            if slots.held.get(hold.start) is not hold:
+                raise HoldExpired(f"hold {hold_id} expired or was released")
+            del slots.held[hold.start]
+            if hold.expires_at <= time.time():
+                # The wheel hasn't reclaimed it yet, but it's no longer valid
+                bisect.insort(slots.free, hold.start)
+                expired = True
+            else:
+                booking = Booking(uuid.uuid4().hex, hold.doctor, hold.start, customer or hold.customer)
+                slots.booked[hold.start] = booking
+                expired = False
+        if expired:
+            self._changed(hold.doctor)
+            raise HoldExpired(f"hold {hold_id} expired")
+        self._bookings[booking.booking_id] = booking
+        self._changed(hold.doctor, (booking.start, "booked", booking.booking_id, booking.customer))
+        return booking
+
+    def release(self, hold_id: str) -> bool:
+        hold = self._holds.pop(hold_id, None)
+        if hold is None:
+            return False
+        self._wheel.cancel(hold_id, hold.expires_at)
+        return self._return_hold(hold)
+
+    def cancel(self, booking_id: str) -> bool:
+        booking = self._bookings.pop(booking_id, None)
+        if booking is None:
+            return False
+        slots = self._doctors[booking.doctor]
+        with slots.lock:
+            if slots.booked.get(booking.start) is not booking:
+                return False
+            del slots.booked[booking.start]
+            bisect.insort(slots.free, booking.start)
+        self._changed(booking.doctor, (booking.start, "free", None, None))
+        return True
+
+    def _return_hold(self, hold: Hold) -> bool:
+        slots = self._doctors[hold.doctor]
+        with slots.lock:
+            if slots.held.get(hold.start) is not hold:
+                return False
+            del slots.held[hold.start]
+            bisect.insort(slots.free, hold.start)
+        self._changed(hold.doctor)
+        return True
+
+    def _expire(self, hold_ids: List[str]):
+        now = time.time()
+        for hold_id in hold_ids:
+            hold = self._holds.get(hold_id)
+            if hold is None or hold.expires_at > now:
+                continue
+            if self._holds.pop(hold_id, None) is hold:
+                self._return_hold(hold)
+
+    # Change feed for AvailabilityView
+
+    def subscribe(self) -> int:
+        token = next(self._tokens)
+        with self._changes_lock:
+            self._changes[token] = set()
+        return token
+
+    def changes(self, token: int) -> Set[str]:
+        with self._changes_lock:
+            changed, self._changes[token] = self._changes[token], set()
+        return changed
+
+    # Persistence
+
+    def flush(self):
+        if self._connection is None:
+            return
+        with self._journal_lock:
+            journal, self._journal = self._journal, {}
+        if not journal:
+            return
+        with self._connection:
+            self._connection.executemany("DELETE FROM slots WHERE doctor = ? AND start = ?", [
+                key for key, (state, _, _) in journal.items() if state == "closed"])
+            self._connection.executemany("INSERT OR REPLACE INTO slots VALUES (?, ?, ?, ?, ?)", [
+                key + value for key, value in journal.items() if value[0] != "closed"])
+
+    def _flush_loop(self, interval: float):
+        while True:
+            self._flush_now.wait(interval)
+            self._flush_now.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                logger.exception("Could not persist appointment slots")
+            if self._stop.is_set():
+                return
+
+
+class AvailabilityView:
+    """Earliest free slot per doctor id of a DoctorTable, kept current from the inventory's change feed."""
+
+    def __init__(self, inventory: AppointmentInventory):
+        self.inventory = inventory
+        self._token = inventory.subscribe()
+        self._table = None
+        self._size = 0
+        self._keys: List[str] = []
+        self._ids_by_key: Dict[str, List[int]] = {}
+        self._earliest = np.full(0, math.inf)
+        self._lock = threading.Lock()
+
+    def _index(self, table, start: int, stop: int, now: float):
+        # Rows are append-only, so only rows past the indexed size need keys
+        keys = [doctor_key(row) for row in table[start:stop]]
+        self._keys.extend(keys)
+        for doctor_id, key in enumerate(keys, start):
+            self._ids_by_key.setdefault(key, []).append(doctor_id)
+        earliest = np.full(stop, math.inf)
+        earliest[:start] = self._earliest[:start]
+        inventory = self.inventory
+        for doctor_id, key in enumerate(keys, start):
+            if inventory.has_schedule(key):
+                earliest[doctor_id] = inventory.earliest_free(key, now)
+        self._earliest = earliest
+        self._size = stop
+
+    def locations(self, keys: Iterable[str]) -> List[Location]:
+        """Locations of the indexed doctors behind keys."""
+        with self._lock:
+            table = self._table
+            return [table[doctor_id].location for key in keys for doctor_id in self._ids_by_key.get(key, ())]
+
+    def earliest(self, snapshot, ids: np.ndarray, now: Optional[float] = None) -> np.ndarray:
+        """Earliest free slot start per doctor id in ids, inf for doctors without one."""
+        now = time.time() if now is None else now
+        inventory = self.inventory
+        with self._lock:
+            table = snapshot.table
+            if table is not self._table:
+                self._table, self._size, self._keys, self._ids_by_key = table, 0, [], {}
+                self._earliest = np.full(0, math.inf)
+                inventory.changes(self._token)
+            if self._size < table.size:
+                self._index(table, self._size, table.size, now)
+            for key in inventory.changes(self._token):
+                earliest = inventory.earliest_free(key, now)
+                for doctor_id in self._ids_by_key.get(key, ()):
+                    self._earliest[doctor_id] = earliest
+            values = self._earliest[ids]
+            # Slots that started since they were looked up move each doctor to its next one
+            passed = np.flatnonzero(values < now)
+            for position in passed.tolist():
+                doctor_id = int(ids[position])
+                values[position] = self._earliest[doctor_id] = inventory.earliest_free(self._keys[doctor_id], now)
+        return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open appointment slots for every doctor in a directory")
+    parser.add_argument("database", help="appointments SQLite file")
+    parser.add_argument("--doctors", default="vets_database.xlsx", help="directory to read doctors from")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--opens", type=float, default=9, help="hour the first slot starts")
+    parser.add_argument("--closes", type=float, default=17, help="hour the last slot ends")
+    parser.add_argument("--slot-minutes", type=int, default=SLOT_MINUTES)
+    args = parser.parse_args()
+
+    from diagnostics import configure_logging
+    from vet_core import VetMatchingSystem
+    configure_logging("INFO")
+    system = VetMatchingSystem(args.doctors)
+    if system.load_error is not None:
+        raise SystemExit(f"Could not load doctors database: {system.load_error}")
+    today = time.mktime(time.localtime()[:3] + (0, 0, 0, 0, 0, -1))
+    opened = 0
+    with AppointmentInventory(args.database) as inventory:
+        for doctor in system.doctors:
+            for day in range(args.days):
+                opened += inventory.open_day(doctor_key(doctor), today + day * 86400, args.opens, args.closes,
+                                             args.slot_minutes)
+    logger.info("Opened %d slots for %d doctors", opened, system.doctor_count)
+
+
+if __name__ == "__main__":
+    main()
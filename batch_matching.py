@@ -0,0 +1,128 @@
+import math
+import os
+from collections import defaultdict, deque
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from ranking import rank_doctors_matrix
+
+# Upper bound on pets x candidates cells held in memory for one distance/score matrix
+MAX_MATRIX_CELLS = 4_000_000
+# Batches with at least this many pets are spread over a process pool by default
+PARALLEL_THRESHOLD = 5000
+KM_PER_DEGREE = 111.2
+
+_worker_state = None
+
+
+class _Point:
+    __slots__ = ("latitude", "longitude")
+
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _group_by_cell(queries: List[tuple], max_distance: float) -> List[List[int]]:
+    # Pets in one cell about max_distance wide share most of their candidates,
+    # scattered pets end up in groups of their own
+    if not math.isfinite(max_distance) or max_distance <= 0:
+        return [list(range(len(queries)))]
+    cell_deg = max_distance / KM_PER_DEGREE
+    groups = defaultdict(list)
+    for index, (lat, lon, _, _) in enumerate(queries):
+        groups[(math.floor(lat / cell_deg), math.floor(lon / cell_deg))].append(index)
+    return list(groups.values())
+
+
+def _rank_group(arrays, queries: List[tuple], candidates: List[np.ndarray],
+                max_distance: float, limit: Optional[int]) -> List[tuple]:
+    ids = np.unique(np.concatenate(candidates))
+
+    # Keep every matrix under MAX_MATRIX_CELLS by splitting the group into row blocks
+    rows_per_block = max(1, MAX_MATRIX_CELLS // max(len(ids), 1))
+    latitudes = np.radians(np.array([q[0] for q in queries], dtype=np.float64))
+    longitudes = np.radians(np.array([q[1] for q in queries], dtype=np.float64))
+    species = [q[2] for q in queries]
+    weights = [q[3] for q in queries]
+
+    rankings = []
+    for start in range(0, len(queries), rows_per_block):
+        stop = start + rows_per_block
+        rankings.extend(rank_doctors_matrix(arrays, latitudes[start:stop], longitudes[start:stop],
+                                            species[start:stop], max_distance, ids, limit,
+                                            weights[start:stop]))
+    return rankings
+
+
+def rank_chunk(snapshot, queries: List[Tuple[float, float, str]],
+               max_distance: float, limit: Optional[int] = None) -> List[tuple]:
+    # queries are (latitude, longitude, species, symptom weights) tuples in degrees.
+    # Each pet is only scored against the candidates of pets in its own grid cell,
+    # not against every candidate of the chunk.
+    if not queries:
+        return []
+    candidates = [snapshot.candidates(_Point(lat, lon), max_distance) for lat, lon, _, _ in queries]
+    rankings = [None] * len(queries)
+    for group in _group_by_cell(queries, max_distance):
+        ranked = _rank_group(snapshot.table, [queries[i] for i in group], [candidates[i] for i in group],
+                             max_distance, limit)
+        for index, ranking in zip(group, ranked):
+            rankings[index] = ranking
+    return rankings
+
+
+def _init_worker(snapshot):
+    global _worker_state
+    _worker_state = snapshot
+
+
+def _rank_in_worker(queries, max_distance, limit):
+    return rank_chunk(_worker_state, queries, max_distance, limit)
+
+
+def iter_batch_rankings(snapshot, pets: Iterable, max_distance: float,
+                        chunk_size: int = 256, processes: Optional[int] = None,
+                        limit: Optional[int] = None,
+                        symptom_matcher=None, mp_context=None) -> Iterator[Tuple[object, tuple]]:
+    # Yields (pet, (ids, distances, scores, specialist)) in input order. mp_context picks the
+    # multiprocessing start method, workers get the snapshot pickled under spawn and forkserver.
+    if processes is None:
+        large = hasattr(pets, "__len__") and len(pets) >= PARALLEL_THRESHOLD
+        processes = (os.cpu_count() or 1) if large else 1
+
+    def query(pet):
+        weights = symptom_matcher.pet_weights(pet) if symptom_matcher is not None else ()
+        return float(pet.location.latitude), float(pet.location.longitude), pet.species, weights
+
+    chunks = ((chunk, [query(p) for p in chunk]) for chunk in chunked(pets, chunk_size))
+
+    if processes <= 1:
+        for chunk, queries in chunks:
+            yield from zip(chunk, rank_chunk(snapshot, queries, max_distance, limit))
+        return
+
+    # Only a couple of chunks per worker are in flight, so memory stays bounded for any batch size
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=processes, mp_context=mp_context, initializer=_init_worker,
+                             initargs=(snapshot,)) as pool:
+        pending = deque()
+        for chunk, queries in chunks:
+            pending.append((chunk, pool.submit(_rank_in_worker, queries, max_distance, limit)))
+            if len(pending) >= 2 * processes:
+                done_chunk, future = pending.popleft()
+                yield from zip(done_chunk, future.result())
+        while pending:
+            done_chunk, future = pending.popleft()
+            yield from zip(done_chunk, future.result())
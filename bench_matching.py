@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from doctor_cache import default_cache_dir, load_doctor_columns
+from synthetic_directory import XLSX_MAX_ROWS, generate_columns, generate_pets, write_directory
+from vet_core import VetMatchingSystem
+
+# Metrics where a larger value is a regression, the rest are throughputs
+LOWER_IS_BETTER = ("load_cold_s", "load_warm_s", "build_s", "build_peak_mb",
+                   "query_p50_ms", "query_p95_ms", "query_p99_ms")
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+    # Linux reports kilobytes, macOS bytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+
+def bench_load(columns, fmt: str, workdir: str) -> dict:
+    # Cold parses the file and compiles the cache, warm is served from the compiled cache
+    os.makedirs(workdir, exist_ok=True)
+    path = os.path.join(workdir, f"doctors_{len(columns)}.{fmt}")
+    write_directory(columns, path)
+    shutil.rmtree(default_cache_dir(path), ignore_errors=True)
+    _, cold = _timed(load_doctor_columns, path)
+    loaded, warm = _timed(load_doctor_columns, path)
+    assert len(loaded) == len(columns)
+    return {"format": fmt, "file_mb": os.path.getsize(path) / 2 ** 20,
+            "load_cold_s": cold, "load_warm_s": warm}
+
+
+def bench_build(columns) -> dict:
+    _, elapsed = _timed(VetMatchingSystem(None).add_doctor_columns, columns)
+    # Traced separately, tracemalloc slows allocation down too much to time under it
+    tracemalloc.start()
+    system = VetMatchingSystem(None)
+    system.add_doctor_columns(columns)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"build_s": elapsed, "build_peak_mb": peak / 2 ** 20, "resident_mb": current / 2 ** 20}, system
+
+
+def bench_queries(system: VetMatchingSystem, pets, max_distance: float) -> dict:
+    latencies = np.empty(len(pets))
+    found = 0
+    for i, pet in enumerate(pets):
+        start = time.perf_counter()
+        found += len(system.find_best_doctor(pet, max_distance))
+        latencies[i] = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {"query_p50_ms": p50, "query_p95_ms": p95, "query_p99_ms": p99,
+            "queries_per_s": len(pets) / latencies.sum(), "mean_matches": found / len(pets)}
+
+
+def bench_batch(system: VetMatchingSystem, pets, max_distance: float, processes) -> dict:
+    _, elapsed = _timed(lambda: sum(1 for _ in system.find_best_doctors_batch(pets, max_distance,
+                                                                             processes=processes)))
+    return {"batch_pets_per_s": len(pets) / elapsed}
+
+
+def run(sizes, formats, queries: int, batch: int, max_distance: float, processes, workdir: str,
+        seed: int) -> dict:
+    results = []
+    pets = generate_pets(max(queries, batch), seed + 1)
+    for rows in sizes:
+        columns = generate_columns(rows, seed)
+        result = {"rows": rows, "loads": []}
+        for fmt in formats:
+            if fmt == "xlsx" and rows > XLSX_MAX_ROWS:
+                continue
+            result["loads"].append(bench_load(columns, fmt, workdir))
+        build, system = bench_build(columns)
+        result.update(build)
+        result.update(bench_queries(system, pets[:queries], max_distance))
+        result.update(bench_batch(system, pets[:batch], max_distance, processes))
+        results.append(result)
+        print(summarize(result), file=sys.stderr)
+        del system, columns
+    return {
+        "meta": {
+            "revision": _git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed": seed,
+            "max_distance": max_distance,
+            "queries": queries,
+            "batch": batch,
+            "processes": processes,
+            "peak_rss_mb": _peak_rss_mb(),
+        },
+        "results": results,
+    }
+
+
+def summarize(result: dict) -> str:
+    loads = ", ".join(f"{load['format']} {load['load_cold_s']:.2f}s cold/{load['load_warm_s']:.3f}s warm"
+                      for load in result["loads"])
+    return (f"{result['rows']:>9} doctors: {loads or 'no load'}; build {result['build_s']:.2f}s "
+            f"({result['build_peak_mb']:.0f}MB peak); query p50 {result['query_p50_ms']:.2f}ms "
+            f"p99 {result['query_p99_ms']:.2f}ms; batch {result['batch_pets_per_s']:.0f} pets/s")
+
+
+def _flatten(report: dict) -> dict:
+    metrics = {}
+    for result in report["results"]:
+        for name, value in result.items():
+            if name in LOWER_IS_BETTER or name.endswith("_per_s"):
+                metrics[(result["rows"], name)] = value
+        for load in result["loads"]:
+            for name in ("load_cold_s", "load_warm_s"):
+                metrics[(result["rows"], f"{load['format']}_{name}")] = load[name]
+    return metrics
+
+
+def compare(report: dict, baseline: dict, tolerance: float):
+    # Returns the metrics that got worse than the baseline by more than tolerance
+    regressions = []
+    current = _flatten(report)
+    for key, before in _flatten(baseline).items():
+        after = current.get(key)
+        if after is None or before <= 0:
+            continue
+        name = key[1]
+        worse = after > before * (1 + tolerance) if not name.endswith("_per_s") \
+            else after < before / (1 + tolerance)
+        if worse:
+            regressions.append((key[0], name, before, after))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loading and matching on synthetic directories")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma separated row counts, up to 10000000")
+    parser.add_argument("--formats", default="xlsx,csv")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=2000)
+    parser.add_argument("--max-distance", type=float, default=10)
+    parser.add_argument("--processes", type=int, default=1, help="batch worker processes, 0 picks automatically")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="where the generated files go, a temporary directory by default")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="a previous JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown against the baseline, as a fraction")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    formats = [fmt.strip() for fmt in args.formats.split(",") if fmt.strip()]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="vet-bench-")
+    try:
+        report = run(sizes, formats, args.queries, args.batch, args.max_distance,
+                     args.processes or None, workdir, args.seed)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for rows, name, before, after in regressions:
+            print(f"REGRESSION {rows} doctors {name}: {before:.4g} -> {after:.4g}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
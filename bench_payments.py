@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+
+import numpy as np
+
+from payment_client import AsyncPaymentClient, GatewayError
+from stub_gateway import StubGateway
+
+
+async def load_test(client: AsyncPaymentClient, requests: int, concurrency: int, duplicate_rate: float,
+                    amount: int, seed: int) -> dict:
+    # A duplicate reuses the previous charge's idempotency key, like a double-clicked Pay button
+    rng = random.Random(seed)
+    keys = []
+    for _ in range(requests):
+        keys.append(keys[-1] if keys and rng.random() < duplicate_rate else uuid.uuid4().hex)
+    pending = iter(keys)
+    latencies = []
+    outcomes = {"succeeded": 0, "declined": 0, "failed": 0}
+    payments = {}
+
+    async def worker():
+        for key in pending:
+            start = time.perf_counter()
+            try:
+                result = await client.charge(amount, "upi", None, key)
+            except GatewayError:
+                outcomes["failed"] += 1
+            else:
+                outcomes[result.status] += 1
+                payments.setdefault(key, set()).add(result.payment_id)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return dict(outcomes, requests=requests, distinct_keys=len(set(keys)), seconds=elapsed,
+                charges_per_s=requests / elapsed, p50_ms=p50, p95_ms=p95, p99_ms=p99,
+                # Must stay 0: a key that came back with two payment ids was charged twice
+                double_charged=sum(len(ids) > 1 for ids in payments.values()),
+                retries=client.retries, coalesced=client.coalesced,
+                connections_opened=client.pool.opened, connections_reused=client.pool.reused)
+
+
+async def run(args) -> dict:
+    server = gateway = None
+    url = args.url
+    if url is None:
+        gateway = StubGateway(args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate, args.lost_rate,
+                              args.seed)
+        server = await gateway.start(port=0)
+        url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    client = AsyncPaymentClient(url, pool_size=args.pool_size, backoff=args.backoff)
+    try:
+        report = await load_test(client, args.requests, args.concurrency, args.duplicate_rate, args.amount,
+                                 args.seed)
+    finally:
+        await client.close()
+        if server is not None:
+            server.close()
+    if gateway is not None:
+        report["gateway"] = dict(gateway.stats)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the payment client against a stub gateway")
+    parser.add_argument("--url", help="gateway to load, by default a StubGateway started in-process")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--pool-size", type=int, default=16)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05,
+                        help="share of charges that repeat the previous idempotency key")
+    parser.add_argument("--amount", type=int, default=39900, help="in paise")
+    parser.add_argument("--backoff", type=float, default=0.05, help="first retry delay in seconds")
+    parser.add_argument("--latency-ms", type=float, default=20, help="stub gateway latency")
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.02, help="stub gateway 503 share")
+    parser.add_argument("--lost-rate", type=float, default=0.01, help="stub gateway lost response share")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    print(f"{report['charges_per_s']:.0f} charges/s, p50 {report['p50_ms']:.1f} ms, p99 {report['p99_ms']:.1f} ms, "
+          f"{report['retries']} retries, {report['double_charged']} double charged", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import logging
+import math
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from models import Location
+from ranking import haversine_km, rank_scored, score_candidates
+from spatial_index import GridSpatialIndex
+from specializations import canonical_specialization
+
+logger = logging.getLogger("vet_system.candidate_cells")
+
+# Most searches are for these species at one of these radii, the GUI defaults to 10 km
+DEFAULT_SPECIES = ("dog", "cat")
+DEFAULT_RADII = (5.0, 10.0, 25.0)
+DEFAULT_CELL_SIZE_DEG = 0.02
+# Candidates re-ranked exactly before the bounds are checked, grows 4x until they settle it
+INITIAL_RERANK = 32
+# Larger batches of new doctors rebuild the cells instead of inserting row by row
+INCREMENTAL_LIMIT = 256
+# Candidates kept per list, deeper pages fall back to the regular ranking
+MAX_LIST_LENGTH = 64
+# Padding (km) on the cell radius so floating point noise never breaks a bound
+_PAD_KM = 1e-6
+
+Cell = Tuple[int, int]
+# (ids, score bounds, bound of the best dropped candidate or -inf when nothing was dropped)
+Group = Tuple[np.ndarray, np.ndarray, float]
+# Per cell: the species' specialists, then everyone else
+CellLists = Tuple[Group, Group]
+
+
+def _round_up(values: np.ndarray) -> np.ndarray:
+    # float32 bounds that are never below the float64 values they stand for
+    rounded = values.astype(np.float32)
+    low = rounded < values
+    rounded[low] = np.nextafter(rounded[low], np.float32(np.inf))
+    return rounded
+
+
+class CandidateCells:
+    """Pre-ranked candidate doctor ids per grid cell, species and radius preset.
+
+    A list holds every doctor that may be within the radius of some point in the
+    cell, ordered by an upper bound on the score it can reach from there. The
+    bound comes from the cell's distance error, the farthest any point in the
+    cell is from its centre. A query re-ranks the head of its cell's list
+    exactly and stops once no bound further down can still make the page.
+    """
+
+    def __init__(self, species: Sequence[str] = DEFAULT_SPECIES, radii: Sequence[float] = DEFAULT_RADII,
+                 cell_size_deg: float = DEFAULT_CELL_SIZE_DEG, max_list_length: int = MAX_LIST_LENGTH):
+        self.species = tuple(dict.fromkeys(canonical_specialization(name) for name in species))
+        self.radii = tuple(sorted(set(float(radius) for radius in radii)))
+        self.cell_size_deg = cell_size_deg
+        self.max_list_length = max_list_length
+        # Table the ids refer to and how many of its rows the lists cover
+        self.table = None
+        self.size = 0
+        # (species, radius) -> cell -> CellLists
+        self._lists: Dict[Tuple[str, float], Dict[Cell, CellLists]] = {
+            (name, radius): {} for name in self.species for radius in self.radii}
+        # cell -> distance error bound in km
+        self.error_km: Dict[Cell, float] = {}
+        self._grid = GridSpatialIndex(cell_size_deg)
+        self._lon_cells = int(math.ceil(360 / cell_size_deg))
+        # Cells are widest at the equator, so no cell's error exceeds this one's
+        self._widest_error_km = self._geometry((0, 0))[1]
+        self._lock = threading.Lock()
+
+    def like(self) -> "CandidateCells":
+        # Empty index with the same presets, for rebuilds
+        return CandidateCells(self.species, self.radii, self.cell_size_deg, self.max_list_length)
+
+    @property
+    def max_error_km(self) -> float:
+        return max(self.error_km.values(), default=0.0)
+
+    def covers(self, snapshot) -> bool:
+        return snapshot.table is self.table and self.size >= snapshot.size
+
+    def _cell(self, latitude: float, longitude: float) -> Cell:
+        return (int(math.floor(latitude / self.cell_size_deg)),
+                int(math.floor((longitude + 180) / self.cell_size_deg)) % self._lon_cells)
+
+    def _geometry(self, cell: Cell) -> Tuple[Location, float]:
+        # Centre and distance error of a cell, the farthest a point in the cell can be from the centre
+        row, col = cell
+        size = self.cell_size_deg
+        south, west = row * size, col * size - 180
+        center = Location(south + size / 2, west + size / 2)
+        corners_lat = np.radians(np.array([south, south, south + size, south + size]))
+        corners_lon = np.radians(np.array([west, west + size, west, west + size]))
+        error = haversine_km(math.radians(center.latitude), math.radians(center.longitude),
+                             corners_lat, corners_lon).max()
+        return center, float(error) + _PAD_KM
+
+    def build(self, snapshot) -> "CandidateCells":
+        """Materializes every cell that holds a live doctor of the snapshot."""
+        start = time.perf_counter()
+        table = snapshot.table
+        live = np.flatnonzero(snapshot.alive)
+        rows = np.floor(table._latitude_deg[live] / self.cell_size_deg).astype(np.int64)
+        cols = np.floor((table._longitude_deg[live] + 180) / self.cell_size_deg).astype(np.int64) % self._lon_cells
+        cells = set(zip(rows.tolist(), cols.tolist()))
+        with self._lock:
+            self.table = table
+            for cell in cells:
+                self._build_cell(snapshot, cell)
+            self.size = snapshot.size
+        logger.info("Materialized %d cells x %d species x %d radii in %.2fs", len(cells), len(self.species),
+                    len(self.radii), time.perf_counter() - start)
+        return self
+
+    def _build_cell(self, snapshot, cell: Cell):
+        table = snapshot.table
+        center, error = self._geometry(cell)
+        self.error_km[cell] = error
+        for radius in self.radii:
+            ids = snapshot.candidates(center, radius + error)
+            distances = haversine_km(math.radians(center.latitude), math.radians(center.longitude),
+                                     table._latitude[ids], table._longitude[ids])
+            reachable = distances <= radius + error
+            ids, distances = ids[reachable], distances[reachable]
+            bounds = (table._rating[ids] + np.minimum(5, table._experience[ids] * 0.2)
+                      - 0.1 * np.maximum(distances - error, 0))
+            order = np.lexsort((ids, -bounds))
+            ids, bounds = ids[order].astype(np.int32), _round_up(bounds[order])
+            for name in self.species:
+                specialist = table.specialist_mask(name, ids)
+                self._lists[(name, radius)][cell] = (self._group(ids[specialist], bounds[specialist]),
+                                                     self._group(ids[~specialist], bounds[~specialist]))
+
+    def _group(self, ids: np.ndarray, bounds: np.ndarray) -> Group:
+        keep = self.max_list_length
+        rest = float(bounds[keep]) if len(ids) > keep else -np.inf
+        # Copies, so the dropped tail of the full list is freed
+        return ids[:keep].copy(), bounds[:keep].copy(), rest
+
+    def add(self, snapshot, doctor_ids: Iterable[int]) -> bool:
+        """Inserts rows appended to the covered table, False when a rebuild is needed instead."""
+        doctor_ids = np.asarray(doctor_ids, dtype=np.intp)
+        if not len(doctor_ids):
+            return True
+        if snapshot.table is not self.table or int(doctor_ids.min()) != self.size \
+                or len(doctor_ids) > INCREMENTAL_LIMIT:
+            return False
+        table = snapshot.table
+        with self._lock:
+            reach = self.radii[-1] + self._widest_error_km
+            for doctor_id in doctor_ids.tolist():
+                latitude, longitude = float(table._latitude_deg[doctor_id]), float(table._longitude_deg[doctor_id])
+                own = self._cell(latitude, longitude)
+                if own not in self.error_km:
+                    # A doctor in a new area brings its own cell, built with the doctor already in it
+                    self._build_cell(snapshot, own)
+                for cell in self._cells_near(Location(latitude, longitude), reach):
+                    self._insert(table, cell, doctor_id)
+            self.size = max(self.size, int(doctor_ids.max()) + 1)
+        return True
+
+    def _cells_near(self, location: Location, radius_km: float) -> List[Cell]:
+        lat_min, lat_max, lon_ranges = self._grid.bounding_box(location, radius_km)
+        cells = []
+        for row in range(int(math.floor(lat_min / self.cell_size_deg)), int(math.floor(lat_max / self.cell_size_deg)) + 1):
+            for lo, hi in lon_ranges:
+                col_min = int(math.floor((lo + 180) / self.cell_size_deg))
+                col_max = min(int(math.floor((hi + 180) / self.cell_size_deg)), self._lon_cells - 1)
+                cells.extend((row, col) for col in range(col_min, col_max + 1) if (row, col) in self.error_km)
+        return cells
+
+    def _insert(self, table, cell: Cell, doctor_id: int):
+        center, error = self._geometry(cell)
+        distance = float(haversine_km(math.radians(center.latitude), math.radians(center.longitude),
+                                      table._latitude[doctor_id], table._longitude[doctor_id]))
+        if distance > self.radii[-1] + error:
+            return
+        bound = _round_up(np.array([table._rating[doctor_id] + min(5, table._experience[doctor_id] * 0.2)
+                                    - 0.1 * max(distance - error, 0)]))
+        for (name, radius), cells in self._lists.items():
+            lists = cells.get(cell)
+            if lists is None or distance > radius + error:
+                continue
+            group = 0 if table.specialist_mask(name, np.array([doctor_id]))[0] else 1
+            ids, bounds, rest = lists[group]
+            if doctor_id in ids or (rest > -np.inf and bound[0] <= rest):
+                # Either the cell was built after an earlier row of the batch added it, or
+                # it falls in the dropped tail, where only the best bound is kept
+                if doctor_id not in ids:
+                    lists = self._replace(lists, group, (ids, bounds, max(rest, float(bound[0]))))
+                    cells[cell] = lists
+                continue
+            position = int(np.searchsorted(-bounds, -bound[0], side="right"))
+            ids = np.insert(ids, position, doctor_id).astype(np.int32)
+            bounds = np.insert(bounds, position, bound[0])
+            if len(ids) > self.max_list_length:
+                rest = max(rest, float(bounds[-1]))
+                ids, bounds = ids[:-1], bounds[:-1]
+            # Readers hold either the old or the new tuple, never a half-updated one
+            cells[cell] = self._replace(lists, group, (ids, bounds, rest))
+
+    @staticmethod
+    def _replace(lists: CellLists, group: int, value: Group) -> CellLists:
+        return (value, lists[1]) if group == 0 else (lists[0], value)
+
+    def rank(self, snapshot, location, species: str, max_distance: float, limit: Optional[int] = None,
+             offset: int = 0):
+        """Same result as ranking.rank_matches, or None when no materialized list serves the query."""
+        if not self.covers(snapshot):
+            return None
+        cells = self._lists.get((canonical_specialization(species), float(max_distance)))
+        if cells is None:
+            return None
+        lists = cells.get(self._cell(float(location.latitude), float(location.longitude)))
+        if lists is None:
+            return None
+
+        stop = None if limit is None else offset + limit
+        specialists, others = lists
+        found = self._rerank(snapshot, location, max_distance, specialists, stop)
+        if found is None:
+            return None
+        ids, distances, scores = found
+        specialist = np.ones(len(ids), dtype=bool)
+        if stop is None or len(ids) < stop:
+            # Only when specialists can't fill the page, so every specialist was re-ranked
+            more = self._rerank(snapshot, location, max_distance, others,
+                                None if stop is None else stop - len(ids))
+            if more is None:
+                return None
+            ids, distances, scores = (np.concatenate(pair) for pair in zip((ids, distances, scores), more))
+            specialist = np.concatenate([specialist, np.zeros(len(more[0]), dtype=bool)])
+        return rank_scored(ids, distances, scores, specialist, limit, offset)
+
+    def _rerank(self, snapshot, location, max_distance: float, group: Group, needed: Optional[int]):
+        # Exact (ids, distances, scores) for a head of the list that provably holds the best
+        # `needed`, None when the kept part of a truncated list can't prove it
+        if needed == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0), np.empty(0)
+        ids, bounds, rest = group
+        truncated = rest > -np.inf
+        if needed is None and truncated:
+            return None
+        total = len(ids)
+        end = total if needed is None else min(total, max(INITIAL_RERANK, 2 * needed))
+        done = 0
+        found = []
+        while True:
+            head = ids[done:end].astype(np.intp)
+            # Rows newer than the snapshot, or retired in it, are not part of its directory
+            head = head[head < snapshot.size]
+            if snapshot.live_count != snapshot.size:
+                head = head[snapshot.alive[head]]
+            found.append(score_candidates(snapshot.table, location, max_distance, head))
+            done = end
+            if done >= total and not truncated:
+                break
+            scores = np.concatenate([part[2] for part in found])
+            if len(scores) >= needed:
+                kth = np.partition(scores, len(scores) - needed)[len(scores) - needed]
+                # Ties could still win on doctor id, so only a strictly lower bound ends the scan
+                if (bounds[done] if done < total else rest) < kth:
+                    break
+            if done >= total:
+                return None
+            end = min(total, end * 4)
+        return tuple(np.concatenate([part[i] for part in found]) for i in range(3))
+
+    def stats(self) -> dict:
+        groups = [group for cells in self._lists.values() for lists in cells.values() for group in lists]
+        return {
+            "cells": len(self.error_km),
+            "species": list(self.species),
+            "radii": list(self.radii),
+            "entries": sum(len(ids) for ids, _, _ in groups),
+            "truncated_lists": sum(rest > -np.inf for _, _, rest in groups),
+            "bytes": sum(ids.nbytes + bounds.nbytes for ids, bounds, _ in groups),
+            "max_error_km": self.max_error_km,
+        }
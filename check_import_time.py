@@ -0,0 +1,54 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# module -> (budget in ms, modules it must not pull in at import time)
+IMPORT_BUDGETS = {
+    "models": (100, ("numpy", "pandas", "tkinter", "PIL", "ttkthemes", "geocoder")),
+    "vet_core": (400, ("pandas", "tkinter", "PIL", "ttkthemes", "geocoder", "multiprocessing")),
+    "matching_service": (500, ("pandas", "tkinter", "PIL", "ttkthemes", "geocoder")),
+}
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{"ms": elapsed, "modules": sorted(m.split(".")[0] for m in sys.modules)}}))
+"""
+
+
+def measure(module: str, runs: int):
+    # Each run is a fresh interpreter, the fastest run is the least noisy estimate
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", _PROBE.format(module=module)], cwd=here,
+                                capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return min(result["ms"] for result in results), set(results[0]["modules"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail when importing the core modules gets slow or heavy")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=float(os.environ.get("VET_TRACKER_IMPORT_BUDGET_SCALE", 1)),
+                        help="multiply every budget, e.g. for slow CI machines")
+    args = parser.parse_args()
+
+    failed = False
+    for module, (budget_ms, forbidden) in IMPORT_BUDGETS.items():
+        elapsed, loaded = measure(module, args.runs)
+        budget = budget_ms * args.scale
+        leaked = sorted(set(forbidden) & loaded)
+        ok = elapsed <= budget and not leaked
+        failed = failed or not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {module}: {elapsed:.0f}ms (budget {budget:.0f}ms)"
+              + (f", imports {', '.join(leaked)}" if leaked else ""))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import logging
+import os
+import random
+from typing import Optional
+
+logger = logging.getLogger("vet_system")
+trace_logger = logging.getLogger("vet_system.trace")
+
+
+class TraceSampler:
+    """Logs per-doctor ranking detail for a random fraction of queries."""
+
+    def __init__(self, rate: Optional[float] = None, max_rows: int = 50):
+        if rate is None:
+            rate = float(os.environ.get("VET_TRACKER_TRACE_RATE", 0))
+        self.rate = rate
+        self.max_rows = max_rows
+
+    def should_trace(self) -> bool:
+        # Cheap checks first, so a disabled sampler costs one comparison per query
+        return (self.rate > 0
+                and trace_logger.isEnabledFor(logging.DEBUG)
+                and random.random() < self.rate)
+
+    def trace_query(self, doctors, pet, max_distance, candidates, ranked):
+        # ranked is the (ids, distances, scores, specialist) the query returned, so the logged
+        # scores carry the same distance kind and symptom/availability bonuses as the ranking
+        ids, distances, scores, specialist = (column[:self.max_rows].tolist() for column in ranked)
+        trace_logger.debug("Trace for %s (%s) at (%s, %s), radius %skm: %d candidates, %d returned",
+                           pet.name, pet.species, pet.location.latitude, pet.location.longitude,
+                           max_distance, len(candidates), len(ranked[0]))
+        for rank, (doctor_id, distance, score, is_specialist) in enumerate(zip(ids, distances, scores, specialist), 1):
+            doctor = doctors[doctor_id]
+            trace_logger.debug("  #%d %s - distance %.3fkm, score %.3f, specialist=%s, specializations %s",
+                               rank, doctor.name, distance, score, is_specialist, doctor.specializations)
+
+
+def configure_logging(level=None):
+    # Level comes from VET_TRACKER_LOG_LEVEL when not given, warnings only by default
+    level = level or os.environ.get("VET_TRACKER_LOG_LEVEL", "WARNING")
+    logging.basicConfig(level=level, format="%(asctime)s %(name)s %(levelname)s %(message)s")
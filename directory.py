@@ -0,0 +1,129 @@
+import logging
+import os
+import threading
+from collections import Counter
+from typing import List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("vet_system.directory")
+
+
+def sheet_keys(names, contacts) -> List[Tuple[str, str, int]]:
+    # Spreadsheet rows are identified by (name, contact, n), n tells apart repeated rows
+    seen = Counter()
+    keys = []
+    for name, contact in zip(names, contacts):
+        seen[(name, contact)] += 1
+        keys.append((name, contact, seen[(name, contact)]))
+    return keys
+
+
+class DirectoryView:
+    """The live doctors of one snapshot, indexable by doctor id."""
+
+    __slots__ = ("_snapshot",)
+
+    def __init__(self, snapshot: "DirectorySnapshot"):
+        self._snapshot = snapshot
+
+    def __len__(self):
+        return self._snapshot.live_count
+
+    def __getitem__(self, doctor_id):
+        return self._snapshot.table[doctor_id]
+
+    def __iter__(self):
+        snapshot = self._snapshot
+        for doctor_id in np.flatnonzero(snapshot.alive).tolist():
+            yield snapshot.table[doctor_id]
+
+    def __contains__(self, doctor_id):
+        return 0 <= doctor_id < self._snapshot.size and bool(self._snapshot.alive[doctor_id])
+
+
+class DirectorySnapshot:
+    """Immutable view of the directory at one version.
+
+    Rows are only ever appended to the table and spatial index, so a snapshot is just
+    the row count plus the alive mask at publication time.
+    """
+
+    __slots__ = ("table", "spatial_index", "size", "alive", "live_count", "version")
+
+    def __init__(self, table, spatial_index, size: int, alive: np.ndarray, live_count: int, version: int):
+        self.table = table
+        self.spatial_index = spatial_index
+        self.size = size
+        self.alive = alive
+        self.live_count = live_count
+        self.version = version
+
+    @property
+    def doctors(self) -> DirectoryView:
+        return DirectoryView(self)
+
+    def candidates(self, location, radius_km: float) -> np.ndarray:
+        ids = np.asarray(self.spatial_index.query(location, radius_km), dtype=np.intp)
+        # Rows appended after this snapshot was published are invisible to it
+        if len(ids) and ids[-1] >= self.size:
+            ids = ids[:np.searchsorted(ids, self.size)]
+        if self.live_count != self.size:
+            ids = ids[self.alive[ids]]
+        return ids
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class DirectoryWatcher:
+    """Polls a spreadsheet and applies its changes to a VetMatchingSystem."""
+
+    def __init__(self, system, path: str, interval: float = 2.0):
+        self.system = system
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_stat = self._stat()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check_now(self) -> bool:
+        # Returns True when the file changed and its diff was applied
+        stat = self._stat()
+        if stat is None or stat == self._last_stat:
+            return False
+        try:
+            self.system.reload_doctors_from_excel(self.path)
+        except Exception:
+            # Likely caught mid-save, the next poll retries
+            logger.exception("Could not apply changes from %s", self.path)
+            return False
+        self._last_stat = stat
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check_now()
+
+    def start(self) -> "DirectoryWatcher":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="vet-directory-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,230 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from models import Location, VetDoctor
+from specializations import SpecializationIndex, normalize_specializations
+from symptom_matcher import MAX_CACHED_BONUSES, SymptomWeights, list_bonus
+
+
+class DoctorRow:
+    """Read-only view of one DoctorTable row with the VetDoctor attributes."""
+
+    __slots__ = ("_table", "doctor_id")
+
+    def __init__(self, table: "DoctorTable", doctor_id: int):
+        self._table = table
+        self.doctor_id = doctor_id
+
+    @property
+    def name(self) -> str:
+        return self._table._names[self.doctor_id]
+
+    @property
+    def specializations(self) -> List[str]:
+        return list(self._table._specialization_lists[self._table._specialization_list_ids[self.doctor_id]])
+
+    @property
+    def normalized_specializations(self):
+        return self._table._normalized_lists[self._table._specialization_list_ids[self.doctor_id]]
+
+    @property
+    def experience_years(self) -> int:
+        return int(self._table._experience[self.doctor_id])
+
+    @property
+    def rating(self) -> float:
+        return float(self._table._rating[self.doctor_id])
+
+    @property
+    def location(self) -> Location:
+        return Location(float(self._table._latitude_deg[self.doctor_id]),
+                        float(self._table._longitude_deg[self.doctor_id]))
+
+    @property
+    def contact(self) -> str:
+        return self._table._contacts[self.doctor_id]
+
+    def to_doctor(self) -> VetDoctor:
+        return VetDoctor(self.name, self.specializations, self.experience_years, self.rating,
+                         self.location, self.contact)
+
+    def __eq__(self, other):
+        if isinstance(other, DoctorRow):
+            return self._table is other._table and self.doctor_id == other.doctor_id
+        if isinstance(other, VetDoctor):
+            return self.to_doctor() == other
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((id(self._table), self.doctor_id))
+
+    def __repr__(self):
+        return (f"VetDoctor(name={self.name!r}, specializations={self.specializations!r}, "
+                f"experience_years={self.experience_years!r}, rating={self.rating!r}, "
+                f"location={self.location!r}, contact={self.contact!r})")
+
+
+class DoctorTable:
+    """Struct-of-arrays doctor directory, indexable like the old list of VetDoctor.
+
+    The radian coordinates, rating and experience columns are what the vectorized
+    ranking in ranking.py reads.
+    """
+
+    _columns = ("_latitude", "_longitude", "_rating", "_experience",
+                "_latitude_deg", "_longitude_deg", "_specialization_list_ids")
+
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        self.specialization_index = SpecializationIndex()
+        self._latitude = np.empty(capacity, dtype=np.float64)
+        self._longitude = np.empty(capacity, dtype=np.float64)
+        self._rating = np.empty(capacity, dtype=np.float64)
+        self._experience = np.empty(capacity, dtype=np.float64)
+        # Degrees are kept next to the radians so row views hand back the exact loaded values
+        self._latitude_deg = np.empty(capacity, dtype=np.float64)
+        self._longitude_deg = np.empty(capacity, dtype=np.float64)
+        self._specialization_list_ids = np.empty(capacity, dtype=np.int32)
+        self._names: List[str] = []
+        self._contacts: List[str] = []
+        # Doctors with the same specialization list share one stored tuple
+        self._specialization_lists: List[Tuple[str, ...]] = []
+        self._normalized_lists = []
+        self._specialization_list_lookup: Dict[Tuple[str, ...], int] = {}
+        # Symptom weights -> bonus per specialization list id
+        self._list_bonuses: Dict[SymptomWeights, np.ndarray] = {}
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [DoctorRow(self, i) for i in range(*index.indices(self.size))]
+        index = int(index)
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("doctor index out of range")
+        return DoctorRow(self, index)
+
+    def __iter__(self):
+        return (DoctorRow(self, i) for i in range(self.size))
+
+    def __len__(self):
+        return self.size
+
+    # Views over the filled part of each column
+    @property
+    def latitude(self):
+        return self._latitude[:self.size]
+
+    @property
+    def longitude(self):
+        return self._longitude[:self.size]
+
+    @property
+    def rating(self):
+        return self._rating[:self.size]
+
+    @property
+    def experience(self):
+        return self._experience[:self.size]
+
+    def _grow(self, needed: int):
+        capacity = len(self._latitude)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in self._columns:
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def specialist_mask(self, species: str, ids: np.ndarray) -> np.ndarray:
+        return self.specialization_index.specialist_mask(species, ids)
+
+    def _specialization_list_id(self, specializations) -> int:
+        key = tuple(specializations)
+        list_id = self._specialization_list_lookup.get(key)
+        if list_id is None:
+            list_id = len(self._specialization_lists)
+            self._specialization_lists.append(key)
+            self._normalized_lists.append(normalize_specializations(key))
+            self._specialization_list_lookup[key] = list_id
+        return list_id
+
+    def symptom_bonus(self, ids, weights: SymptomWeights) -> np.ndarray:
+        # One gather through the list ids instead of one mask per weighted specialization
+        bonus = self._list_bonuses.get(weights)
+        if bonus is None or len(bonus) < len(self._normalized_lists):
+            if len(self._list_bonuses) >= MAX_CACHED_BONUSES:
+                self._list_bonuses.clear()
+            bonus = self._list_bonuses[weights] = list_bonus(self._normalized_lists, weights)
+        return bonus[self._specialization_list_ids[ids]]
+
+    def append(self, doctor) -> int:
+        self._grow(self.size + 1)
+        i = self.size
+        self._latitude[i] = np.radians(float(doctor.location.latitude))
+        self._longitude[i] = np.radians(float(doctor.location.longitude))
+        self._rating[i] = float(doctor.rating)
+        self._experience[i] = float(doctor.experience_years)
+        self._latitude_deg[i] = float(doctor.location.latitude)
+        self._longitude_deg[i] = float(doctor.location.longitude)
+        list_id = self._specialization_list_ids[i] = self._specialization_list_id(doctor.specializations)
+        self.specialization_index.add(i, self._normalized_lists[list_id])
+        self._names.append(doctor.name)
+        self._contacts.append(doctor.contact)
+        self.size += 1
+        return i
+
+    def columns(self, ids):
+        # The given rows as doctor_cache.DoctorColumns, e.g. to rebuild a compacted table
+        from doctor_cache import DoctorColumns
+        ids = np.asarray(ids, dtype=np.intp)
+        positions = ids.tolist()
+        list_ids = self._specialization_list_ids[ids].tolist()
+        return DoctorColumns(
+            names=[self._names[i] for i in positions],
+            specializations=[list(self._specialization_lists[j]) for j in list_ids],
+            contacts=[self._contacts[i] for i in positions],
+            latitude=self._latitude_deg[ids],
+            longitude=self._longitude_deg[ids],
+            rating=self._rating[ids],
+            experience=self._experience[ids].astype(np.int64),
+        )
+
+    def same_rows(self, ids, columns, positions) -> np.ndarray:
+        # Whether table rows `ids` hold the same values as `columns` rows `positions`
+        ids = np.asarray(ids, dtype=np.intp)
+        positions = np.asarray(positions, dtype=np.intp)
+        same = ((self._latitude_deg[ids] == np.asarray(columns.latitude)[positions])
+                & (self._longitude_deg[ids] == np.asarray(columns.longitude)[positions])
+                & (self._rating[ids] == np.asarray(columns.rating)[positions])
+                & (self._experience[ids] == np.asarray(columns.experience)[positions]))
+        list_ids = self._specialization_list_ids[ids].tolist()
+        for k, (list_id, position) in enumerate(zip(list_ids, positions.tolist())):
+            if same[k] and self._specialization_lists[list_id] != tuple(columns.specializations[position]):
+                same[k] = False
+        return same
+
+    def extend_columns(self, columns) -> np.ndarray:
+        # Bulk append from doctor_cache.DoctorColumns without creating VetDoctor objects
+        start = self.size
+        stop = start + len(columns.latitude)
+        self._grow(stop)
+        latitude = np.asarray(columns.latitude, dtype=np.float64)
+        longitude = np.asarray(columns.longitude, dtype=np.float64)
+        self._latitude[start:stop] = np.radians(latitude)
+        self._longitude[start:stop] = np.radians(longitude)
+        self._rating[start:stop] = np.asarray(columns.rating, dtype=np.float64)
+        self._experience[start:stop] = np.asarray(columns.experience, dtype=np.float64)
+        self._latitude_deg[start:stop] = latitude
+        self._longitude_deg[start:stop] = longitude
+        for i, names in enumerate(columns.specializations, start):
+            list_id = self._specialization_list_ids[i] = self._specialization_list_id(names)
+            self.specialization_index.add(i, self._normalized_lists[list_id])
+        self.size = stop
+        self._names.extend(columns.names)
+        self._contacts.extend(columns.contacts)
+        return np.arange(start, stop)
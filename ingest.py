@@ -0,0 +1,157 @@
+import logging
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from doctor_cache import REQUIRED_SOURCE_COLUMNS, SOURCE_COLUMNS, DoctorColumns, parse_dataframe
+
+logger = logging.getLogger("vet_system.ingest")
+
+DEFAULT_CHUNK_ROWS = 50000
+# VET_TRACKER_INGEST_PROCESSES > 1 parses spreadsheet chunks in parallel by default
+DEFAULT_PROCESSES = int(os.environ.get("VET_TRACKER_INGEST_PROCESSES", 0)) or None
+# Sample row numbers kept per column for the rejected rows report
+REPORT_SAMPLE_ROWS = 10
+
+
+@dataclass
+class IngestReport:
+    """Rows read and rejected by one ingestion, reported once instead of per row."""
+
+    rows: int = 0
+    accepted: int = 0
+    # Column -> number of rows rejected for a missing or invalid value in it
+    rejected_by_column: Dict[str, int] = field(default_factory=dict)
+    # Column -> the first few spreadsheet row numbers (header is row 1) rejected for it
+    sample_rows: Dict[str, List[int]] = field(default_factory=dict)
+
+    @property
+    def rejected(self) -> int:
+        return self.rows - self.accepted
+
+    def add(self, first_row: int, rows: int, accepted: int, invalid: Dict[str, np.ndarray]):
+        self.rows += rows
+        self.accepted += accepted
+        for column, mask in invalid.items():
+            count = int(mask.sum())
+            if not count:
+                continue
+            self.rejected_by_column[column] = self.rejected_by_column.get(column, 0) + count
+            sample = self.sample_rows.setdefault(column, [])
+            if len(sample) < REPORT_SAMPLE_ROWS:
+                positions = np.flatnonzero(mask)[:REPORT_SAMPLE_ROWS - len(sample)]
+                sample.extend((positions + first_row).tolist())
+
+    def summary(self) -> str:
+        reasons = "; ".join(
+            f"{count} with bad {column} (rows {', '.join(map(str, self.sample_rows[column]))}"
+            f"{', ...' if count > len(self.sample_rows[column]) else ''})"
+            for column, count in sorted(self.rejected_by_column.items()))
+        return f"{self.rejected} of {self.rows} rows rejected" + (f": {reasons}" if reasons else "")
+
+
+def _check_header(header: Sequence[str], path: str):
+    missing = [column for column in SOURCE_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f"{path} is missing columns: {', '.join(missing)}")
+
+
+def iter_xlsx_rows(path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[Tuple[List[str], list]]:
+    # Streams (header, rows) chunks, read-only mode never loads the whole sheet
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(name).strip() if name is not None else "" for name in next(rows, ())]
+        _check_header(header, path)
+        chunk = []
+        for row in rows:
+            # Read-only sheets report formatted but empty trailing rows as all None
+            if any(value is not None for value in row):
+                chunk.append(row)
+                if len(chunk) >= chunk_rows:
+                    yield header, chunk
+                    chunk = []
+        if chunk:
+            yield header, chunk
+    finally:
+        workbook.close()
+
+
+def iter_csv_frames(path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+    import pandas as pd
+    reader = pd.read_csv(path, chunksize=chunk_rows, dtype={"Contact": str})
+    with reader:
+        for frame in reader:
+            _check_header(list(frame.columns), path)
+            yield frame
+
+
+def parse_rows(header: List[str], rows: list):
+    import pandas as pd
+    return parse_dataframe(pd.DataFrame.from_records(rows, columns=header))
+
+
+def _parse_chunk(chunk):
+    # Runs in worker processes too, so it takes and returns only picklable values
+    if isinstance(chunk, tuple):
+        return parse_rows(*chunk)
+    return parse_dataframe(chunk)
+
+
+def _chunks(path: str, chunk_rows: int):
+    if path.lower().endswith(".csv"):
+        return iter_csv_frames(path, chunk_rows)
+    return iter_xlsx_rows(path, chunk_rows)
+
+
+def iter_doctor_chunks(path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS, processes: Optional[int] = None,
+                       report: Optional[IngestReport] = None) -> Iterator[DoctorColumns]:
+    """Parsed DoctorColumns per chunk of `path`, in file order.
+
+    processes > 1 parses chunks in a process pool while the next ones are read.
+    """
+    report = report if report is not None else IngestReport()
+    chunks = _chunks(path, chunk_rows)
+    first_row = 2
+
+    def account(rows: int, parsed):
+        nonlocal first_row
+        columns, invalid = parsed
+        report.add(first_row, rows, len(columns), {c: invalid[c] for c in REQUIRED_SOURCE_COLUMNS})
+        first_row += rows
+        return columns
+
+    if not processes or processes <= 1:
+        for chunk in chunks:
+            yield account(len(chunk[1]) if isinstance(chunk, tuple) else len(chunk), _parse_chunk(chunk))
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(processes) as pool:
+        # Bounded read-ahead keeps at most two chunks per worker in memory
+        pending = deque()
+        for chunk in chunks:
+            rows = len(chunk[1]) if isinstance(chunk, tuple) else len(chunk)
+            pending.append((rows, pool.submit(_parse_chunk, chunk)))
+            if len(pending) >= 2 * processes:
+                rows, future = pending.popleft()
+                yield account(rows, future.result())
+        while pending:
+            rows, future = pending.popleft()
+            yield account(rows, future.result())
+
+
+def read_doctor_columns(path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                        processes: Optional[int] = None) -> DoctorColumns:
+    # Whole-file DoctorColumns. Parsed chunks are staged and joined by DoctorColumns.concat, so
+    # peak memory is about twice the columns, never a DataFrame of the whole sheet
+    report = IngestReport()
+    processes = processes if processes is not None else DEFAULT_PROCESSES
+    columns = DoctorColumns.concat(iter_doctor_chunks(path, chunk_rows, processes, report))
+    if report.rejected:
+        logger.warning("%s: %s", os.path.basename(path), report.summary())
+    return columns
@@ -0,0 +1,320 @@
+import bisect
+import collections
+import io
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger("vet_system.instrumentation")
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000, 100000, 1000000)
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Monotonic Prometheus counter, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels: str):
+        with self._lock:
+            self._values[labels] += amount
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0.0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """Prometheus histogram with fixed bucket bounds, optionally split by labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = SECONDS_BUCKETS,
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def count(self, *labels: str) -> int:
+        with self._lock:
+            series = self._series.get(labels)
+            return sum(series[0]) if series else 0
+
+    def samples(self):
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="%s"' % le)
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = SECONDS_BUCKETS,
+                  labelnames: Sequence[str] = ()) -> Histogram:
+        return self._register(Histogram(name, help, buckets, labelnames))
+
+    def get(self, name: str):
+        return self._metrics[name]
+
+    def render(self) -> str:
+        # Prometheus text exposition format 0.0.4
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """Runtime-toggled profiler, either cProfile around instrumented calls or a stack sampler."""
+
+    MODES = ("cprofile", "sampling")
+
+    def __init__(self):
+        self.mode: Optional[str] = None
+        self._lock = threading.Lock()
+        self._started_at = 0.0
+        # cprofile: one cProfile.Profile per thread, merged on stop
+        self._local = threading.local()
+        self._profiles = []
+        # sampling: collapsed stack -> sample count
+        self._stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, mode: str = "sampling", interval: float = 0.005):
+        if mode not in self.MODES:
+            raise ValueError(f"unknown profiler mode {mode!r}, expected one of {', '.join(self.MODES)}")
+        with self._lock:
+            if self.mode is not None:
+                raise RuntimeError(f"{self.mode} profiler already running")
+            self.mode = mode
+            self._started_at = time.perf_counter()
+            self._profiles = []
+            self._local = threading.local()
+            self._stacks = collections.Counter()
+            if mode == "sampling":
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._sample, args=(interval,),
+                                                name="vet-profiler", daemon=True)
+                self._thread.start()
+        logger.info("Started %s profiler", mode)
+
+    def stop(self, limit: int = 40) -> str:
+        # Returns the report, pstats text for cprofile and collapsed stacks for sampling
+        with self._lock:
+            mode, self.mode = self.mode, None
+            if mode is None:
+                raise RuntimeError("profiler is not running")
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        elapsed = time.perf_counter() - self._started_at
+        logger.info("Stopped %s profiler after %.1fs", mode, elapsed)
+        if mode == "sampling":
+            return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+        return self._cprofile_report(limit)
+
+    def _cprofile_report(self, limit: int) -> str:
+        import pstats
+        profiles = [profile for profile in self._profiles if profile.getstats()]
+        if not profiles:
+            return "no instrumented calls were profiled\n"
+        out = io.StringIO()
+        stats = pstats.Stats(profiles[0], stream=out)
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+    @contextmanager
+    def profiling(self):
+        # Profiles the calling thread while inside the block, only in cprofile mode
+        profile = getattr(self._local, "profile", None)
+        if profile is None:
+            import cProfile
+            profile = self._local.profile = cProfile.Profile()
+            with self._lock:
+                self._profiles.append(profile)
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def _sample(self, interval: float):
+        own = threading.get_ident()
+        while not self._stop.wait(interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self._stacks[";".join(reversed(stack))] += 1
+
+
+class Instrumentation:
+    """Opt-in metrics for loading and matching, with a runtime profiler hook.
+
+    Disabled, callers pay one attribute check per query.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.profiler = Profiler()
+        # enabled, or a cProfile session that needs the instrumented code path
+        self.active = enabled
+        registry = self.registry = MetricsRegistry()
+
+        self.load_stage_seconds = registry.histogram(
+            "vet_load_stage_seconds", "Time spent per directory load stage", labelnames=("stage",))
+        self.load_rows = registry.counter("vet_load_rows_total", "Spreadsheet rows accepted by loads")
+        self.load_rejected_rows = registry.counter(
+            "vet_load_rejected_rows_total", "Spreadsheet rows skipped for missing or invalid values")
+        self.directory_changes = registry.counter(
+            "vet_directory_changes_total", "Doctors added, updated or removed by reloads", ("change",))
+
+        self.queries = registry.counter("vet_queries_total", "Ranking queries by cache outcome", ("cache",))
+        self.query_seconds = registry.histogram("vet_query_seconds", "End to end ranking query time")
+        self.scoring_seconds = registry.histogram(
+            "vet_query_scoring_seconds", "Time spent scoring and ordering candidates")
+        self.candidates = registry.histogram(
+            "vet_query_candidates", "Doctors scanned from the spatial index per query", COUNT_BUCKETS)
+        self.in_radius = registry.histogram(
+            "vet_query_in_radius", "Scanned doctors that were within the search radius", COUNT_BUCKETS)
+        self.results = registry.histogram("vet_query_results", "Matches returned per query", COUNT_BUCKETS)
+        self.batch_pets = registry.counter("vet_batch_pets_total", "Pets ranked through the batch API")
+        self.batch_seconds = registry.histogram("vet_batch_seconds", "Time per batch ranking call")
+
+    @classmethod
+    def from_env(cls) -> "Instrumentation":
+        # VET_TRACKER_METRICS=1 turns metrics on without code changes
+        return cls(os.environ.get("VET_TRACKER_METRICS", "").lower() in ("1", "true", "yes", "on"))
+
+    def enable(self):
+        self.enabled = self.active = True
+
+    def disable(self):
+        self.enabled = False
+        self.active = self.profiler.mode == "cprofile"
+
+    def start_profiler(self, mode: str = "sampling", interval: float = 0.005):
+        self.profiler.start(mode, interval)
+        self.active = self.enabled or mode == "cprofile"
+
+    def stop_profiler(self, limit: int = 40) -> str:
+        try:
+            return self.profiler.stop(limit)
+        finally:
+            self.active = self.enabled
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        yield
+        if self.enabled:
+            self.load_stage_seconds.observe(time.perf_counter() - start, name)
+
+    @contextmanager
+    def call(self):
+        # Wraps an instrumented call in the cProfile session when one is running
+        if self.profiler.mode == "cprofile":
+            with self.profiler.profiling():
+                yield
+        else:
+            yield
+
+    def record_load(self, rows: int, rejected: int):
+        if self.enabled:
+            self.load_rows.inc(rows)
+            self.load_rejected_rows.inc(rejected)
+
+    def record_sync(self, added: int, updated: int, removed: int):
+        if self.enabled:
+            self.directory_changes.inc(added, "added")
+            self.directory_changes.inc(updated, "updated")
+            self.directory_changes.inc(removed, "removed")
+
+    def record_query(self, stats: dict, seconds: float):
+        if not self.enabled:
+            return
+        self.queries.inc(1, stats.get("cache", "off"))
+        self.query_seconds.observe(seconds)
+        if "candidates" in stats:
+            self.candidates.observe(stats["candidates"])
+            self.in_radius.observe(stats["in_radius"])
+            self.scoring_seconds.observe(stats["scoring_seconds"])
+        self.results.observe(stats["results"])
+
+    def record_batch(self, pets: int, seconds: float):
+        if self.enabled:
+            self.batch_pets.inc(pets)
+            self.batch_seconds.observe(seconds)
+
+    def render(self) -> str:
+        return self.registry.render()
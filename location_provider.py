@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+from models import Location
+
+logger = logging.getLogger("vet_system.location")
+
+DEFAULT_LOCATION = Location(28.2487, -77.0635)
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".vet_tracker", "location.json")
+
+
+class IPLocationBackend:
+    name = "ip"
+
+    def locate(self) -> Location:
+        import geocoder
+        g = geocoder.ip('me')
+        if not g.ok:
+            raise Exception("Could not detect location")
+        return Location(g.lat, g.lng)
+
+
+class FixedLocationBackend:
+    # For tests and offline deployments
+    name = "fixed"
+
+    def __init__(self, latitude: float, longitude: float):
+        self.location = Location(latitude, longitude)
+
+    def locate(self) -> Location:
+        return self.location
+
+
+class LocationProvider:
+    """Current-location lookups with memory and disk caching and background refresh."""
+
+    def __init__(self, backend=None, ttl: float = 3600, cache_path: Optional[str] = DEFAULT_CACHE_PATH,
+                 refresh_after: float = 0.8, fallback: Location = DEFAULT_LOCATION):
+        self.backend = backend or IPLocationBackend()
+        self.ttl = ttl
+        self.cache_path = cache_path
+        # Fraction of the ttl after which a cached entry is refreshed in the background
+        self.refresh_after = refresh_after
+        self.fallback = fallback
+        self._lock = threading.Lock()
+        # Set once the background refresh in flight is done, None when there is none
+        self._refresh: Optional[threading.Event] = None
+        self._location: Optional[Location] = None
+        self._fetched_at = 0.0
+        self._load_disk_cache()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        # VET_TRACKER_LOCATION="lat,lon" pins the location, VET_TRACKER_LOCATION_TTL sets the ttl
+        # Malformed values are logged and ignored, the GUI builds its provider from here on startup
+        fixed = os.environ.get("VET_TRACKER_LOCATION")
+        if fixed:
+            try:
+                latitude, longitude = (float(part) for part in fixed.split(","))
+                if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                    raise ValueError("out of range")
+            except ValueError:
+                logger.warning("Ignoring VET_TRACKER_LOCATION=%r, expected \"latitude,longitude\"", fixed)
+            else:
+                kwargs.setdefault("backend", FixedLocationBackend(latitude, longitude))
+                kwargs.setdefault("cache_path", None)
+        ttl = os.environ.get("VET_TRACKER_LOCATION_TTL")
+        if ttl is not None:
+            try:
+                kwargs.setdefault("ttl", float(ttl))
+            except ValueError:
+                logger.warning("Ignoring VET_TRACKER_LOCATION_TTL=%r, expected seconds", ttl)
+        return cls(**kwargs)
+
+    def _load_disk_cache(self):
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path) as f:
+                entry = json.load(f)
+            if entry.get("backend") != self.backend.name:
+                return
+            self._location = Location(float(entry["latitude"]), float(entry["longitude"]))
+            self._fetched_at = float(entry["fetched_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def _save_disk_cache(self, location: Location, fetched_at: float):
+        if not self.cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"backend": self.backend.name, "latitude": location.latitude,
+                           "longitude": location.longitude, "fetched_at": fetched_at}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning("Could not write location cache: %s", e)
+
+    def _fetch(self) -> Optional[Location]:
+        try:
+            location = self.backend.locate()
+        except Exception as e:
+            logger.warning("Location lookup failed: %s", e)
+            return None
+        fetched_at = time.time()
+        with self._lock:
+            self._location = location
+            self._fetched_at = fetched_at
+        self._save_disk_cache(location, fetched_at)
+        return location
+
+    def _background_refresh(self):
+        try:
+            self._fetch()
+        finally:
+            with self._lock:
+                done, self._refresh = self._refresh, None
+            done.set()
+
+    def refresh_async(self):
+        with self._lock:
+            if self._refresh is not None:
+                return
+            self._refresh = threading.Event()
+        threading.Thread(target=self._background_refresh, name="vet-location-refresh", daemon=True).start()
+
+    def prefetch(self):
+        # Warm the cache at startup so the first search doesn't wait on the network
+        if self._location is None or time.time() - self._fetched_at >= self.refresh_after * self.ttl:
+            self.refresh_async()
+
+    def get(self) -> Tuple[Location, bool]:
+        # Returns (location, detected), detected is False when the fallback location is used
+        with self._lock:
+            location, age = self._location, time.time() - self._fetched_at
+        if location is not None and age < self.ttl:
+            if age >= self.refresh_after * self.ttl:
+                self.refresh_async()
+            return location, True
+        with self._lock:
+            pending = self._refresh
+        if pending is None:
+            location = self._fetch()
+        else:
+            # The prefetch is already asking the backend, its answer is as good as a second lookup
+            pending.wait()
+            with self._lock:
+                location = self._location if time.time() - self._fetched_at < self.ttl else None
+        if location is not None:
+            return location, True
+        if self._location is not None:
+            # Expired, but better than the fallback while the backend is unreachable
+            return self._location, True
+        return self.fallback, False
+
+    def invalidate(self):
+        with self._lock:
+            self._location = None
+            self._fetched_at = 0.0
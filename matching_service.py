@@ -0,0 +1,414 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from models import Location, Pet
+from vet_core import VetMatchingSystem
+from diagnostics import configure_logging
+from query_cache import QueryCache
+from instrumentation import Instrumentation
+from appointments import AVAILABILITY_BONUS, AppointmentInventory, HoldExpired, SlotUnavailable, doctor_key
+
+logger = logging.getLogger("vet_system.service")
+
+MAX_BODY_BYTES = 10 * 1024 * 1024
+MAX_BATCH_PETS = 10000
+KEEP_ALIVE_TIMEOUT = 15
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           408: "Request Timeout", 409: "Conflict", 410: "Gone", 413: "Payload Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def doctor_to_json(doctor, distance: float) -> dict:
+    location = doctor.location
+    return {
+        "name": doctor.name,
+        "specializations": doctor.specializations,
+        "experience_years": doctor.experience_years,
+        "rating": doctor.rating,
+        "latitude": location.latitude,
+        "longitude": location.longitude,
+        "contact": doctor.contact,
+        "distance_km": round(distance, 3),
+        # Names the doctor in the /appointments endpoints
+        "key": doctor_key(doctor),
+    }
+
+
+def _finite(value, field: str) -> float:
+    # json.loads accepts NaN, Infinity and 1e400 (which becomes inf), none of which rank
+    if isinstance(value, bool):
+        raise HTTPError(400, f"{field} must be a number")
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"{field} must be a number")
+    if not math.isfinite(value):
+        raise HTTPError(400, f"{field} must be finite")
+    return value
+
+
+def _coordinate(data: dict, field: str, bound: float) -> float:
+    if field not in data:
+        raise HTTPError(400, f"missing field '{field}'")
+    value = _finite(data[field], field)
+    if not -bound <= value <= bound:
+        raise HTTPError(400, f"{field} must be between {-bound:g} and {bound:g}")
+    return value
+
+
+def pet_from_json(data) -> Pet:
+    if not isinstance(data, dict):
+        raise HTTPError(400, "pet must be an object")
+    location = Location(_coordinate(data, "latitude", 90), _coordinate(data, "longitude", 180))
+    try:
+        return Pet(
+            name=str(data.get("name", "")),
+            species=str(data["species"]),
+            age=float(data.get("age", 0)),
+            weight=float(data.get("weight", 0)),
+            symptoms=list(data.get("symptoms", [])),
+            medical_history=list(data.get("medical_history", [])),
+            location=location
+        )
+    except KeyError as e:
+        raise HTTPError(400, f"missing field {e}")
+    except (TypeError, ValueError) as e:
+        raise HTTPError(400, f"invalid pet: {e}")
+
+
+def _max_distance(body: dict) -> float:
+    max_distance = _finite(body.get("max_distance", 10), "max_distance")
+    if max_distance <= 0:
+        raise HTTPError(400, "max_distance must be greater than 0")
+    return max_distance
+
+
+def _limit(body: dict) -> Optional[int]:
+    limit = body.get("limit")
+    if limit is None:
+        return None
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 0:
+        raise HTTPError(400, "limit must be a non-negative integer")
+    return limit
+
+
+def _offset(body: dict) -> int:
+    offset = body.get("offset", 0)
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        raise HTTPError(400, "offset must be a non-negative integer")
+    return offset
+
+
+def _available_within(body: dict) -> Optional[float]:
+    within = body.get("available_within")
+    if within is None:
+        return None
+    if not isinstance(within, (int, float)) or isinstance(within, bool) or not 0 <= within < math.inf:
+        raise HTTPError(400, "available_within must be a non-negative number of seconds")
+    return float(within)
+
+
+def _string(body: dict, field: str) -> str:
+    value = body.get(field)
+    if not isinstance(value, str) or not value:
+        raise HTTPError(400, f"{field} must be a non-empty string")
+    return value
+
+
+class MatchingService:
+    """Headless HTTP/1.1 front end for VetMatchingSystem."""
+
+    def __init__(self, system: VetMatchingSystem, workers: Optional[int] = None):
+        self.system = system
+        # Ranking is mostly NumPy work that releases the GIL, so threads scale across cores
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4,
+                                           thread_name_prefix="vet-match")
+        self.routes = {
+            ("GET", "/health"): self.handle_health,
+            ("GET", "/cache"): self.handle_cache_stats,
+            ("GET", "/metrics"): self.handle_metrics,
+            ("POST", "/profile"): self.handle_profile,
+            ("POST", "/match"): self.handle_match,
+            ("POST", "/match/batch"): self.handle_batch_match,
+            ("POST", "/appointments/slots"): self.handle_slots,
+            ("POST", "/appointments/hold"): self.handle_hold,
+            ("POST", "/appointments/confirm"): self.handle_confirm,
+            ("POST", "/appointments/release"): self.handle_release,
+        }
+
+    # Endpoint handlers, each returns a JSON-serializable payload
+
+    async def handle_health(self, body):
+        snapshot = self.system.snapshot
+        return {"status": "ok", "doctors": self.system.doctor_count, "version": snapshot.version}
+
+    async def handle_cache_stats(self, body):
+        cache = self.system.query_cache
+        return cache.stats() if cache is not None else {"enabled": False}
+
+    async def handle_metrics(self, body):
+        # Prometheus text format, served as plain text rather than JSON
+        return self.system.instrumentation.render()
+
+    async def handle_profile(self, body):
+        # {"mode": "sampling" | "cprofile"} starts a profiler, {"mode": "off"} stops it and returns the report
+        instrumentation = self.system.instrumentation
+        mode = body.get("mode", "sampling")
+        try:
+            if mode == "off":
+                return instrumentation.stop_profiler()
+            interval = float(body.get("interval", 0.005))
+            instrumentation.start_profiler(mode, interval)
+        except (TypeError, ValueError, RuntimeError) as e:
+            raise HTTPError(400, str(e))
+        return {"profiling": mode}
+
+    def _match(self, pet: Pet, max_distance: float, limit: Optional[int], offset: int,
+               available_within: Optional[float] = None):
+        if available_within is not None and not self.system.filters_availability:
+            raise HTTPError(400, "available_within needs appointments and an in-memory directory")
+        matches = self.system.rank_doctors(pet, max_distance, limit, offset, available_within)
+        return [doctor_to_json(match.doctor, match.distance) for match in matches]
+
+    def _batch_match(self, pets, max_distance: float, limit: Optional[int], offset: int):
+        return [[doctor_to_json(match.doctor, match.distance) for match in matches]
+                for _, matches in self.system.rank_doctors_batch(pets, max_distance, limit, offset, processes=1)]
+
+    async def handle_match(self, body):
+        pet = pet_from_json(body.get("pet", body))
+        loop = asyncio.get_running_loop()
+        doctors = await loop.run_in_executor(self.executor, self._match, pet,
+                                             _max_distance(body), _limit(body), _offset(body),
+                                             _available_within(body))
+        return {"doctors": doctors}
+
+    async def handle_batch_match(self, body):
+        pets = body.get("pets")
+        if not isinstance(pets, list):
+            raise HTTPError(400, "pets must be a list")
+        if len(pets) > MAX_BATCH_PETS:
+            raise HTTPError(413, f"at most {MAX_BATCH_PETS} pets per batch")
+        pets = [pet_from_json(pet) for pet in pets]
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(self.executor, self._batch_match, pets,
+                                             _max_distance(body), _limit(body), _offset(body))
+        return {"results": results}
+
+    # Appointment handlers only take per-doctor locks and never touch the disk, so they run on the loop
+
+    def _appointments(self) -> AppointmentInventory:
+        if self.system.appointments is None:
+            raise HTTPError(404, "appointments are not enabled")
+        return self.system.appointments
+
+    async def handle_slots(self, body):
+        after = body.get("after")
+        if after is not None and not isinstance(after, (int, float)):
+            raise HTTPError(400, "after must be a timestamp")
+        limit = _limit(body)
+        slots = self._appointments().free_slots(_string(body, "doctor"), after, 20 if limit is None else limit)
+        return {"slots": slots}
+
+    async def handle_hold(self, body):
+        # {"doctor": key, "start": timestamp} holds that slot, without start the doctor's next free one
+        inventory = self._appointments()
+        doctor = _string(body, "doctor")
+        start = body.get("start")
+        customer = body.get("customer")
+        try:
+            if start is None:
+                hold = inventory.hold_next(doctor, customer=customer)
+            elif isinstance(start, int):
+                hold = inventory.hold(doctor, start, customer)
+            else:
+                raise HTTPError(400, "start must be an integer timestamp")
+        except SlotUnavailable as e:
+            raise HTTPError(409, str(e))
+        return {"hold": hold.hold_id, "doctor": hold.doctor, "start": hold.start, "expires_at": hold.expires_at}
+
+    async def handle_confirm(self, body):
+        try:
+            booking = self._appointments().confirm(_string(body, "hold"), body.get("customer"))
+        except HoldExpired as e:
+            raise HTTPError(410, str(e))
+        return {"booking": booking.booking_id, "doctor": booking.doctor, "start": booking.start}
+
+    async def handle_release(self, body):
+        return {"released": self._appointments().release(_string(body, "hold"))}
+
+    # HTTP plumbing
+
+    @staticmethod
+    async def read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, dict, bytes]]:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(413, "headers too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "malformed request line")
+        headers = {"_version": version}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            raise HTTPError(400, "Content-Length must be a number")
+        if length < 0:
+            raise HTTPError(400, "Content-Length must not be negative")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, "body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, target.split("?", 1)[0], headers, body
+
+    @staticmethod
+    def keep_alive(headers: dict) -> bool:
+        connection = headers.get("connection", "").lower()
+        if headers.get("_version") == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    @staticmethod
+    def write_response(writer: asyncio.StreamWriter, status: int, payload, keep_alive: bool):
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        writer.write((
+            f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        ).encode("latin-1") + body)
+
+    async def dispatch(self, method: str, path: str, body: bytes):
+        handler = self.routes.get((method, path))
+        if handler is None:
+            if any(route_path == path for _, route_path in self.routes):
+                raise HTTPError(405, "method not allowed")
+            raise HTTPError(404, "not found")
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            raise HTTPError(400, "body must be JSON")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "body must be a JSON object")
+        return await handler(data)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await self.read_request(reader)
+                    if request is None:
+                        break
+                    method, path, headers, body = request
+                    keep_alive = self.keep_alive(headers)
+                    status, payload = 200, await self.dispatch(method, path, body)
+                except HTTPError as e:
+                    # Errors before the body was read leave keep_alive off, as framing may be broken
+                    status, payload = e.status, {"error": str(e)}
+                except Exception:
+                    logger.exception("Unhandled error serving request")
+                    status, payload, keep_alive = 500, {"error": "internal error"}, False
+                self.write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080):
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        logger.info("Matching service listening on %s", ", ".join(
+            str(sock.getsockname()) for sock in server.sockets))
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless veterinary doctor matching service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--database", default="vets_database.xlsx")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache-size", type=int, default=4096,
+                        help="cached search results, 0 disables the cache")
+    parser.add_argument("--cache-ttl", type=float, default=300)
+    parser.add_argument("--metrics", action="store_true",
+                        help="collect metrics for GET /metrics, also enabled by VET_TRACKER_METRICS")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="rank in this many shard worker processes, 0 ranks in-process")
+    parser.add_argument("--travel-table", metavar="NPZ",
+                        help="rank by road distance from a table built with road_graph.py")
+    parser.add_argument("--cells", metavar="RADII",
+                        help="precompute candidates per grid cell for these comma separated radii, e.g. 5,10,25")
+    parser.add_argument("--cell-species", default="dog,cat",
+                        help="comma separated species the --cells lists are built for")
+    parser.add_argument("--watch", type=float, default=0, metavar="SECONDS",
+                        help="poll the database for changes at this interval, 0 disables")
+    parser.add_argument("--appointments", metavar="DB",
+                        help="serve appointment slots from this SQLite file, see appointments.py")
+    parser.add_argument("--availability-boost", type=float, default=AVAILABILITY_BONUS,
+                        help="score points for doctors with a free slot in the next day, 0 ranks without")
+    args = parser.parse_args()
+
+    configure_logging(os.environ.get("VET_TRACKER_LOG_LEVEL", "INFO"))
+    query_cache = QueryCache(args.cache_size, args.cache_ttl) if args.cache_size > 0 else None
+    instrumentation = Instrumentation(enabled=True) if args.metrics else None
+    system = VetMatchingSystem(args.database, query_cache, instrumentation)
+    if system.load_error is not None:
+        raise SystemExit(f"Could not load doctors database: {system.load_error}")
+    if args.travel_table:
+        from road_graph import TravelTable
+        try:
+            system.use_travel_table(TravelTable.load(args.travel_table, system.snapshot.table))
+        except ValueError as e:
+            raise SystemExit(f"Could not use travel table: {e}")
+    if args.shards > 0:
+        system.enable_sharding(args.shards)
+    if args.cells:
+        try:
+            radii = [float(radius) for radius in args.cells.split(",")]
+        except ValueError:
+            raise SystemExit(f"--cells expects comma separated radii in km, got {args.cells!r}")
+        system.enable_candidate_cells(args.cell_species.split(","), radii)
+    if args.watch > 0:
+        system.watch_database(args.database, args.watch)
+    if args.appointments:
+        system.use_appointments(AppointmentInventory(args.appointments), args.availability_boost)
+    service = MatchingService(system, args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        system.disable_sharding()
+        if system.appointments is not None:
+            system.appointments.close()
+
+
+if __name__ == "__main__":
+    main()
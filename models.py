@@ -0,0 +1,61 @@
+from dataclasses import dataclass
+from typing import List
+import math
+from specializations import normalize_specializations
+
+@dataclass
+class Location:
+    __slots__ = ('latitude', 'longitude')
+
+    latitude: float
+    longitude: float
+
+    def distance_to(self, other: 'Location') -> float:
+        R = 6371
+        lat1, lon1 = math.radians(float(self.latitude)), math.radians(float(self.longitude))
+        lat2, lon2 = math.radians(float(other.latitude)), math.radians(float(other.longitude))
+        
+        dlat = lat2 - lat1
+        dlon = lon2 - lon1
+        
+        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+        return R * c
+
+@dataclass
+class Pet:
+    __slots__ = ('name', 'species', 'age', 'weight', 'symptoms', 'medical_history', 'location')
+
+    name: str
+    species: str
+    age: float
+    weight: float
+    symptoms: List[str]
+    medical_history: List[str]
+    location: Location
+
+@dataclass
+class VetDoctor:
+    # normalized_specializations is derived in __post_init__, so it is a slot but not a field
+    __slots__ = ('name', 'specializations', 'experience_years', 'rating', 'location', 'contact',
+                 'normalized_specializations')
+
+    name: str
+    specializations: List[str]
+    experience_years: int
+    rating: float
+    location: Location
+    contact: str
+
+    def __post_init__(self):
+        self.normalized_specializations = normalize_specializations(self.specializations)
+
+@dataclass
+class DoctorMatch:
+    # One ranked result, carrying the values computed while ranking
+    __slots__ = ('doctor', 'distance', 'score', 'is_specialist')
+
+    doctor: VetDoctor
+    distance: float
+    score: float
+    is_specialist: bool
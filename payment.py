@@ -1,19 +1,39 @@
+import os
+import uuid
 import tkinter as tk
 from tkinter import ttk, messagebox
 from ttkthemes import ThemedTk
-from PIL import Image, ImageTk
-import webbrowser
+from payment_client import GatewayError, PaymentWorker
+
+# In paise, ₹399
+BOOKING_AMOUNT = 39900
+PAYMENT_POLL_MS = 50
 
 class PaymentGUI:
-    def __init__(self, root):
+    # One window per app: show() reuses it, closing only hides it
+    def __init__(self, root, payments=None, amount=BOOKING_AMOUNT, on_paid=None, on_cancel=None):
         self.root = root
         self.root.title("Payment Gateway")
         self.root.geometry("600x700")
         self.root.configure(bg="#f0f0f0")
+        self.root.protocol("WM_DELETE_WINDOW", self.hide)
+        # PaymentWorker the charges go through, on_paid(result) runs in Tk once one succeeds.
+        # Without VET_TRACKER_PAYMENT_GATEWAY it serves a stub gateway itself, see README.md
+        self.payments = payments or PaymentWorker(os.environ.get("VET_TRACKER_PAYMENT_GATEWAY") or None)
+        self.amount = amount
+        self.on_paid = on_paid
+        self.on_cancel = on_cancel
+        self.pending_payment = None
+        self.paid = False
+        # One key per charge request, so a double click or a retry can't charge twice
+        self.idempotency_key = uuid.uuid4().hex
+        # (method, details) the key was used for, None once its outcome is known
+        self.key_request = None
         
-        # Configure style
+        # Configure style, the main window may already use the theme
         self.style = ttk.Style(self.root)
-        self.style.theme_use("arc")
+        if self.style.theme_use() != "arc":
+            self.style.theme_use("arc")
         self.style.configure("Accent.TButton", 
                            font=("Helvetica", 12, "bold"), 
                            background="#4CAF50", 
@@ -28,6 +48,36 @@ class PaymentGUI:
         self.create_header()
         self.create_payment_details()
         self.create_payment_methods()
+        self.status_label = ttk.Label(self.main_frame, text="", font=("Helvetica", 12))
+        self.status_label.grid(row=3, column=0, columnspan=2, sticky=tk.W, padx=10, pady=10)
+        
+    def show(self, amount=None, on_paid=None, on_cancel=None):
+        # Starts a new booking attempt in the existing window
+        if self.pending_payment is not None:
+            self.root.deiconify()
+            self.root.lift()
+            return
+        self.amount = amount if amount is not None else self.amount
+        self.on_paid, self.on_cancel = on_paid, on_cancel
+        self.idempotency_key = uuid.uuid4().hex
+        self.key_request = None
+        self.paid = False
+        self.amount_label.configure(text=self.amount_text())
+        self.status_label.configure(text="")
+        for entry in (self.card_number, self.expiry, self.cvv):
+            entry.delete(0, tk.END)
+        self.set_buttons_enabled(True)
+        self.root.deiconify()
+        self.root.lift()
+        
+    def hide(self):
+        # A charge in flight keeps running, its result still arrives through poll_payment
+        self.root.withdraw()
+        if not self.paid and self.pending_payment is None and self.on_cancel is not None:
+            self.on_cancel()
+        
+    def amount_text(self):
+        return f"₹ {self.amount / 100:g}/-"
         
     def create_header(self):
         # Header Frame
@@ -65,12 +115,13 @@ class PaymentGUI:
             font=("Helvetica", 14)
         ).grid(row=0, column=0, sticky=tk.W, pady=5)
         
-        ttk.Label(
+        self.amount_label = ttk.Label(
             details_frame, 
-            text="₹ 399/-", 
+            text=self.amount_text(), 
             font=("Helvetica", 14, "bold"), 
             foreground="#4CAF50"
-        ).grid(row=0, column=1, sticky=tk.W, pady=5)
+        )
+        self.amount_label.grid(row=0, column=1, sticky=tk.W, pady=5)
         
         # Service details
         ttk.Label(
@@ -111,12 +162,13 @@ class PaymentGUI:
             font=("Helvetica", 12, "bold")
         ).grid(row=0, column=0, sticky=tk.W)
         
-        ttk.Button(
+        self.upi_button = ttk.Button(
             upi_frame, 
             text="Pay with UPI", 
             style="Accent.TButton",
             command=self.pay_with_upi
-        ).grid(row=1, column=0, pady=10)
+        )
+        self.upi_button.grid(row=1, column=0, pady=10)
         
         # Card Payment
         card_frame = ttk.Frame(methods_frame, padding="10")
@@ -152,12 +204,13 @@ class PaymentGUI:
         self.cvv = ttk.Entry(card_frame, width=5, show="*")
         self.cvv.grid(row=3, column=1, sticky=tk.W, padx=5)
         
-        ttk.Button(
+        self.card_button = ttk.Button(
             card_frame, 
             text="Pay with Card", 
             style="Accent.TButton",
             command=self.pay_with_card
-        ).grid(row=4, column=0, columnspan=2, pady=10)
+        )
+        self.card_button.grid(row=4, column=0, columnspan=2, pady=10)
         
         # Net Banking
         net_banking_frame = ttk.Frame(methods_frame, padding="10")
@@ -181,46 +234,85 @@ class PaymentGUI:
         bank_dropdown.current(0)
         bank_dropdown.grid(row=1, column=0, pady=5)
         
-        ttk.Button(
+        self.netbanking_button = ttk.Button(
             net_banking_frame, 
             text="Pay with Net Banking", 
             style="Accent.TButton",
             command=self.pay_with_netbanking
-        ).grid(row=2, column=0, pady=10)
+        )
+        self.netbanking_button.grid(row=2, column=0, pady=10)
+
+    def set_buttons_enabled(self, enabled):
+        for button in (self.upi_button, self.card_button, self.netbanking_button):
+            button.state(["!disabled"] if enabled else ["disabled"])
 
     def pay_with_upi(self):
-        messagebox.showinfo(
-            "UPI Payment", 
-            "Redirecting to UPI payment gateway...\nAmount: ₹399/-"
-        )
-        # Here you would integrate with actual UPI payment gateway
+        self.start_payment("upi", {}, "Waiting for UPI approval...")
 
     def pay_with_card(self):
         if not self.card_number.get() or not self.expiry.get() or not self.cvv.get():
             messagebox.showerror("Error", "Please fill all card details")
             return
         
-        messagebox.showinfo(
-            "Card Payment", 
-            "Processing card payment...\nAmount: ₹399/-"
-        )
-        # Here you would integrate with actual card payment gateway
+        self.start_payment("card", {"card_number": self.card_number.get(), "expiry": self.expiry.get(),
+                                    "cvv": self.cvv.get()}, "Processing card payment...")
 
     def pay_with_netbanking(self):
         if self.selected_bank.get() == "Select Bank":
             messagebox.showerror("Error", "Please select a bank")
             return
         
-        messagebox.showinfo(
-            "Net Banking", 
-            f"Redirecting to {self.selected_bank.get()} payment gateway...\nAmount: ₹399/-"
-        )
-        # Here you would integrate with actual net banking gateway
+        self.start_payment("netbanking", {"bank": self.selected_bank.get()},
+                           f"Waiting for {self.selected_bank.get()}...")
+
+    def start_payment(self, method, details, status):
+        # The charge runs on the payment worker's loop, the window stays responsive meanwhile
+        if self.pending_payment is not None or self.paid:
+            return
+        request = (method, tuple(sorted(details.items())))
+        if request != self.key_request:
+            # Another method or other details make another charge, it gets its own key
+            self.idempotency_key = uuid.uuid4().hex
+            self.key_request = request
+        self.set_buttons_enabled(False)
+        self.status_label.configure(text=f"{status}\nAmount: {self.amount_text()}", foreground="")
+        self.pending_payment = self.payments.charge(self.amount, method, details, self.idempotency_key)
+        self.root.after(PAYMENT_POLL_MS, self.poll_payment)
+
+    def poll_payment(self):
+        future = self.pending_payment
+        if future is None:
+            return
+        if not future.done():
+            self.root.after(PAYMENT_POLL_MS, self.poll_payment)
+            return
+        self.pending_payment = None
+        try:
+            result = future.result()
+        except Exception as e:
+            if isinstance(e, GatewayError) and e.status is not None and 400 <= e.status < 500:
+                # Rejected outright, nothing was charged under this key
+                self.key_request = None
+            # Otherwise the outcome is unknown, paying again the same way reuses the key and can't charge twice
+            self.status_label.configure(text=f"Payment could not be completed: {e}", foreground="#d32f2f")
+            self.set_buttons_enabled(True)
+            return
+        if not result.succeeded:
+            self.key_request = None
+            self.status_label.configure(text="Payment declined, please try another method.", foreground="#d32f2f")
+            self.set_buttons_enabled(True)
+            return
+        self.paid = True
+        self.status_label.configure(text=f"Paid {self.amount_text()} (payment {result.payment_id})",
+                                    foreground="#4CAF50")
+        if self.on_paid is not None:
+            self.on_paid(result)
 
 def main():
     root = ThemedTk(theme="arc")
     app = PaymentGUI(root)
     root.mainloop()
+    app.payments.close()
 
 if __name__ == "__main__":
     main()
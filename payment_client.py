@@ -0,0 +1,305 @@
+import asyncio
+import json
+import logging
+import random
+import ssl
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("vet_system.payments")
+
+DEFAULT_GATEWAY_URL = "http://127.0.0.1:8099"
+POOL_SIZE = 8
+# Idle connections older than this are closed instead of reused, below the gateway's keep-alive timeout
+IDLE_TIMEOUT = 10
+REQUEST_TIMEOUT = 10
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.1
+BACKOFF_MAX = 2.0
+# Responses worth another attempt, the idempotency key makes retrying a charge safe
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+MAX_RESPONSE_BYTES = 1024 * 1024
+
+
+class PaymentError(Exception):
+    pass
+
+
+class GatewayError(PaymentError):
+    def __init__(self, status: Optional[int], message: str):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class PaymentResult:
+    payment_id: str
+    # "succeeded" or "declined"
+    status: str
+    # In paise
+    amount: int
+    method: str
+    idempotency_key: Optional[str]
+    # True when the gateway had already processed this idempotency key
+    replayed: bool = False
+    attempts: int = 1
+
+    @property
+    def succeeded(self) -> bool:
+        return self.status == "succeeded"
+
+    @classmethod
+    def from_json(cls, data: dict, attempts: int = 1) -> "PaymentResult":
+        return cls(data["id"], data["status"], int(data["amount"]), data["method"],
+                   data.get("idempotency_key"), bool(data.get("replayed", False)), attempts)
+
+
+class _Connection:
+    __slots__ = ("reader", "writer", "idle_since")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.idle_since = time.monotonic()
+
+
+class ConnectionPool:
+    """Keep-alive HTTP/1.1 connections to one host, at most size of them open at once.
+
+    The most recently used idle connection is reused first. A connection the
+    server closed while it sat idle fails on its next request, which callers
+    retry like any other connection error.
+    """
+
+    def __init__(self, host: str, port: int, size: int = POOL_SIZE, idle_timeout: float = IDLE_TIMEOUT,
+                 ssl_context: Optional[ssl.SSLContext] = None):
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl_context
+        self._idle: List[_Connection] = []
+        self._slots = asyncio.Semaphore(size)
+        self.opened = 0
+        self.reused = 0
+
+    async def _connection(self) -> _Connection:
+        now = time.monotonic()
+        while self._idle:
+            connection = self._idle.pop()
+            if now - connection.idle_since < self.idle_timeout and not connection.reader.at_eof():
+                self.reused += 1
+                return connection
+            connection.writer.close()
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl_context)
+        self.opened += 1
+        return _Connection(reader, writer)
+
+    async def request(self, method: str, path: str, headers: Dict[str, str], body: bytes,
+                      timeout: float = REQUEST_TIMEOUT) -> Tuple[int, bytes]:
+        async with self._slots:
+            connection = await self._connection()
+            try:
+                status, keep_alive, data = await asyncio.wait_for(
+                    self._exchange(connection, method, path, headers, body), timeout)
+            except BaseException:
+                # The stream may hold half a response, it can't be reused
+                connection.writer.close()
+                raise
+            if keep_alive:
+                connection.idle_since = time.monotonic()
+                self._idle.append(connection)
+            else:
+                connection.writer.close()
+            return status, data
+
+    async def _exchange(self, connection: _Connection, method: str, path: str, headers: Dict[str, str],
+                        body: bytes) -> Tuple[int, bool, bytes]:
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", "Connection: keep-alive",
+                f"Content-Length: {len(body)}"]
+        if body:
+            head.append("Content-Type: application/json")
+        head.extend(f"{name}: {value}" for name, value in headers.items())
+        connection.writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await connection.writer.drain()
+
+        lines = (await connection.reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        try:
+            status = int(lines[0].split(" ", 2)[1])
+        except (IndexError, ValueError):
+            raise GatewayError(None, f"malformed status line {lines[0]!r}")
+        response_headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                response_headers[name.strip().lower()] = value.strip()
+        length = int(response_headers.get("content-length", 0) or 0)
+        if length > MAX_RESPONSE_BYTES:
+            raise GatewayError(status, "response too large")
+        data = await connection.reader.readexactly(length) if length else b""
+        return status, response_headers.get("connection", "").lower() != "close", data
+
+    async def close(self):
+        while self._idle:
+            connection = self._idle.pop()
+            connection.writer.close()
+            try:
+                await connection.writer.wait_closed()
+            except (ConnectionError, ssl.SSLError):
+                pass
+
+
+class AsyncPaymentClient:
+    """Payment gateway client: pooled connections, idempotent retries and request coalescing.
+
+    Every charge carries an idempotency key, so a retry after a timeout or a 5xx
+    can't charge twice. Concurrent calls for the same charge key or payment id
+    share one in-flight request.
+    """
+
+    def __init__(self, url: str = DEFAULT_GATEWAY_URL, pool_size: int = POOL_SIZE,
+                 timeout: float = REQUEST_TIMEOUT, max_retries: int = MAX_RETRIES,
+                 backoff: float = BACKOFF_BASE, backoff_max: float = BACKOFF_MAX,
+                 api_key: Optional[str] = None):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"gateway url must be http(s)://host[:port], got {url!r}")
+        secure = parts.scheme == "https"
+        self.pool = ConnectionPool(parts.hostname, parts.port or (443 if secure else 80), pool_size,
+                                   ssl_context=ssl.create_default_context() if secure else None)
+        self.base_path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self.retries = 0
+        self.coalesced = 0
+
+    async def charge(self, amount: int, method: str, details: Optional[dict] = None,
+                     idempotency_key: Optional[str] = None) -> PaymentResult:
+        """Charges amount paise; pass the same idempotency_key to retry a charge safely later."""
+        key = idempotency_key or uuid.uuid4().hex
+        payload = {"amount": int(amount), "currency": "INR", "method": method, "details": details or {}}
+        return await self._coalesce(("charge", key), lambda: self._charge(key, payload))
+
+    async def status(self, payment_id: str) -> PaymentResult:
+        return await self._coalesce(("status", payment_id), lambda: self._status(payment_id))
+
+    async def close(self):
+        await self.pool.close()
+
+    async def _charge(self, key: str, payload: dict) -> PaymentResult:
+        status, data, attempts = await self._send("POST", "/payments", payload, {"Idempotency-Key": key})
+        if status != 200:
+            raise GatewayError(status, data.get("error", f"charge failed with HTTP {status}"))
+        return PaymentResult.from_json(data, attempts)
+
+    async def _status(self, payment_id: str) -> PaymentResult:
+        status, data, attempts = await self._send("GET", f"/payments/{payment_id}", None, {})
+        if status != 200:
+            raise GatewayError(status, data.get("error", f"status check failed with HTTP {status}"))
+        return PaymentResult.from_json(data, attempts)
+
+    async def _coalesce(self, key: tuple, start: Callable[[], Awaitable[PaymentResult]]) -> PaymentResult:
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(start())
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.coalesced += 1
+        # Shielded, so a caller giving up doesn't cancel the request for everyone else
+        return await asyncio.shield(task)
+
+    def _finished(self, key: tuple, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            # Marks the error retrieved when every waiter has gone away
+            task.exception()
+
+    async def _send(self, method: str, path: str, payload: Optional[dict],
+                    headers: Dict[str, str]) -> Tuple[int, dict, int]:
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        headers = {**self._headers, **headers}
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+                # Full jitter, so clients that failed together don't retry together
+                await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (attempt - 1))))
+            try:
+                status, data = await self.pool.request(method, self.base_path + path, headers, body, self.timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                error = GatewayError(None, f"{type(e).__name__}: {e}")
+                continue
+            try:
+                decoded = json.loads(data) if data else {}
+            except ValueError:
+                decoded = {}
+            if status not in RETRY_STATUSES:
+                return status, decoded, attempt + 1
+            error = GatewayError(status, decoded.get("error", f"HTTP {status}"))
+        logger.warning("%s %s failed after %d attempts: %s", method, path, self.max_retries + 1, error)
+        raise error
+
+
+class PaymentWorker:
+    """Runs an AsyncPaymentClient on its own event loop thread.
+
+    For callers such as the Tk GUI that must not block: calls return
+    concurrent.futures.Future objects right away.
+    """
+
+    def __init__(self, url: Optional[str] = DEFAULT_GATEWAY_URL, **client_args):
+        # url None charges against a stub_gateway.StubGateway served from this worker's own loop
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="vet-payments", daemon=True)
+        self._thread.start()
+        self.stub_server = None
+        if url is None:
+            self.stub_server = self._submit(self._start_stub()).result()
+            host, port = self.stub_server.sockets[0].getsockname()[:2]
+            url = f"http://{host}:{port}"
+            logger.warning("No payment gateway configured, charges go to a local stub at %s", url)
+        self.client = self._submit(self._create(url, client_args)).result()
+
+    @staticmethod
+    async def _start_stub() -> asyncio.AbstractServer:
+        from stub_gateway import StubGateway
+        return await StubGateway().start("127.0.0.1", 0)
+
+    @staticmethod
+    async def _stop_stub(server: asyncio.AbstractServer):
+        server.close()
+        await server.wait_closed()
+
+    @staticmethod
+    async def _create(url: str, client_args: dict) -> AsyncPaymentClient:
+        # Built on the worker's loop so the pool's primitives belong to it
+        return AsyncPaymentClient(url, **client_args)
+
+    def _submit(self, coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def charge(self, amount: int, method: str, details: Optional[dict] = None,
+               idempotency_key: Optional[str] = None) -> Future:
+        return self._submit(self.client.charge(amount, method, details, idempotency_key))
+
+    def status(self, payment_id: str) -> Future:
+        return self._submit(self.client.status(payment_id))
+
+    def close(self, timeout: float = 5):
+        if not self._thread.is_alive():
+            return
+        try:
+            self._submit(self.client.close()).result(timeout)
+            if self.stub_server is not None:
+                self._submit(self._stop_stub(self.stub_server)).result(timeout)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
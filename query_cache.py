@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from models import Location
+from spatial_index import geohash_cell_diagonal_km, geohash_encode
+from specializations import canonical_specialization
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "center", "max_distance")
+
+    def __init__(self, value, expires_at, center, max_distance):
+        self.value = value
+        self.expires_at = expires_at
+        self.center = center
+        self.max_distance = max_distance
+
+
+class QueryCache:
+    """LRU + TTL cache of ranking results keyed on geohash-quantized searches."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300, geohash_precision: int = 7):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.geohash_precision = geohash_precision
+        # Searches from anywhere in a cell share an entry, so invalidation pads radii by the cell size
+        self.cell_diagonal_km = geohash_cell_diagonal_km(geohash_precision)
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Bumped on every invalidation so results computed before it are not stored after it
+        self.generation = 0
+
+    def key(self, location, species: str, max_distance: float, *extra) -> tuple:
+        cell = geohash_encode(float(location.latitude), float(location.longitude), self.geohash_precision)
+        return (cell, canonical_specialization(species), float(max_distance)) + extra
+
+    def get(self, key) -> Optional[object]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key, value, location, max_distance: float, generation: Optional[int] = None):
+        center = Location(float(location.latitude), float(location.longitude))
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = _Entry(value, time.monotonic() + self.ttl, center, float(max_distance))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_near(self, location):
+        # Drops only the entries whose search area could include a doctor at location
+        with self._lock:
+            self.generation += 1
+            stale = [key for key, entry in self._entries.items()
+                     if entry.center.distance_to(location) <= entry.max_distance + self.cell_diagonal_km]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
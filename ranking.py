@@ -0,0 +1,107 @@
+from typing import Callable, Optional, Tuple
+import numpy as np
+
+from doctor_table import DoctorTable
+from specializations import canonical_specialization
+from symptom_matcher import SymptomWeights
+
+EARTH_RADIUS_KM = 6371
+
+
+def haversine_km(lat, lon, lats, lons):
+    # All coordinates in radians, lat/lon may be scalars or arrays broadcastable against lats/lons
+    dlat = lats - lat
+    dlon = lons - lon
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def score_candidates(arrays: DoctorTable, location, max_distance: float,
+                     ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Returns (ids, distances, scores) for the candidates that are within max_distance
+    lat = np.radians(float(location.latitude))
+    lon = np.radians(float(location.longitude))
+    distances = haversine_km(lat, lon, arrays._latitude[ids], arrays._longitude[ids])
+    in_range = distances <= max_distance
+    ids = ids[in_range]
+    distances = distances[in_range]
+    scores = (arrays._rating[ids]
+              + np.minimum(5, arrays._experience[ids] * 0.2)
+              - 0.1 * distances)
+    return ids, distances, scores
+
+
+def top_k(ids: np.ndarray, scores: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+    # Positions of the k best scores, best first, ties broken by ascending id like a stable sort
+    if k is None or k >= len(ids):
+        return np.lexsort((ids, -scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    above = np.flatnonzero(scores > threshold)
+    tied = np.flatnonzero(scores == threshold)
+    tied = tied[np.argsort(ids[tied], kind="stable")][:k - len(above)]
+    selected = np.concatenate([above, tied])
+    return selected[np.lexsort((ids[selected], -scores[selected]))]
+
+
+def order_positions(ids: np.ndarray, scores: np.ndarray, specialist: np.ndarray,
+                    limit: Optional[int] = None) -> np.ndarray:
+    # Positions of the best `limit` matches, specialists first, each group by descending score
+    spec_positions = np.flatnonzero(specialist)
+    other_positions = np.flatnonzero(~specialist)
+
+    ranked_specialists = spec_positions[top_k(ids[spec_positions], scores[spec_positions], limit)]
+    remaining = None if limit is None else max(limit - len(ranked_specialists), 0)
+    ranked_others = other_positions[top_k(ids[other_positions], scores[other_positions], remaining)]
+    return np.concatenate([ranked_specialists, ranked_others])
+
+
+def rank_matches(arrays: DoctorTable, location, species: str, max_distance: float,
+                 ids: np.ndarray, limit: Optional[int] = None, offset: int = 0,
+                 weights: SymptomWeights = (),
+                 bonus: Optional[Callable[[np.ndarray], np.ndarray]] = None):
+    # Doctor ids within max_distance, specialists first, each group by descending score, with
+    # the distances, scores and specialist flags of the ranked page. Only the best
+    # offset + limit matches are fully sorted.
+    # bonus, when given, maps the in-range ids to extra score points.
+    ids, distances, scores = score_candidates(arrays, location, max_distance, ids)
+    if weights:
+        scores = scores + arrays.symptom_bonus(ids, weights)
+    if bonus is not None:
+        scores = scores + bonus(ids)
+    return rank_scored(ids, distances, scores, arrays.specialist_mask(species, ids), limit, offset)
+
+
+def rank_scored(ids: np.ndarray, distances: np.ndarray, scores: np.ndarray, specialist: np.ndarray,
+                limit: Optional[int] = None, offset: int = 0):
+    # The ordering half of rank_matches, for callers that scored the candidates themselves
+    stop = None if limit is None else offset + limit
+    positions = order_positions(ids, scores, specialist, stop)[offset:]
+    return ids[positions], distances[positions], scores[positions], specialist[positions]
+
+
+def rank_doctors_matrix(arrays: DoctorTable, latitudes: np.ndarray, longitudes: np.ndarray,
+                        species, max_distance: float, ids: np.ndarray,
+                        limit: Optional[int] = None, weights=None):
+    # Ranks several pets at once from a (pets x candidates) distance/score matrix, returning
+    # (ids, distances, scores, specialist) per pet like rank_scored. latitudes/longitudes
+    # are the pets' coordinates in radians, weights the optional SymptomWeights per pet.
+    distances = haversine_km(latitudes[:, None], longitudes[:, None],
+                             arrays._latitude[ids][None, :], arrays._longitude[ids][None, :])
+    in_range = distances <= max_distance
+    scores = (arrays._rating[ids] + np.minimum(5, arrays._experience[ids] * 0.2)) - 0.1 * distances
+
+    masks = {}
+    rankings = []
+    for row, pet_species in enumerate(species):
+        key = canonical_specialization(pet_species)
+        if key not in masks:
+            masks[key] = arrays.specialist_mask(key, ids)
+        selected = np.flatnonzero(in_range[row])
+        row_ids = ids[selected]
+        row_scores = scores[row, selected]
+        if weights is not None and weights[row]:
+            row_scores = row_scores + arrays.symptom_bonus(row_ids, weights[row])
+        rankings.append(rank_scored(row_ids, distances[row, selected], row_scores, masks[key][selected], limit))
+    return rankings
@@ -0,0 +1,372 @@
+import argparse
+import bz2
+import gzip
+import hashlib
+import heapq
+import logging
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ranking import haversine_km, rank_scored, score_candidates
+from spatial_index import GridSpatialIndex
+from symptom_matcher import SymptomWeights
+
+logger = logging.getLogger("vet_system.road_graph")
+
+# OSM highway values that cars and pedestrians can use to reach a clinic
+ROUTABLE_HIGHWAYS = frozenset((
+    "motorway", "trunk", "primary", "secondary", "tertiary", "unclassified", "residential",
+    "motorway_link", "trunk_link", "primary_link", "secondary_link", "tertiary_link",
+    "living_street", "service", "road",
+))
+TRAVEL_TABLE_VERSION = 2
+
+
+class _Point:
+    __slots__ = ("latitude", "longitude")
+
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+def directory_fingerprint(table, doctor_count: int) -> str:
+    # Hash of the doctor rows a travel table's ids refer to, rows are never changed in place
+    digest = hashlib.sha256()
+    for doctor_id in range(doctor_count):
+        digest.update(f"{table._names[doctor_id]}|{table._contacts[doctor_id]}|"
+                      f"{table._latitude_deg[doctor_id]:.6f}|{table._longitude_deg[doctor_id]:.6f}\n"
+                      .encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _open(path: str):
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+class RoadGraph:
+    """Directed road network in CSR form, edge weights are lengths in km."""
+
+    def __init__(self, latitudes: np.ndarray, longitudes: np.ndarray, heads: np.ndarray,
+                 tails: np.ndarray, lengths: np.ndarray, cell_size_deg: float = 0.01):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self._latitude_rad = np.radians(self.latitudes)
+        self._longitude_rad = np.radians(self.longitudes)
+        # Ways that share a segment would duplicate the edge, keep the shortest copy
+        heads, tails, lengths = (np.asarray(column) for column in (heads, tails, lengths))
+        order = np.lexsort((lengths, tails, heads))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (heads[order][1:] != heads[order][:-1]) | (tails[order][1:] != tails[order][:-1])
+        heads, tails, lengths = heads[order][first], tails[order][first], lengths[order][first]
+        self.forward = self._csr(heads, tails, lengths)
+        # Edges reversed, distances to a node rather than from it
+        self.backward = self._csr(tails, heads, lengths)
+        self.node_index = GridSpatialIndex(cell_size_deg)
+        self.node_index.insert_many(np.arange(len(self.latitudes)), self.latitudes, self.longitudes)
+        self._backward_matrix = None
+        self._backward_lists = None
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def _csr(self, sources, targets, weights):
+        order = np.argsort(sources, kind="stable")
+        indptr = np.zeros(len(self.latitudes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(self.latitudes)), out=indptr[1:])
+        return indptr, np.asarray(targets)[order].astype(np.int64), np.asarray(weights)[order]
+
+    @classmethod
+    def from_osm(cls, path: str, highways=ROUTABLE_HIGHWAYS) -> "RoadGraph":
+        """Reads the routable ways of an OSM XML extract (.osm, .osm.bz2 or .osm.gz)."""
+        import xml.etree.ElementTree as ElementTree
+        node_positions: Dict[int, Tuple[float, float]] = {}
+        ways: List[Tuple[List[int], int]] = []
+        with _open(path) as f:
+            for _, element in ElementTree.iterparse(f, events=("end",)):
+                if element.tag == "node":
+                    node_positions[int(element.get("id"))] = (float(element.get("lat")), float(element.get("lon")))
+                    element.clear()
+                elif element.tag == "way":
+                    tags = {tag.get("k"): tag.get("v") for tag in element.iter("tag")}
+                    if tags.get("highway") in highways:
+                        refs = [int(nd.get("ref")) for nd in element.iter("nd")]
+                        oneway = tags.get("oneway")
+                        direction = 1 if oneway in ("yes", "true", "1") else -1 if oneway == "-1" else 0
+                        if tags.get("highway") == "motorway" and oneway is None:
+                            direction = 1
+                        ways.append((refs, direction))
+                    element.clear()
+
+        # Only nodes on routable ways become graph nodes
+        used = sorted({ref for refs, _ in ways for ref in refs if ref in node_positions})
+        numbering = {osm_id: i for i, osm_id in enumerate(used)}
+        heads, tails = [], []
+        for refs, direction in ways:
+            refs = [numbering[ref] for ref in refs if ref in numbering]
+            for a, b in zip(refs, refs[1:]):
+                if direction >= 0:
+                    heads.append(a)
+                    tails.append(b)
+                if direction <= 0:
+                    heads.append(b)
+                    tails.append(a)
+        latitudes = np.array([node_positions[osm_id][0] for osm_id in used], dtype=np.float64)
+        longitudes = np.array([node_positions[osm_id][1] for osm_id in used], dtype=np.float64)
+        heads = np.array(heads, dtype=np.int64)
+        tails = np.array(tails, dtype=np.int64)
+        lengths = haversine_km(np.radians(latitudes[heads]), np.radians(longitudes[heads]),
+                               np.radians(latitudes[tails]), np.radians(longitudes[tails]))
+        logger.info("Loaded road graph with %d nodes and %d edges from %s", len(used), len(heads), path)
+        return cls(latitudes, longitudes, heads, tails, lengths)
+
+    def nearest_node(self, latitude: float, longitude: float, max_km: float = 1.0) -> Tuple[int, float]:
+        # (node, distance km), node is -1 when no road is within max_km
+        candidates = np.asarray(self.node_index.query(_Point(latitude, longitude), max_km), dtype=np.intp)
+        if not len(candidates):
+            return -1, math.inf
+        distances = haversine_km(math.radians(latitude), math.radians(longitude),
+                                 self._latitude_rad[candidates], self._longitude_rad[candidates])
+        best = int(np.argmin(distances))
+        if distances[best] > max_km:
+            return -1, math.inf
+        return int(candidates[best]), float(distances[best])
+
+    def distances_to(self, node: int, max_km: float) -> Tuple[np.ndarray, np.ndarray]:
+        """(nodes, km) of every node that can reach `node` within max_km of road."""
+        indptr, targets, weights = self.backward
+        try:
+            from scipy.sparse import csr_matrix
+            from scipy.sparse.csgraph import dijkstra
+        except ImportError:
+            pass
+        else:
+            if self._backward_matrix is None:
+                self._backward_matrix = csr_matrix((weights, targets, indptr), shape=(len(self), len(self)))
+            distances = dijkstra(self._backward_matrix, indices=node, limit=max_km)
+            reached = np.flatnonzero(np.isfinite(distances))
+            return reached, distances[reached]
+
+        # Plain Dijkstra, bounded by max_km, over Python lists as numpy scalar access is slow here
+        if self._backward_lists is None:
+            self._backward_lists = (indptr.tolist(), targets.tolist(), weights.tolist())
+        indptr, targets, weights = self._backward_lists
+        best = {node: 0.0}
+        heap = [(0.0, node)]
+        while heap:
+            distance, current = heapq.heappop(heap)
+            if distance > best.get(current, math.inf):
+                continue
+            for edge in range(indptr[current], indptr[current + 1]):
+                neighbour = targets[edge]
+                candidate = distance + weights[edge]
+                if candidate <= max_km and candidate < best.get(neighbour, math.inf):
+                    best[neighbour] = candidate
+                    heapq.heappush(heap, (candidate, neighbour))
+        nodes = np.fromiter(best.keys(), dtype=np.int64, count=len(best))
+        return nodes, np.fromiter(best.values(), dtype=np.float64, count=len(best))
+
+
+class TravelTable:
+    """Precomputed road distances from grid cells to clinics.
+
+    Each cell of a lat/lon grid keeps, sorted by doctor id, the road distance from
+    the cell's road node to every clinic reachable within max_km. A query costs one
+    cell lookup plus a searchsorted against its haversine-filtered candidates.
+    """
+
+    def __init__(self, cell_size_deg: float, max_km: float, cell_keys: np.ndarray, cell_nodes_lat: np.ndarray,
+                 cell_nodes_lon: np.ndarray, indptr: np.ndarray, doctor_ids: np.ndarray,
+                 distances: np.ndarray, covered: np.ndarray, doctor_count: int, fingerprint: str):
+        self.cell_size_deg = cell_size_deg
+        self.max_km = max_km
+        # Sorted cell keys (row * 2**32 + col) and the road node each cell snaps to
+        self.cell_keys = cell_keys
+        self.cell_nodes_lat = cell_nodes_lat
+        self.cell_nodes_lon = cell_nodes_lon
+        self.indptr = indptr
+        self.doctor_ids = doctor_ids
+        self.distances = distances
+        # Sorted ids of the doctors that snapped onto the graph when the table was built
+        self.covered = covered
+        # Doctors in the directory when the table was built, later ones are not covered
+        self.doctor_count = doctor_count
+        # directory_fingerprint of those doctors, a table only fits the directory it was built from
+        self.fingerprint = fingerprint
+
+    def _cell_key(self, latitude: float, longitude: float) -> int:
+        row = int(math.floor(latitude / self.cell_size_deg))
+        col = int(math.floor((longitude + 180) / self.cell_size_deg))
+        return (row << 32) + col
+
+    @classmethod
+    def build(cls, graph: RoadGraph, table, doctor_ids=None, max_km: float = 30.0,
+              cell_size_deg: float = 0.01, snap_km: float = 1.0) -> "TravelTable":
+        # Cells are the grid cells that contain road nodes, each represented by its node nearest the centre
+        node_rows = np.floor(graph.latitudes / cell_size_deg).astype(np.int64)
+        node_cols = np.floor((graph.longitudes + 180) / cell_size_deg).astype(np.int64)
+        node_keys = (node_rows << 32) + node_cols
+        centre_lat = (node_rows + 0.5) * cell_size_deg
+        centre_lon = (node_cols + 0.5) * cell_size_deg - 180
+        offsets = haversine_km(np.radians(centre_lat), np.radians(centre_lon),
+                               graph._latitude_rad, graph._longitude_rad)
+        order = np.lexsort((offsets, node_keys))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = node_keys[order][1:] != node_keys[order][:-1]
+        cell_nodes = order[first]
+        cell_keys = node_keys[cell_nodes]
+        cell_of_node = np.full(len(graph), -1, dtype=np.int64)
+        cell_of_node[cell_nodes] = np.arange(len(cell_nodes))
+
+        if doctor_ids is None:
+            doctor_ids = np.arange(table.size)
+        doctor_ids = np.asarray(doctor_ids, dtype=np.int64)
+        entries_cell, entries_doctor, entries_km = [], [], []
+        covered = []
+        for doctor_id in doctor_ids.tolist():
+            node, snap = graph.nearest_node(float(table._latitude_deg[doctor_id]),
+                                            float(table._longitude_deg[doctor_id]), snap_km)
+            if node < 0:
+                continue
+            covered.append(doctor_id)
+            nodes, km = graph.distances_to(node, max_km - snap)
+            cells = cell_of_node[nodes]
+            keep = cells >= 0
+            entries_cell.append(cells[keep])
+            entries_doctor.append(np.full(int(keep.sum()), doctor_id, dtype=np.int64))
+            entries_km.append(km[keep] + snap)
+
+        cells = np.concatenate(entries_cell) if entries_cell else np.empty(0, dtype=np.int64)
+        doctors = np.concatenate(entries_doctor) if entries_doctor else np.empty(0, dtype=np.int64)
+        km = np.concatenate(entries_km) if entries_km else np.empty(0)
+        order = np.lexsort((doctors, cells))
+        indptr = np.zeros(len(cell_keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=len(cell_keys)), out=indptr[1:])
+        logger.info("Built travel table: %d clinics on the road graph, %d cells, %d entries",
+                    len(covered), len(cell_keys), len(order))
+        return cls(cell_size_deg, max_km, cell_keys, graph.latitudes[cell_nodes], graph.longitudes[cell_nodes],
+                   indptr, doctors[order], km[order].astype(np.float32),
+                   np.array(covered, dtype=np.int64), int(table.size), directory_fingerprint(table, int(table.size)))
+
+    def save(self, path: str):
+        np.savez(path, version=TRAVEL_TABLE_VERSION, cell_size_deg=self.cell_size_deg, max_km=self.max_km,
+                 cell_keys=self.cell_keys, cell_nodes_lat=self.cell_nodes_lat,
+                 cell_nodes_lon=self.cell_nodes_lon, indptr=self.indptr, doctor_ids=self.doctor_ids,
+                 distances=self.distances, covered=self.covered, doctor_count=self.doctor_count,
+                 fingerprint=self.fingerprint)
+
+    @classmethod
+    def load(cls, path: str, table) -> "TravelTable":
+        # table is the directory's DoctorTable, a file built from other doctors is refused
+        with np.load(path) as data:
+            if int(data["version"]) != TRAVEL_TABLE_VERSION:
+                raise ValueError(f"{path} was built by an incompatible version")
+            travel = cls(float(data["cell_size_deg"]), float(data["max_km"]), data["cell_keys"],
+                         data["cell_nodes_lat"], data["cell_nodes_lon"], data["indptr"], data["doctor_ids"],
+                         data["distances"], data["covered"], int(data["doctor_count"]), str(data["fingerprint"]))
+        if not travel.matches(table):
+            raise ValueError(f"{path} was built for a different doctors database")
+        return travel
+
+    def matches(self, table) -> bool:
+        return table.size >= self.doctor_count and directory_fingerprint(table, self.doctor_count) == self.fingerprint
+
+    def lookup(self, latitude: float, longitude: float) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        # (doctor ids, road km) for the cell containing the location, None outside the graph
+        key = self._cell_key(latitude, longitude)
+        cell = int(np.searchsorted(self.cell_keys, key))
+        if cell >= len(self.cell_keys) or self.cell_keys[cell] != key:
+            return None
+        # From the location to its cell's road node, then along the road
+        snap = float(haversine_km(math.radians(latitude), math.radians(longitude),
+                                  math.radians(self.cell_nodes_lat[cell]),
+                                  math.radians(self.cell_nodes_lon[cell])))
+        start, stop = self.indptr[cell], self.indptr[cell + 1]
+        return self.doctor_ids[start:stop], self.distances[start:stop] + snap
+
+    def travel_distances(self, location, ids: np.ndarray, straight_km: np.ndarray) -> Optional[np.ndarray]:
+        """Road km for `ids`, inf when unreachable within max_km.
+
+        Doctors the table does not cover (off the graph, or added after it was
+        built) keep their straight-line distance. None when the location is
+        outside the graph.
+        """
+        found = self.lookup(float(location.latitude), float(location.longitude))
+        if found is None:
+            return None
+        table_ids, table_km = found
+        travel = np.full(len(ids), np.inf)
+        if len(table_ids):
+            positions = np.minimum(np.searchsorted(table_ids, ids), len(table_ids) - 1)
+            hit = table_ids[positions] == ids
+            travel[hit] = table_km[positions[hit]]
+        covered = ids < self.doctor_count
+        if len(self.covered):
+            positions = np.minimum(np.searchsorted(self.covered, ids), len(self.covered) - 1)
+            covered &= self.covered[positions] == ids
+        else:
+            covered[:] = False
+        travel[~covered] = straight_km[~covered]
+        return travel
+
+
+def rank_matches_by_travel(arrays, travel_table: TravelTable, location, species: str, max_distance: float,
+                           ids: np.ndarray, limit: Optional[int] = None, offset: int = 0,
+                           weights: SymptomWeights = (), bonus=None):
+    """Like ranking.rank_matches, with road distance in place of the straight line.
+
+    Roads are never shorter than the straight line, so the haversine radius check
+    is an exact prefilter. Falls back to straight-line ranking outside the graph and
+    for radii beyond the table's max_km, where unreachable and untabulated look alike.
+    """
+    ids, straight, _ = score_candidates(arrays, location, max_distance, ids)
+    travel = None
+    if max_distance <= travel_table.max_km:
+        travel = travel_table.travel_distances(location, ids, straight)
+    if travel is None:
+        distances = straight
+    else:
+        reachable = travel <= max_distance
+        ids, distances = ids[reachable], travel[reachable].astype(np.float64)
+    scores = (arrays._rating[ids]
+              + np.minimum(5, arrays._experience[ids] * 0.2)
+              - 0.1 * distances)
+    if weights:
+        scores = scores + arrays.symptom_bonus(ids, weights)
+    if bonus is not None:
+        scores = scores + bonus(ids)
+    return rank_scored(ids, distances, scores, arrays.specialist_mask(species, ids), limit, offset)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute road distances from grid cells to clinics")
+    parser.add_argument("osm", help="OSM XML extract (.osm, .osm.bz2 or .osm.gz)")
+    parser.add_argument("output", help="where to write the .npz travel table")
+    parser.add_argument("--database", default="vets_database.xlsx")
+    parser.add_argument("--max-km", type=float, default=30.0)
+    parser.add_argument("--cell-size", type=float, default=0.01, help="grid cell size in degrees")
+    parser.add_argument("--snap-km", type=float, default=1.0,
+                        help="clinics farther than this from any road are left to straight-line ranking")
+    args = parser.parse_args()
+
+    from diagnostics import configure_logging
+    from vet_core import VetMatchingSystem
+    configure_logging("INFO")
+    system = VetMatchingSystem(args.database)
+    if system.load_error is not None:
+        raise SystemExit(f"Could not load doctors database: {system.load_error}")
+    snapshot = system.snapshot
+    graph = RoadGraph.from_osm(args.osm)
+    travel = TravelTable.build(graph, snapshot.table, np.flatnonzero(snapshot.alive), args.max_km,
+                               args.cell_size, args.snap_km)
+    travel.save(args.output)
+
+
+if __name__ == "__main__":
+    main()
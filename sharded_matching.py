@@ -0,0 +1,392 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+from concurrent.futures import Future, TimeoutError
+from itertools import islice
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ranking import order_positions, score_candidates
+from spatial_index import GridSpatialIndex
+from specializations import canonical_specialization
+from symptom_matcher import MAX_CACHED_BONUSES, list_bonus
+
+logger = logging.getLogger("vet_system.sharded")
+
+# Columns copied into shared memory, in shard order
+_SHARED_COLUMNS = (
+    ("doctor_id", np.int64),
+    ("latitude_deg", np.float64),
+    ("longitude_deg", np.float64),
+    ("latitude", np.float64),
+    ("longitude", np.float64),
+    ("rating", np.float64),
+    ("experience", np.float64),
+    ("list_id", np.int32),
+)
+# Queries per message to a shard, larger batches amortize the IPC round trip
+QUERIES_PER_MESSAGE = 256
+# How long rank_many waits on one shard message before giving up on the workers
+RESULT_TIMEOUT = 30.0
+# How often the monitor checks that every worker is still running
+LIVENESS_INTERVAL = 0.5
+
+# One ranked page from one shard: (doctor ids, distances, scores, specialist flags)
+Partial = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+class _Point:
+    __slots__ = ("latitude", "longitude")
+
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+class _ShardArrays:
+    # Just the DoctorTable columns score_candidates reads
+    __slots__ = ("_latitude", "_longitude", "_rating", "_experience")
+
+    def __init__(self, columns: dict):
+        self._latitude = columns["latitude"]
+        self._longitude = columns["longitude"]
+        self._rating = columns["rating"]
+        self._experience = columns["experience"]
+
+
+def _layout(count: int):
+    offset = 0
+    layout = []
+    for name, dtype in _SHARED_COLUMNS:
+        layout.append((name, offset, np.dtype(dtype).str))
+        offset += count * np.dtype(dtype).itemsize
+    return layout, max(offset, 1)
+
+
+def _views(buffer, layout, count: int, start: int = 0, stop: Optional[int] = None) -> dict:
+    stop = count if stop is None else stop
+    views = {}
+    for name, offset, dtype in layout:
+        column = np.ndarray((count,), dtype=dtype, buffer=buffer, offset=offset)
+        views[name] = column[start:stop]
+    return views
+
+
+def partition(latitudes: np.ndarray, longitudes: np.ndarray, shards: int) -> List[np.ndarray]:
+    """Splits row positions into `shards` compact regions of nearly equal size.
+
+    Recursively bisects along the wider side of the bounding box (k-d style), so
+    each shard covers one contiguous area and a query touches as few as possible.
+    """
+    def split(positions: np.ndarray, parts: int) -> List[np.ndarray]:
+        if parts == 1 or len(positions) <= 1:
+            return [positions] + [positions[:0]] * (parts - 1)
+        lat = latitudes[positions]
+        lon = longitudes[positions]
+        height = lat.max() - lat.min()
+        width = (lon.max() - lon.min()) * np.cos(np.radians(np.median(lat)))
+        order = positions[np.argsort(lon if width > height else lat, kind="stable")]
+        left = parts // 2
+        cut = len(order) * left // parts
+        return split(order[:cut], left) + split(order[cut:], parts - left)
+
+    return split(np.arange(len(latitudes), dtype=np.intp), shards)
+
+
+def _shard_worker(shm_name: str, layout, count: int, start: int, stop: int, normalized_lists,
+                  cell_size_deg: float, requests, results, shard: int):
+    from multiprocessing import shared_memory
+    # Workers share the parent's resource tracker, so only the parent's unlink releases the segment
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        _serve_shard(_views(shm.buf, layout, count, start, stop), normalized_lists, cell_size_deg,
+                     requests, results, shard)
+    finally:
+        shm.close()
+
+
+def _serve_shard(columns: dict, normalized_lists, cell_size_deg: float, requests, results, shard: int):
+    arrays = _ShardArrays(columns)
+    doctor_ids = columns["doctor_id"]
+    list_ids = columns["list_id"]
+    index = GridSpatialIndex(cell_size_deg)
+    index.insert_many(np.arange(len(doctor_ids)), columns["latitude_deg"], columns["longitude_deg"])
+    # Canonical species -> bool per specialization list id
+    species_lists = {}
+    # Symptom weights -> score bonus per specialization list id
+    bonus_lists = {}
+
+    while True:
+        message = requests.get()
+        if message is None:
+            return
+        request_id, queries, max_distance, limit = message
+        try:
+            partials = []
+            for latitude, longitude, species, weights in queries:
+                key = canonical_specialization(species)
+                has_species = species_lists.get(key)
+                if has_species is None:
+                    has_species = species_lists[key] = np.array(
+                        [key in names for names in normalized_lists] or [False], dtype=bool)
+                location = _Point(latitude, longitude)
+                positions = np.asarray(index.query(location, max_distance), dtype=np.intp)
+                positions, distances, scores = score_candidates(arrays, location, max_distance, positions)
+                if weights:
+                    bonus = bonus_lists.get(weights)
+                    if bonus is None:
+                        if len(bonus_lists) >= MAX_CACHED_BONUSES:
+                            bonus_lists.clear()
+                        bonus = bonus_lists[weights] = list_bonus(normalized_lists, weights)
+                    scores = scores + bonus[list_ids[positions]]
+                ids = doctor_ids[positions]
+                specialist = has_species[list_ids[positions]]
+                # Ties are broken on the directory-wide doctor id, like the unsharded ranking
+                ranked = order_positions(ids, scores, specialist, limit)
+                partials.append((ids[ranked], distances[ranked], scores[ranked], specialist[ranked]))
+            results.put((request_id, shard, partials, None))
+        except Exception as e:
+            results.put((request_id, shard, None, repr(e)))
+
+
+def merge_partials(partials: Sequence[Partial], limit: Optional[int] = None) -> Partial:
+    """k-way merge of per-shard rankings into the global specialists-first order."""
+    partials = [partial for partial in partials if len(partial[0])]
+    if not partials:
+        empty = np.empty(0)
+        return np.empty(0, dtype=np.int64), empty, empty, np.empty(0, dtype=bool)
+    if len(partials) == 1:
+        ids, distances, scores, specialist = partials[0]
+        return ids[:limit], distances[:limit], scores[:limit], specialist[:limit]
+
+    # Each shard's list is already sorted on (specialist first, score desc, id asc)
+    streams = [zip((~specialist).tolist(), (-scores).tolist(), ids.tolist(), distances.tolist())
+               for ids, distances, scores, specialist in partials]
+    merged = list(islice(heapq.merge(*streams), limit))
+    not_specialist, negative_scores, ids, distances = zip(*merged)
+    return (np.array(ids, dtype=np.int64), np.array(distances),
+            -np.array(negative_scores), ~np.array(not_specialist, dtype=bool))
+
+
+class ShardFailure(RuntimeError):
+    pass
+
+
+class ShardedMatcher:
+    """Ranks queries in worker processes that each own one geographic shard of a snapshot.
+
+    Coordinates, ratings and experience live in one shared memory block the workers
+    map directly. A query only goes to the shards whose area its radius overlaps.
+    The matcher serves the snapshot it was built from, build a new one after updates.
+    If a worker exits or stops answering, pending and later queries fail with
+    ShardFailure and `failed` is set, callers rank in-process and rebuild.
+    """
+
+    def __init__(self, snapshot, shards: Optional[int] = None, cell_size_deg: Optional[float] = None):
+        import multiprocessing
+        from multiprocessing import shared_memory
+
+        self.snapshot = snapshot
+        self.version = snapshot.version
+        self.shard_count = shards = max(1, shards or os.cpu_count() or 1)
+        table = snapshot.table
+        live = np.flatnonzero(snapshot.alive)
+
+        latitude_deg = table._latitude_deg[live]
+        longitude_deg = table._longitude_deg[live]
+        parts = partition(latitude_deg, longitude_deg, shards)
+        order = live[np.concatenate(parts)] if len(live) else live
+        count = len(order)
+
+        layout, size = _layout(count)
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        columns = _views(self._shm.buf, layout, count)
+        columns["doctor_id"][:] = order
+        columns["latitude_deg"][:] = table._latitude_deg[order]
+        columns["longitude_deg"][:] = table._longitude_deg[order]
+        columns["latitude"][:] = table._latitude[order]
+        columns["longitude"][:] = table._longitude[order]
+        columns["rating"][:] = table._rating[order]
+        columns["experience"][:] = table._experience[order]
+        columns["list_id"][:] = table._specialization_list_ids[order]
+        del columns
+
+        # Bounding box per shard for routing: (lat_min, lat_max, lon_min, lon_max), None when empty
+        self.bounds = []
+        bounds_start = 0
+        self._ranges = []
+        for part in parts:
+            stop = bounds_start + len(part)
+            self._ranges.append((bounds_start, stop))
+            if len(part):
+                lat, lon = latitude_deg[part], longitude_deg[part]
+                self.bounds.append((lat.min(), lat.max(), lon.min(), lon.max()))
+            else:
+                self.bounds.append(None)
+            bounds_start = stop
+
+        cell_size_deg = cell_size_deg or snapshot.spatial_index.cell_size_deg
+        self._router = GridSpatialIndex(cell_size_deg)
+        normalized_lists = list(table._normalized_lists)
+        context = multiprocessing.get_context()
+        self._results = context.Queue()
+        self._requests = []
+        self._workers = []
+        for shard, (start, stop) in enumerate(self._ranges):
+            requests = context.Queue()
+            worker = context.Process(
+                target=_shard_worker, name=f"vet-shard-{shard}", daemon=True,
+                args=(self._shm.name, layout, count, start, stop, normalized_lists, cell_size_deg,
+                      requests, self._results, shard))
+            worker.start()
+            self._requests.append(requests)
+            self._workers.append(worker)
+
+        # Guards _pending, _closed and failed, so submitting and closing or failing can't interleave
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._request_ids = itertools.count()
+        self._closed = False
+        self.failed = None
+        self._collector = threading.Thread(target=self._collect, name="vet-shard-results", daemon=True)
+        self._collector.start()
+        self._monitor = threading.Thread(target=self._watch_workers, name="vet-shard-monitor", daemon=True)
+        self._monitor.start()
+        logger.info("Started %d shard workers over %d doctors", shards, count)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _collect(self):
+        while True:
+            message = self._results.get()
+            if message is None:
+                return
+            request_id, shard, partials, error = message
+            with self._pending_lock:
+                future = self._pending.pop((request_id, shard), None)
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(ShardFailure(f"shard {shard} failed: {error}"))
+            else:
+                future.set_result(partials)
+
+    def _watch_workers(self):
+        from multiprocessing.connection import wait
+        sentinels = {worker.sentinel: shard for shard, worker in enumerate(self._workers)}
+        while not self._closed:
+            exited = wait(list(sentinels), LIVENESS_INTERVAL)
+            if exited and not self._closed:
+                shard = sentinels[exited[0]]
+                worker = self._workers[shard]
+                # Reaps it, so exitcode is known
+                worker.join(1)
+                self._fail(f"shard worker {shard} exited with code {worker.exitcode}")
+                return
+
+    def _fail(self, reason: str):
+        # Fails every pending query, later ones fail in _submit
+        with self._pending_lock:
+            if self.failed is not None or self._closed:
+                return
+            self.failed = reason
+            pending, self._pending = self._pending, {}
+        logger.error("Sharded matcher failed: %s", reason)
+        for future in pending.values():
+            future.set_exception(ShardFailure(reason))
+
+    def shards_for(self, latitude: float, longitude: float, max_distance: float) -> List[int]:
+        # Shards whose bounding box intersects the query's bounding box
+        lat_min, lat_max, lon_ranges = self._router.bounding_box(_Point(latitude, longitude), max_distance)
+        selected = []
+        for shard, bounds in enumerate(self.bounds):
+            if bounds is None:
+                continue
+            shard_lat_min, shard_lat_max, shard_lon_min, shard_lon_max = bounds
+            if shard_lat_max < lat_min or shard_lat_min > lat_max:
+                continue
+            if any(shard_lon_max >= lo and shard_lon_min <= hi for lo, hi in lon_ranges):
+                selected.append(shard)
+        return selected
+
+    def _submit(self, shard: int, queries, max_distance: float, limit: Optional[int]) -> Future:
+        future = Future()
+        with self._pending_lock:
+            if self._closed:
+                raise ShardFailure("matcher is closed")
+            if self.failed is not None:
+                raise ShardFailure(self.failed)
+            request_id = next(self._request_ids)
+            self._pending[(request_id, shard)] = future
+            self._requests[shard].put((request_id, queries, max_distance, limit))
+        return future
+
+    def rank_many(self, pets: Iterable, max_distance: float, limit: Optional[int] = None,
+                  weights: Optional[Sequence] = None, timeout: float = RESULT_TIMEOUT) -> List[Partial]:
+        """(ids, distances, scores, specialist) per pet, in the order of rank_matches.
+
+        weights, when given, holds the SymptomWeights of each pet. Raises ShardFailure
+        when a worker has died or a shard takes longer than timeout seconds.
+        """
+        pets = list(pets)
+        weights = weights if weights is not None else [()] * len(pets)
+        queries = [(float(pet.location.latitude), float(pet.location.longitude), pet.species, pet_weights)
+                   for pet, pet_weights in zip(pets, weights)]
+        # Per shard, the query positions it serves, so each shard gets a few large messages
+        routed = [[] for _ in self._workers]
+        routes = []
+        for position, (latitude, longitude, _, _) in enumerate(queries):
+            shards = self.shards_for(latitude, longitude, max_distance)
+            routes.append(shards)
+            for shard in shards:
+                routed[shard].append(position)
+
+        futures = []
+        for shard, positions in enumerate(routed):
+            for start in range(0, len(positions), QUERIES_PER_MESSAGE):
+                block = positions[start:start + QUERIES_PER_MESSAGE]
+                futures.append((shard, block, self._submit(shard, [queries[i] for i in block],
+                                                           max_distance, limit)))
+
+        partials = [dict() for _ in queries]
+        for shard, block, future in futures:
+            try:
+                results = future.result(timeout)
+            except TimeoutError:
+                # A worker that is alive but stuck is as unusable as a dead one
+                self._fail(f"shard {shard} did not answer within {timeout}s")
+                raise ShardFailure(f"shard {shard} did not answer within {timeout}s")
+            for position, partial in zip(block, results):
+                partials[position][shard] = partial
+        return [merge_partials([found[shard] for shard in shards], limit)
+                for found, shards in zip(partials, routes)]
+
+    def rank(self, pet, max_distance: float, limit: Optional[int] = None, weights=()) -> Partial:
+        return self.rank_many([pet], max_distance, limit, [weights])[0]
+
+    def close(self):
+        with self._pending_lock:
+            if self._closed:
+                return
+            self._closed = True
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(ShardFailure("matcher closed"))
+        self._monitor.join()
+        for requests in self._requests:
+            requests.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self._results.put(None)
+        self._collector.join()
+        self._shm.close()
+        self._shm.unlink()
@@ -0,0 +1,141 @@
+import math
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+
+# Padding (radians) so floating point noise never prunes a doctor that sits exactly on the radius
+_EPSILON = 1e-9
+
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(latitude: float, longitude: float, precision: int = 7) -> str:
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bit = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, starting with longitude
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_GEOHASH_ALPHABET[value])
+            bit = 0
+            value = 0
+    return "".join(chars)
+
+
+def geohash_cell_diagonal_km(precision: int) -> float:
+    # Upper bound on the distance between two points in one geohash cell (cells are widest at the equator)
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    height = math.radians(180 / 2 ** lat_bits) * EARTH_RADIUS_KM
+    width = math.radians(360 / 2 ** lon_bits) * EARTH_RADIUS_KM
+    return math.hypot(height, width)
+
+
+class GridSpatialIndex:
+    """Uniform latitude/longitude grid over doctor ids."""
+
+    def __init__(self, cell_size_deg: float = 0.1):
+        self.cell_size_deg = cell_size_deg
+        self.cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        self._lon_cells = int(math.ceil(360 / cell_size_deg))
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        row = int(math.floor(latitude / self.cell_size_deg))
+        col = int(math.floor((longitude + 180) / self.cell_size_deg)) % self._lon_cells
+        return row, col
+
+    def insert(self, doctor_id: int, location) -> None:
+        self.cells[self._cell(float(location.latitude), float(location.longitude))].append(doctor_id)
+        self._size += 1
+
+    def insert_many(self, doctor_ids, latitudes, longitudes) -> None:
+        rows = np.floor(np.asarray(latitudes, dtype=np.float64) / self.cell_size_deg).astype(np.int64)
+        cols = np.floor((np.asarray(longitudes, dtype=np.float64) + 180) / self.cell_size_deg).astype(np.int64)
+        cols %= self._lon_cells
+        for doctor_id, row, col in zip(np.asarray(doctor_ids).tolist(), rows.tolist(), cols.tolist()):
+            self.cells[(row, col)].append(doctor_id)
+        self._size += len(rows)
+
+    def clear(self) -> None:
+        self.cells.clear()
+        self._size = 0
+
+    def bounding_box(self, location, radius_km: float):
+        # Returns (lat_min, lat_max, lon_ranges) in degrees, lon_ranges is a list of (lo, hi)
+        lat = math.radians(float(location.latitude))
+        lon = math.radians(float(location.longitude))
+        angular = max(radius_km, 0) / EARTH_RADIUS_KM + _EPSILON
+
+        lat_min = lat - angular
+        lat_max = lat + angular
+        if lat_min <= -math.pi / 2 or lat_max >= math.pi / 2 or angular >= math.pi / 2:
+            # The circle covers a pole, so every longitude is reachable
+            lat_min = max(lat_min, -math.pi / 2)
+            lat_max = min(lat_max, math.pi / 2)
+            return math.degrees(lat_min), math.degrees(lat_max), [(-180.0, 180.0)]
+
+        ratio = math.sin(angular) / math.cos(lat)
+        if ratio >= 1:
+            return math.degrees(lat_min), math.degrees(lat_max), [(-180.0, 180.0)]
+        dlon = math.asin(ratio) + _EPSILON
+        lon_min = math.degrees(lon - dlon)
+        lon_max = math.degrees(lon + dlon)
+
+        # Split boxes that cross the antimeridian
+        if lon_min < -180:
+            lon_ranges = [(lon_min + 360, 180.0), (-180.0, lon_max)]
+        elif lon_max > 180:
+            lon_ranges = [(lon_min, 180.0), (-180.0, lon_max - 360)]
+        else:
+            lon_ranges = [(lon_min, lon_max)]
+        return math.degrees(lat_min), math.degrees(lat_max), lon_ranges
+
+    def query(self, location, radius_km: float) -> List[int]:
+        # Candidate ids that may lie within radius_km, in insertion order
+        lat_min, lat_max, lon_ranges = self.bounding_box(location, radius_km)
+        row_min = int(math.floor(lat_min / self.cell_size_deg))
+        row_max = int(math.floor(lat_max / self.cell_size_deg))
+
+        cols = set()
+        for lo, hi in lon_ranges:
+            col_min = int(math.floor((lo + 180) / self.cell_size_deg))
+            col_max = min(int(math.floor((hi + 180) / self.cell_size_deg)), self._lon_cells - 1)
+            cols.update(range(col_min, col_max + 1))
+
+        candidates = []
+        if (row_max - row_min + 1) * len(cols) > len(self.cells):
+            # Wide query over a sparse grid, walk the occupied cells instead. The items are
+            # copied first because a writer may add cells while a query runs.
+            for (row, col), ids in list(self.cells.items()):
+                if row_min <= row <= row_max and col in cols:
+                    candidates.extend(ids)
+        else:
+            for row in range(row_min, row_max + 1):
+                for col in cols:
+                    ids = self.cells.get((row, col))
+                    if ids:
+                        candidates.extend(ids)
+
+        candidates.sort()
+        return candidates
@@ -0,0 +1,137 @@
+import sys
+import threading
+from array import array
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, FrozenSet, Iterable
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Canonical specialization -> synonyms that should match it
+SPECIES_ALIASES = {
+    "dog": ("dogs", "canine", "canines", "puppy", "puppies"),
+    "cat": ("cats", "feline", "felines", "kitten", "kittens"),
+    "bird": ("birds", "avian", "parrot", "parrots"),
+    "horse": ("horses", "equine", "pony", "ponies"),
+    "reptile": ("reptiles", "reptilian", "herp", "herps"),
+    "rabbit": ("rabbits", "bunny", "bunnies", "lagomorph"),
+    "cattle": ("cow", "cows", "bovine"),
+    "fish": ("fishes", "aquatic"),
+    "leopard": ("leopards", "leapord"),
+    "lion": ("lions",),
+    "elephant": ("elephants",),
+    "exotic": ("exotics", "exotic pets"),
+}
+# Clinical specialties, the symptom matcher points at these
+SPECIALTY_ALIASES = {
+    "dermatology": ("dermatologist", "skin care"),
+    "dentistry": ("dental", "dentist", "dental care"),
+    "orthopedics": ("orthopedic", "orthopaedics", "orthopaedic", "orthopedist"),
+    "neurology": ("neurologist",),
+    "cardiology": ("cardiologist",),
+    "ophthalmology": ("ophthalmologist", "eye care"),
+    "oncology": ("oncologist",),
+    "surgery": ("surgeon", "surgical", "general surgery"),
+    "emergency": ("emergency care", "critical care", "emergency and critical care"),
+    "internal medicine": ("internist", "general medicine"),
+    "gastroenterology": ("gastroenterologist",),
+    "theriogenology": ("reproduction", "obstetrics"),
+    "toxicology": ("toxicologist",),
+}
+
+_ALIAS_TO_CANONICAL: Dict[str, str] = {}
+_NORMALIZED_SETS: Dict[tuple, FrozenSet[str]] = {}
+
+
+def register_alias(alias: str, canonical: str):
+    canonical = _clean(canonical)
+    _ALIAS_TO_CANONICAL[_clean(alias)] = sys.intern(canonical)
+    # Previously normalized sets may have used the old meaning of the alias
+    _NORMALIZED_SETS.clear()
+
+
+def _clean(name: str) -> str:
+    # Sheets quote whole lists ('"Dog, Cat"'), so edges can carry stray quotes
+    return " ".join(str(name).strip().strip("\"'").lower().split())
+
+
+def canonical_specialization(name: str) -> str:
+    cleaned = _clean(name)
+    return _ALIAS_TO_CANONICAL.get(cleaned) or sys.intern(cleaned)
+
+
+def normalize_specializations(names: Iterable[str]) -> FrozenSet[str]:
+    # Identical specialization lists share one interned frozenset
+    key = tuple(names)
+    normalized = _NORMALIZED_SETS.get(key)
+    if normalized is None:
+        normalized = frozenset(canonical_specialization(name) for name in key)
+        normalized = _NORMALIZED_SETS.setdefault(key, normalized)
+    return normalized
+
+
+for _canonical, _aliases in list(SPECIES_ALIASES.items()) + list(SPECIALTY_ALIASES.items()):
+    for _alias in _aliases:
+        register_alias(_alias, _canonical)
+
+
+def _id_array() -> array:
+    # Module level rather than a lambda so the index pickles for spawned batch workers
+    return array("q")
+
+
+class SpecializationIndex:
+    """Inverted index from canonical specialization to doctor ids."""
+
+    def __init__(self):
+        self.size = 0
+        # Compact id arrays rather than sets of int objects, masks give the set semantics
+        self._doctor_ids: Dict[str, array] = defaultdict(_id_array)
+        self._masks: Dict[str, "np.ndarray"] = {}
+        # Writers append while readers may be building masks from the same id arrays
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        with self._lock:
+            state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add(self, doctor_id: int, specializations: FrozenSet[str]):
+        with self._lock:
+            for specialization in specializations:
+                self._doctor_ids[specialization].append(doctor_id)
+                self._masks.pop(specialization, None)
+            self.size = max(self.size, doctor_id + 1)
+
+    def doctor_ids(self, species: str) -> "np.ndarray":
+        import numpy as np
+        return np.flatnonzero(self.mask(species))
+
+    def mask(self, species: str) -> "np.ndarray":
+        # Boolean membership over all doctor ids, built once per specialization and reused
+        import numpy as np
+        key = canonical_specialization(species)
+        mask = self._masks.get(key)
+        if mask is not None and len(mask) >= self.size:
+            return mask
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is None:
+                mask = np.zeros(self.size, dtype=bool)
+                ids = self._doctor_ids.get(key)
+                if ids:
+                    mask[np.frombuffer(ids, dtype=np.int64)] = True
+            elif len(mask) < self.size:
+                # Doctors added since the mask was built don't have this specialization
+                mask = np.concatenate([mask, np.zeros(self.size - len(mask), dtype=bool)])
+            self._masks[key] = mask
+        return mask
+
+    def specialist_mask(self, species: str, ids: "np.ndarray") -> "np.ndarray":
+        # Intersects the candidate ids with the specialists for species
+        return self.mask(species)[ids]
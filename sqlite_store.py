@@ -0,0 +1,270 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+from models import DoctorMatch, Location, Pet, VetDoctor
+from ranking import haversine_km, rank_scored
+from spatial_index import GridSpatialIndex
+from specializations import canonical_specialization, normalize_specializations
+from symptom_matcher import SYMPTOM_BONUS, SymptomWeights
+
+logger = logging.getLogger("vet_system.sqlite_store")
+
+SCHEMA_VERSION = 1
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS doctors (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    specializations TEXT NOT NULL,
+    experience_years INTEGER NOT NULL,
+    rating REAL NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    contact TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS doctor_locations USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+CREATE TABLE IF NOT EXISTS doctor_species (
+    species TEXT NOT NULL,
+    doctor_id INTEGER NOT NULL,
+    PRIMARY KEY (species, doctor_id)
+) WITHOUT ROWID;
+"""
+
+# R*Tree boxes are bounding boxes, the exact radius check happens on the REAL columns
+_CANDIDATES_SQL = """
+SELECT d.id, d.latitude, d.longitude, d.rating, d.experience_years,
+       EXISTS (SELECT 1 FROM doctor_species s WHERE s.species = ? AND s.doctor_id = d.id)
+FROM doctor_locations r JOIN doctors d ON d.id = r.id
+WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+"""
+# Doctors in the same bounding box that have one specialization, for symptom bonuses
+_SPECIALIZED_SQL = """
+SELECT r.id FROM doctor_locations r JOIN doctor_species s ON s.doctor_id = r.id AND s.species = ?
+WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+"""
+
+
+def is_sqlite_path(path: str) -> bool:
+    return path.lower().endswith(SQLITE_SUFFIXES)
+
+
+class ConnectionPool:
+    """Fixed-size pool of read-only connections, WAL lets them read while a writer commits."""
+
+    def __init__(self, path: str, size: int = 4):
+        self.path = path
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(self._connect())
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        connection.execute("PRAGMA query_only = ON")
+        # Bounded page cache per reader, about 16 MB
+        connection.execute("PRAGMA cache_size = -16000")
+        return connection
+
+    @contextmanager
+    def connection(self):
+        connection = self._idle.get()
+        try:
+            yield connection
+        finally:
+            self._idle.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class SQLiteDoctorStore:
+    """Doctor directory kept on disk, radius queries go through an R*Tree.
+
+    Ranking matches VetMatchingSystem.rank_doctors: specialists first, then score,
+    ties on ascending doctor id, which is the spreadsheet row order after an import.
+    """
+
+    def __init__(self, path: str, pool_size: int = 4):
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._writer = sqlite3.connect(path, check_same_thread=False)
+        self._writer.execute("PRAGMA journal_mode = WAL")
+        self._writer.execute("PRAGMA synchronous = NORMAL")
+        self._writer.executescript(_SCHEMA)
+        self._writer.execute("INSERT OR IGNORE INTO meta VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+        self._writer.commit()
+        self._pool = ConnectionPool(path, pool_size)
+        self._bbox = GridSpatialIndex()
+
+    def __len__(self):
+        with self._pool.connection() as connection:
+            return connection.execute("SELECT COUNT(*) FROM doctors").fetchone()[0]
+
+    def close(self):
+        self._pool.close()
+        with self._write_lock:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Writes
+
+    def _insert_rows(self, cursor, first_id: int, names, specializations, experience, rating,
+                     latitude, longitude, contacts):
+        ids = range(first_id, first_id + len(names))
+        cursor.executemany("INSERT INTO doctors VALUES (?, ?, ?, ?, ?, ?, ?, ?)", zip(
+            ids, names, (json.dumps(list(names_)) for names_ in specializations),
+            (int(value) for value in experience), (float(value) for value in rating),
+            (float(value) for value in latitude), (float(value) for value in longitude), contacts))
+        cursor.executemany("INSERT INTO doctor_locations VALUES (?, ?, ?, ?, ?)", (
+            (doctor_id, lat, lat, lon, lon)
+            for doctor_id, lat, lon in zip(ids, map(float, latitude), map(float, longitude))))
+        cursor.executemany("INSERT OR IGNORE INTO doctor_species VALUES (?, ?)", (
+            (species, doctor_id)
+            for doctor_id, names_ in zip(ids, specializations)
+            for species in normalize_specializations(names_)))
+
+    def import_spreadsheet(self, source_path: str, chunk_rows: int = 50000,
+                           processes: Optional[int] = None) -> int:
+        """Replaces the directory with the rows of an .xlsx or .csv file, in one transaction."""
+        from doctor_cache import file_sha256
+        from ingest import IngestReport, iter_doctor_chunks
+        report = IngestReport()
+        with self._write_lock:
+            cursor = self._writer.cursor()
+            try:
+                cursor.execute("BEGIN")
+                for table in ("doctors", "doctor_locations", "doctor_species"):
+                    cursor.execute(f"DELETE FROM {table}")
+                next_id = 0
+                for columns in iter_doctor_chunks(source_path, chunk_rows, processes, report):
+                    self._insert_rows(cursor, next_id, columns.names, columns.specializations,
+                                      columns.experience, columns.rating, columns.latitude,
+                                      columns.longitude, columns.contacts)
+                    next_id += len(columns)
+                cursor.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+                    ("source", os.path.abspath(source_path)),
+                    ("source_sha256", file_sha256(source_path)),
+                ])
+                cursor.execute("COMMIT")
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            # Fresh statistics help the planner pick the R*Tree
+            self._writer.execute("ANALYZE")
+        if report.rejected:
+            logger.warning("%s: %s", os.path.basename(source_path), report.summary())
+        logger.info("Imported %d doctors from %s into %s", next_id, source_path, self.path)
+        return next_id
+
+    def add_doctor(self, doctor: VetDoctor) -> int:
+        with self._write_lock, self._writer:
+            cursor = self._writer.cursor()
+            doctor_id = cursor.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM doctors").fetchone()[0]
+            location = doctor.location
+            self._insert_rows(cursor, doctor_id, [doctor.name], [doctor.specializations],
+                              [doctor.experience_years], [doctor.rating], [location.latitude],
+                              [location.longitude], [doctor.contact])
+        return doctor_id
+
+    def remove_doctor(self, doctor_id: int):
+        with self._write_lock, self._writer:
+            if self._writer.execute("DELETE FROM doctors WHERE id = ?", (doctor_id,)).rowcount == 0:
+                raise KeyError(f"no doctor with id {doctor_id}")
+            self._writer.execute("DELETE FROM doctor_locations WHERE id = ?", (doctor_id,))
+            self._writer.execute("DELETE FROM doctor_species WHERE doctor_id = ?", (doctor_id,))
+
+    # Reads
+
+    def get_doctors(self, doctor_ids: Iterable[int]) -> List[VetDoctor]:
+        doctor_ids = list(doctor_ids)
+        if not doctor_ids:
+            return []
+        with self._pool.connection() as connection:
+            rows = {}
+            # Stay under SQLite's bound parameter limit
+            for start in range(0, len(doctor_ids), 900):
+                block = doctor_ids[start:start + 900]
+                rows.update((row[0], row) for row in connection.execute(
+                    "SELECT id, name, specializations, experience_years, rating, latitude, longitude, contact "
+                    f"FROM doctors WHERE id IN ({','.join('?' * len(block))})", block))
+        return [VetDoctor(name, json.loads(specializations), experience, rating, Location(latitude, longitude),
+                          contact)
+                for _, name, specializations, experience, rating, latitude, longitude, contact
+                in (rows[doctor_id] for doctor_id in doctor_ids)]
+
+    def rank_doctors(self, pet: Pet, max_distance: float, limit: Optional[int] = None,
+                     offset: int = 0, weights: SymptomWeights = ()) -> List[DoctorMatch]:
+        lat_min, lat_max, lon_ranges = self._bbox.bounding_box(pet.location, max_distance)
+        species = canonical_specialization(pet.species)
+        rows = []
+        specialized = {}
+        with self._pool.connection() as connection:
+            for lon_min, lon_max in lon_ranges:
+                box = (lat_min, lat_max, lon_min, lon_max)
+                rows.extend(connection.execute(_CANDIDATES_SQL, (species,) + box))
+                for specialization, _ in weights:
+                    specialized.setdefault(specialization, []).extend(
+                        row[0] for row in connection.execute(_SPECIALIZED_SQL, (specialization,) + box))
+        if not rows:
+            return []
+
+        columns = np.array(rows, dtype=np.float64).reshape(len(rows), 6)
+        ids = columns[:, 0].astype(np.int64)
+        distances = haversine_km(np.radians(float(pet.location.latitude)), np.radians(float(pet.location.longitude)),
+                                 np.radians(columns[:, 1]), np.radians(columns[:, 2]))
+        # Same scoring and ordering as ranking.score_candidates/rank_matches
+        in_range = distances <= max_distance
+        ids, distances, columns = ids[in_range], distances[in_range], columns[in_range]
+        scores = columns[:, 3] + np.minimum(5, columns[:, 4] * 0.2) - 0.1 * distances
+        if weights:
+            # Same bonus as symptom_matcher.symptom_bonus, from the species table instead of masks
+            bonus = np.zeros(len(ids), dtype=np.float64)
+            for specialization, weight in weights:
+                bonus += weight * np.isin(ids, specialized[specialization])
+            scores = scores + SYMPTOM_BONUS * np.minimum(bonus, 1.0)
+        ids, distances, scores, specialist = rank_scored(ids, distances, scores, columns[:, 5] != 0,
+                                                         limit, offset)
+        doctors = self.get_doctors(ids.tolist())
+        return [DoctorMatch(doctor, distance, score, is_specialist)
+                for doctor, distance, score, is_specialist
+                in zip(doctors, distances.tolist(), scores.tolist(), specialist.tolist())]
+
+    def find_best_doctor(self, pet: Pet, max_distance: float, limit: Optional[int] = None,
+                         offset: int = 0, weights: SymptomWeights = ()) -> List[VetDoctor]:
+        return [match.doctor for match in self.rank_doctors(pet, max_distance, limit, offset, weights)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a vet spreadsheet into a SQLite doctor store")
+    parser.add_argument("source", help=".xlsx or .csv spreadsheet")
+    parser.add_argument("database", help="SQLite file to create or replace the directory in")
+    parser.add_argument("--processes", type=int, default=None, help="parse chunks in this many processes")
+    args = parser.parse_args()
+
+    from diagnostics import configure_logging
+    configure_logging("INFO")
+    with SQLiteDoctorStore(args.database) as store:
+        store.import_spreadsheet(args.source, processes=args.processes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from typing import Dict, Optional
+
+from diagnostics import configure_logging
+from matching_service import HTTPError, MatchingService
+
+logger = logging.getLogger("vet_system.stub_gateway")
+
+PAYMENT_METHODS = ("upi", "card", "netbanking")
+# Like the test cards of real gateways, this card number is always declined
+DECLINED_CARD = "4000000000000002"
+
+
+class StubGateway:
+    """Local stand-in for the payment gateway's HTTP API, for development and load tests.
+
+    POST /payments charges once per Idempotency-Key, GET /payments/<id> reads a
+    payment back and GET /stats reports counters. Latency, transient 503s and
+    responses lost after the charge went through can be injected to exercise
+    client retries.
+    """
+
+    def __init__(self, latency: float = 0.02, jitter: float = 0.01, error_rate: float = 0.0,
+                 lost_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.lost_rate = lost_rate
+        self._random = random.Random(seed)
+        self.payments: Dict[str, dict] = {}
+        # Idempotency key -> the payment it created, a future while the first request is in flight
+        self._by_key: Dict[str, asyncio.Future] = {}
+        self._fingerprints: Dict[str, str] = {}
+        self.stats = {"requests": 0, "charges": 0, "replays": 0, "errors": 0, "lost": 0}
+
+    async def dispatch(self, method: str, path: str, headers: dict, body: bytes):
+        self.stats["requests"] += 1
+        if path == "/payments":
+            if method != "POST":
+                raise HTTPError(405, "method not allowed")
+            return await self.handle_charge(headers, self._json(body))
+        if path.startswith("/payments/"):
+            if method != "GET":
+                raise HTTPError(405, "method not allowed")
+            payment = self.payments.get(path[len("/payments/"):])
+            if payment is None:
+                raise HTTPError(404, "no such payment")
+            return payment
+        if path == "/stats":
+            return dict(self.stats, payments=len(self.payments))
+        raise HTTPError(404, "not found")
+
+    @staticmethod
+    def _json(body: bytes) -> dict:
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            raise HTTPError(400, "body must be JSON")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "body must be a JSON object")
+        return data
+
+    async def handle_charge(self, headers: dict, body: dict):
+        if self._random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            raise HTTPError(503, "gateway busy, retry later")
+        key = headers.get("idempotency-key")
+        if not key:
+            raise HTTPError(400, "Idempotency-Key header is required")
+        fingerprint = json.dumps(body, sort_keys=True)
+        existing = self._by_key.get(key)
+        if existing is not None:
+            if self._fingerprints[key] != fingerprint:
+                raise HTTPError(409, "idempotency key reused for a different request")
+            # A duplicate of a charge still in flight waits for it rather than charging again
+            payment = await asyncio.shield(existing)
+            self.stats["replays"] += 1
+            return dict(payment, replayed=True)
+
+        amount, method = body.get("amount"), body.get("method")
+        if not isinstance(amount, int) or amount <= 0:
+            raise HTTPError(400, "amount must be a positive integer in paise")
+        if method not in PAYMENT_METHODS:
+            raise HTTPError(400, f"method must be one of {', '.join(PAYMENT_METHODS)}")
+        details = body.get("details") or {}
+        pending = self._by_key[key] = asyncio.get_running_loop().create_future()
+        self._fingerprints[key] = fingerprint
+
+        await asyncio.sleep(self.latency + self._random.uniform(0, self.jitter))
+        card = str(details.get("card_number", "")).replace(" ", "")
+        payment = {
+            "id": f"pay_{uuid.uuid4().hex[:16]}",
+            "status": "declined" if method == "card" and card == DECLINED_CARD else "succeeded",
+            "amount": amount,
+            "currency": body.get("currency", "INR"),
+            "method": method,
+            "idempotency_key": key,
+            "created_at": time.time(),
+        }
+        # Card numbers are never kept, only what a receipt would show
+        if card:
+            payment["card_last4"] = card[-4:]
+        self.payments[payment["id"]] = payment
+        pending.set_result(payment)
+        self.stats["charges"] += 1
+        if self._random.random() < self.lost_rate:
+            # Charged, but the client never hears about it and has to retry
+            self.stats["lost"] += 1
+            raise HTTPError(504, "upstream timeout")
+        return payment
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Same keep-alive loop as MatchingService, with headers passed to dispatch
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await MatchingService.read_request(reader)
+                    if request is None:
+                        break
+                    method, path, headers, body = request
+                    keep_alive = MatchingService.keep_alive(headers)
+                    status, payload = 200, await self.dispatch(method, path, headers, body)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except Exception:
+                    logger.exception("Unhandled error serving request")
+                    status, payload, keep_alive = 500, {"error": "internal error"}, False
+                MatchingService.write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8099) -> asyncio.AbstractServer:
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        logger.info("Stub payment gateway listening on %s", ", ".join(
+            str(sock.getsockname()) for sock in server.sockets))
+        return server
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8099):
+        async with await self.start(host, port) as server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of the payment gateway API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of charges answered with a 503")
+    parser.add_argument("--lost-rate", type=float, default=0.0,
+                        help="share of charges that go through but answer with a 504")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    configure_logging(os.environ.get("VET_TRACKER_LOG_LEVEL", "INFO"))
+    gateway = StubGateway(args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate, args.lost_rate,
+                          args.seed)
+    try:
+        asyncio.run(gateway.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from specializations import canonical_specialization
+
+# (specialization, weight) pairs sorted by specialization, hashable so they can key caches
+SymptomWeights = Tuple[Tuple[str, float], ...]
+
+# Keyword -> specializations it points to, with how strongly (0..1).
+# A trailing * also matches longer words ("vomit*" matches "vomiting").
+SYMPTOM_SPECIALIZATIONS: Dict[str, Tuple[Tuple[str, float], ...]] = {
+    # The GUI's checkbox symptoms
+    "bloody vomit": (("gastroenterology", 1.0), ("emergency", 0.6)),
+    "excessive hairloss": (("dermatology", 1.0),),
+    "extreme smell": (("dermatology", 0.5), ("dentistry", 0.5)),
+    "not eating food": (("internal medicine", 0.6), ("dentistry", 0.3)),
+    "fever": (("internal medicine", 0.6),),
+    # Digestive
+    "vomit*": (("gastroenterology", 0.8),),
+    "diarrh*": (("gastroenterology", 0.8),),
+    "constipat*": (("gastroenterology", 0.6),),
+    "bloat*": (("gastroenterology", 0.6), ("emergency", 0.6)),
+    "not eating": (("internal medicine", 0.6), ("dentistry", 0.3)),
+    "appetite": (("internal medicine", 0.5),),
+    # Skin and coat
+    "hairloss": (("dermatology", 1.0),),
+    "hair loss": (("dermatology", 1.0),),
+    "itch*": (("dermatology", 0.8),),
+    "scratch*": (("dermatology", 0.6),),
+    "rash*": (("dermatology", 0.8),),
+    "flea*": (("dermatology", 0.6),),
+    "mange": (("dermatology", 1.0),),
+    "smell*": (("dermatology", 0.4), ("dentistry", 0.4)),
+    "odor*": (("dermatology", 0.4), ("dentistry", 0.4)),
+    # Mouth and teeth
+    "bad breath": (("dentistry", 1.0),),
+    "teeth": (("dentistry", 1.0),),
+    "tooth": (("dentistry", 1.0),),
+    "gum*": (("dentistry", 0.8),),
+    "drool*": (("dentistry", 0.5),),
+    # Movement
+    "limp*": (("orthopedics", 1.0),),
+    "lame": (("orthopedics", 1.0),),
+    "lameness": (("orthopedics", 1.0),),
+    "fractur*": (("orthopedics", 1.0), ("surgery", 0.6)),
+    "broken bone": (("orthopedics", 1.0), ("surgery", 0.6)),
+    "joint*": (("orthopedics", 0.6),),
+    "arthritis": (("orthopedics", 0.8),),
+    # Nervous system
+    "seizure*": (("neurology", 1.0), ("emergency", 0.5)),
+    "fits": (("neurology", 0.6),),
+    "paraly*": (("neurology", 1.0),),
+    "tremor*": (("neurology", 0.8),),
+    # Heart and lungs
+    "cough*": (("cardiology", 0.5), ("internal medicine", 0.4)),
+    "breathing": (("cardiology", 0.6), ("emergency", 0.4)),
+    "heart murmur": (("cardiology", 1.0),),
+    "faint*": (("cardiology", 0.6),),
+    # Eyes and ears
+    "eye*": (("ophthalmology", 0.8),),
+    "blind*": (("ophthalmology", 1.0),),
+    "cloudy": (("ophthalmology", 0.5),),
+    "ear": (("dermatology", 0.4),),
+    "ears": (("dermatology", 0.4),),
+    # Everything else
+    "lump*": (("oncology", 0.8), ("surgery", 0.4)),
+    "tumor*": (("oncology", 1.0), ("surgery", 0.5)),
+    "tumour*": (("oncology", 1.0), ("surgery", 0.5)),
+    "cancer": (("oncology", 1.0),),
+    "pregnan*": (("theriogenology", 1.0),),
+    "birth": (("theriogenology", 0.8),),
+    "bleed*": (("emergency", 1.0), ("surgery", 0.4)),
+    "blood*": (("emergency", 0.5),),
+    "poison*": (("emergency", 1.0), ("toxicology", 1.0)),
+    "hit by": (("emergency", 1.0), ("surgery", 0.6)),
+    "wound*": (("surgery", 0.6), ("emergency", 0.5)),
+    "urin*": (("internal medicine", 0.6),),
+    "thirst*": (("internal medicine", 0.6),),
+    "weight loss": (("internal medicine", 0.6),),
+    "diabet*": (("internal medicine", 1.0),),
+    # Signs that point at a kind of animal rather than a clinical specialty
+    "feather*": (("bird", 0.8),),
+    "beak": (("bird", 1.0),),
+    "hoof": (("horse", 0.8), ("cattle", 0.4)),
+    "hooves": (("horse", 0.8), ("cattle", 0.4)),
+    "colic": (("horse", 0.8), ("gastroenterology", 0.4)),
+    "laminitis": (("horse", 1.0), ("orthopedics", 0.5)),
+    "shell": (("reptile", 1.0),),
+    "shedding skin": (("reptile", 0.8),),
+    "scale rot": (("reptile", 1.0),),
+    "udder": (("cattle", 1.0),),
+    "mastitis": (("cattle", 1.0),),
+    "fin rot": (("fish", 1.0),),
+    "swim bladder": (("fish", 1.0),),
+    "gill*": (("fish", 0.8),),
+    "tusk*": (("elephant", 1.0),),
+    "trunk": (("elephant", 0.8),),
+}
+# Keywords in the medical history count for this much of a current symptom
+HISTORY_WEIGHT = 0.5
+# Score points added for a doctor whose specializations cover all of a pet's symptom weight
+SYMPTOM_BONUS = 1.0
+# Symptom weight sets whose per-list bonus a table or shard keeps, the table resets when full
+MAX_CACHED_BONUSES = 1024
+
+
+def _clean_text(text: str) -> str:
+    return " ".join(str(text).lower().split())
+
+
+def normalize_symptoms(lines: Optional[Iterable[str]]) -> Tuple[str, ...]:
+    # Order, case, spacing and duplicates don't change the match, so they don't change the key
+    if not lines:
+        return ()
+    return tuple(sorted({cleaned for cleaned in map(_clean_text, lines) if cleaned}))
+
+
+class SymptomAutomaton:
+    """Aho-Corasick automaton over the keyword table, scans text in one pass.
+
+    Keywords only match whole words; a keyword ending in * may run on into a
+    longer word.
+    """
+
+    def __init__(self, keywords: Sequence[str]):
+        # keyword id -> (length, whole word only)
+        self.keywords = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail = [0]
+        # state -> keyword ids that end there, including via fail links
+        self._output: List[Tuple[int, ...]] = [()]
+        for keyword_id, keyword in enumerate(keywords):
+            prefix = keyword.endswith("*")
+            text = _clean_text(keyword.rstrip("*"))
+            self.keywords.append((len(text), not prefix))
+            state = 0
+            for char in text:
+                following = self._goto[state].get(char)
+                if following is None:
+                    following = self._goto[state][char] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                state = following
+            self._output[state] += (keyword_id,)
+
+        # Breadth-first so each state's fail target is finished before it
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, following in self._goto[state].items():
+                pending.append(following)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[following] = target if target != following else 0
+                self._output[following] += self._output[self._fail[following]]
+
+    def scan(self, text: str) -> List[int]:
+        # Keyword ids found in text, in the order their matches end
+        found = []
+        goto, fail, output, keywords = self._goto, self._fail, self._output, self.keywords
+        state = 0
+        end = len(text)
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for keyword_id in output[state]:
+                length, whole_word = keywords[keyword_id]
+                start = position - length + 1
+                if start > 0 and text[start - 1].isalnum():
+                    continue
+                if whole_word and position + 1 < end and text[position + 1].isalnum():
+                    continue
+                found.append(keyword_id)
+        return found
+
+
+class SymptomMatcher:
+    """Turns a pet's symptoms and medical history into specialization weights.
+
+    The keyword table is compiled once; weights are cached per normalized
+    symptom set, so repeat searches cost one dictionary lookup.
+    """
+
+    def __init__(self, table: Mapping[str, Sequence[Tuple[str, float]]] = SYMPTOM_SPECIALIZATIONS,
+                 history_weight: float = HISTORY_WEIGHT, max_entries: int = 4096):
+        keywords = list(table)
+        self.automaton = SymptomAutomaton(keywords)
+        self._targets = [tuple((canonical_specialization(name), float(weight)) for name, weight in table[keyword])
+                         for keyword in keywords]
+        self.history_weight = history_weight
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[tuple, SymptomWeights]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def weights(self, symptoms: Optional[Iterable[str]],
+                medical_history: Optional[Iterable[str]] = None) -> SymptomWeights:
+        key = (normalize_symptoms(symptoms), normalize_symptoms(medical_history))
+        if not key[0] and not key[1]:
+            return ()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+
+        found: Dict[str, float] = {}
+        for lines, factor in ((key[0], 1.0), (key[1], self.history_weight)):
+            if not lines:
+                continue
+            # Newlines keep keywords from matching across two lines
+            for keyword_id in self.automaton.scan("\n".join(lines)):
+                for specialization, weight in self._targets[keyword_id]:
+                    # The strongest hint counts, repeating a symptom doesn't add up
+                    found[specialization] = max(found.get(specialization, 0.0), weight * factor)
+        weights = tuple(sorted(found.items()))
+
+        with self._lock:
+            self._cache[key] = weights
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return weights
+
+    def pet_weights(self, pet) -> SymptomWeights:
+        return self.weights(pet.symptoms, pet.medical_history)
+
+
+def specialization_bonus(specializations: FrozenSet[str], weights: SymptomWeights) -> float:
+    # Bonus for one doctor, capped so several matching specialties count like one full match
+    return SYMPTOM_BONUS * min(1.0, sum(weight for name, weight in weights if name in specializations))
+
+
+def list_bonus(normalized_lists: Sequence[FrozenSet[str]], weights: SymptomWeights):
+    # Bonus per distinct specialization list, doctors then gather it through their list id
+    import numpy as np
+    return np.array([specialization_bonus(names, weights) for names in list(normalized_lists)] or [0.0])
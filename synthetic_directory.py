@@ -0,0 +1,148 @@
+import argparse
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from doctor_cache import DoctorColumns
+from models import Location, Pet
+
+# (city, latitude, longitude, relative size), doctors cluster around these like the real sheet
+CITIES = (
+    ("Delhi", 28.6139, 77.2090, 32.0),
+    ("Mumbai", 19.0760, 72.8777, 24.0),
+    ("Bengaluru", 12.9716, 77.5946, 13.0),
+    ("Kolkata", 22.5726, 88.3639, 15.0),
+    ("Chennai", 13.0827, 80.2707, 11.0),
+    ("Hyderabad", 17.3850, 78.4867, 10.5),
+    ("Ahmedabad", 23.0225, 72.5714, 8.5),
+    ("Pune", 18.5204, 73.8567, 7.0),
+    ("Jaipur", 26.9124, 75.7873, 4.0),
+    ("Lucknow", 26.8467, 80.9462, 3.8),
+    ("Chandigarh", 30.7333, 76.7794, 1.2),
+    ("Gurugram", 28.4595, 77.0266, 1.5),
+    ("Bhopal", 23.2599, 77.4126, 2.4),
+    ("Kochi", 9.9312, 76.2673, 2.2),
+    ("Guwahati", 26.1445, 91.7362, 1.1),
+)
+# Bounding box for the doctors that are not in any city
+RURAL_BOUNDS = ((8.0, 32.0), (69.0, 89.0))
+RURAL_FRACTION = 0.05
+
+# Species by popularity, specializations are drawn with Zipf weights over this order
+SPECIES = ("Dog", "Cat", "Bird", "Rabbit", "Cattle", "Horse", "Reptiles", "Fish",
+           "Exotic", "Leopard", "Lion", "Elephant")
+ZIPF_EXPONENT = 1.1
+# Distinct specialization lists, doctors share them like the rows of a real sheet do
+SPECIALIZATION_COMBINATIONS = 256
+
+# Excel's row limit, minus the header
+XLSX_MAX_ROWS = 1048575
+FORMATS = ("xlsx", "csv")
+
+
+def zipf_weights(count: int, exponent: float = ZIPF_EXPONENT) -> np.ndarray:
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def _specialization_pool(rng: np.random.Generator):
+    species_weights = zipf_weights(len(SPECIES))
+    pool = []
+    for _ in range(SPECIALIZATION_COMBINATIONS):
+        count = min(len(SPECIES), 1 + rng.binomial(5, 0.35))
+        chosen = np.sort(rng.choice(len(SPECIES), size=count, replace=False, p=species_weights))
+        pool.append([SPECIES[i] for i in chosen])
+    # Lists built from popular species come first, so the Zipf draw below favours them
+    pool.sort(key=lambda names: sum(SPECIES.index(name) for name in names) / len(names))
+    return pool
+
+
+def _locations(rng: np.random.Generator, rows: int):
+    sizes = np.array([city[3] for city in CITIES])
+    city_ids = rng.choice(len(CITIES), size=rows, p=sizes / sizes.sum())
+    centers = np.array([(city[1], city[2]) for city in CITIES])
+    # Bigger cities sprawl further, ~3 km spread for the smallest, ~17 km for Delhi
+    spread_km = 3.0 * np.sqrt(sizes)[city_ids]
+    latitude = centers[city_ids, 0] + rng.normal(0, 1, rows) * spread_km / 111.0
+    longitude = (centers[city_ids, 1] + rng.normal(0, 1, rows) * spread_km
+                 / (111.0 * np.cos(np.radians(centers[city_ids, 0]))))
+
+    rural = rng.random(rows) < RURAL_FRACTION
+    (lat_low, lat_high), (lon_low, lon_high) = RURAL_BOUNDS
+    latitude[rural] = rng.uniform(lat_low, lat_high, rural.sum())
+    longitude[rural] = rng.uniform(lon_low, lon_high, rural.sum())
+    return np.round(latitude, 4), np.round(longitude, 4)
+
+
+def generate_columns(rows: int, seed: int = 0) -> DoctorColumns:
+    """A reproducible synthetic directory with `rows` doctors."""
+    rng = np.random.default_rng(seed)
+    latitude, longitude = _locations(rng, rows)
+
+    pool = _specialization_pool(rng)
+    combination_ids = rng.choice(len(pool), size=rows, p=zipf_weights(len(pool)))
+    # Most vets sit between 4 and 5 stars, experience is right-skewed
+    rating = np.round(np.clip(rng.normal(4.2, 0.45, rows), 1.0, 5.0), 1)
+    experience = np.clip(rng.gamma(2.0, 6.0, rows), 0, 45).astype(np.int64)
+    contacts = rng.integers(5_000_000_000, 9_999_999_999, rows)
+
+    return DoctorColumns(
+        names=[f"Dr. Synthetic {i:08d}" for i in range(rows)],
+        specializations=[pool[i] for i in combination_ids.tolist()],
+        contacts=[str(contact) for contact in contacts.tolist()],
+        latitude=latitude,
+        longitude=longitude,
+        rating=rating,
+        experience=experience,
+    )
+
+
+def generate_pets(count: int, seed: int = 1) -> List[Pet]:
+    # Searches come from the same places and for the same species as the directory
+    rng = np.random.default_rng(seed)
+    latitude, longitude = _locations(rng, count)
+    species = rng.choice(len(SPECIES), size=count, p=zipf_weights(len(SPECIES)))
+    return [Pet(f"Pet {i}", SPECIES[s].lower(), 3.0, 10.0, [], [], Location(lat, lon))
+            for i, (s, lat, lon) in enumerate(zip(species.tolist(), latitude.tolist(), longitude.tolist()))]
+
+
+def to_dataframe(columns: DoctorColumns):
+    import pandas as pd
+    return pd.DataFrame({
+        "Name": columns.names,
+        "Specializations": [", ".join(names) for names in columns.specializations],
+        "Experience_Years": columns.experience,
+        "Latitude": columns.latitude,
+        "Longitude": columns.longitude,
+        "Availability": True,
+        "Rating": columns.rating,
+        "Contact": columns.contacts,
+    })
+
+
+def write_directory(columns: DoctorColumns, path: str, fmt: Optional[str] = None):
+    # The same layout as vets_database.xlsx, so the normal loaders read it
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"unsupported format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    if fmt == "xlsx" and len(columns) > XLSX_MAX_ROWS:
+        raise ValueError(f"xlsx holds at most {XLSX_MAX_ROWS} rows, use csv for {len(columns)}")
+    df = to_dataframe(columns)
+    if fmt == "xlsx":
+        df.to_excel(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic vet directory for benchmarks")
+    parser.add_argument("rows", type=int)
+    parser.add_argument("output", help="a .xlsx or .csv path")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_directory(generate_columns(args.rows, args.seed), args.output)
+
+
+if __name__ == "__main__":
+    main()
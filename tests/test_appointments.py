@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+
+from appointments import AppointmentInventory, HoldExpired, SlotUnavailable, doctor_key
+from models import Location, Pet, VetDoctor
+from query_cache import QueryCache
+from vet_core import VetMatchingSystem
+
+
+@pytest.fixture
+def inventory():
+    inventory = AppointmentInventory(hold_seconds=60)
+    yield inventory
+    inventory.close()
+
+
+def _slot(minutes=60):
+    return int(time.time()) + minutes * 60
+
+
+def test_hold_then_confirm_books_the_slot(inventory):
+    start = _slot()
+    inventory.open_slots("Dr A|1", [start])
+    hold = inventory.hold("Dr A|1", start, customer="pet owner")
+    assert inventory.free_slots("Dr A|1") == []
+
+    booking = inventory.confirm(hold.hold_id)
+    assert (booking.doctor, booking.start, booking.customer) == ("Dr A|1", start, "pet owner")
+    assert inventory.free_slots("Dr A|1") == []
+    with pytest.raises(HoldExpired):
+        inventory.confirm(hold.hold_id)
+
+
+def test_slot_can_only_be_held_once(inventory):
+    start = _slot()
+    inventory.open_slots("Dr A|1", [start])
+    results = []
+
+    def reserve():
+        try:
+            results.append(inventory.hold("Dr A|1", start))
+        except SlotUnavailable:
+            results.append(None)
+
+    threads = [threading.Thread(target=reserve) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(result is not None for result in results) == 1
+
+
+def test_release_returns_the_slot(inventory):
+    start = _slot()
+    inventory.open_slots("Dr A|1", [start])
+    hold = inventory.hold("Dr A|1", start)
+    assert inventory.release(hold.hold_id)
+    assert inventory.free_slots("Dr A|1") == [start]
+    assert not inventory.release(hold.hold_id)
+
+
+def test_unscheduled_doctor_cannot_be_held(inventory):
+    with pytest.raises(SlotUnavailable):
+        inventory.hold("Dr B|2", _slot())
+
+
+def test_expired_hold_cannot_be_confirmed():
+    inventory = AppointmentInventory(hold_seconds=0.05)
+    try:
+        start = _slot()
+        inventory.open_slots("Dr A|1", [start])
+        hold = inventory.hold("Dr A|1", start)
+        time.sleep(0.1)
+        with pytest.raises(HoldExpired):
+            inventory.confirm(hold.hold_id)
+        assert inventory.free_slots("Dr A|1") == [start]
+    finally:
+        inventory.close()
+
+
+def test_timer_wheel_reclaims_expired_holds():
+    inventory = AppointmentInventory(hold_seconds=0.05)
+    try:
+        start = _slot()
+        inventory.open_slots("Dr A|1", [start])
+        inventory.hold("Dr A|1", start)
+        deadline = time.time() + 5
+        while inventory.free_slots("Dr A|1") != [start] and time.time() < deadline:
+            time.sleep(0.05)
+        assert inventory.free_slots("Dr A|1") == [start]
+    finally:
+        inventory.close()
+
+
+def test_bookings_survive_a_restart(tmp_path):
+    path = str(tmp_path / "appointments.db")
+    booked, free = _slot(60), _slot(90)
+    with AppointmentInventory(path) as inventory:
+        inventory.open_slots("Dr A|1", [booked, free])
+        inventory.confirm(inventory.hold("Dr A|1", booked).hold_id)
+    with AppointmentInventory(path) as inventory:
+        assert inventory.free_slots("Dr A|1") == [free]
+
+
+def test_cached_searches_only_drop_around_the_held_doctor(inventory):
+    system = VetMatchingSystem(None, query_cache=QueryCache())
+    near = VetDoctor("Dr Near", ["Dog"], 10, 4.5, Location(28.60, 77.20), "1")
+    far = VetDoctor("Dr Far", ["Dog"], 10, 4.5, Location(19.07, 72.87), "2")
+    for doctor in (near, far):
+        system.add_doctor(doctor)
+        inventory.open_slots(doctor_key(doctor), [_slot(), _slot(90)])
+    system.use_appointments(inventory)
+    pet = Pet("Rex", "Dog", 3, 20, [], [], Location(28.61, 77.21))
+
+    system.rank_doctors(pet, 25)
+    inventory.hold(doctor_key(far), _slot())
+    system.rank_doctors(pet, 25)
+    assert system.query_cache.hits == 1
+
+    inventory.hold(doctor_key(near), _slot())
+    system.rank_doctors(pet, 25)
+    assert system.query_cache.hits == 1
@@ -0,0 +1,30 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from batch_matching import iter_batch_rankings
+from synthetic_directory import generate_columns, generate_pets
+from vet_core import VetMatchingSystem
+
+
+@pytest.fixture(scope="module")
+def snapshot():
+    system = VetMatchingSystem(None)
+    system.add_doctor_columns(generate_columns(5000, seed=0))
+    return system.snapshot
+
+
+@pytest.mark.parametrize("method", ["spawn", "fork"])
+def test_worker_pool_matches_serial_ranking(snapshot, method):
+    if method not in multiprocessing.get_all_start_methods():
+        pytest.skip(f"{method} is not available")
+    pets = generate_pets(200, seed=1)
+    serial = list(iter_batch_rankings(snapshot, pets, 25, chunk_size=50, processes=1, limit=10))
+    pooled = list(iter_batch_rankings(snapshot, pets, 25, chunk_size=50, processes=2, limit=10,
+                                      mp_context=multiprocessing.get_context(method)))
+
+    assert [pet for pet, _ in pooled] == pets
+    for (_, expected), (_, ranked) in zip(serial, pooled):
+        for expected_column, column in zip(expected, ranked):
+            np.testing.assert_array_equal(column, expected_column)
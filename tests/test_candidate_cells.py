@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+from models import Location, VetDoctor
+from synthetic_directory import generate_columns, generate_pets
+from vet_core import VetMatchingSystem
+
+PETS = generate_pets(150, seed=7)
+
+
+@pytest.fixture
+def system():
+    system = VetMatchingSystem(None)
+    system.add_doctor_columns(generate_columns(5000, seed=0))
+    system.enable_candidate_cells(radii=(10.0, 25.0), cell_size_deg=0.05)
+    return system
+
+
+def _rankings(system, max_distance, limit, offset):
+    return [[(m.doctor.name, m.doctor.contact, m.score, m.is_specialist)
+             for m in system.rank_doctors(pet, max_distance, limit, offset)] for pet in PETS]
+
+
+def _assert_same_as_full_ranking(system):
+    cells = system.candidate_cells
+    for max_distance in (10.0, 25.0, 12.0):
+        for limit, offset in ((10, 0), (5, 3), (0, 0), (50, 40), (None, 0)):
+            cached = _rankings(system, max_distance, limit, offset)
+            system.candidate_cells = None
+            try:
+                assert cached == _rankings(system, max_distance, limit, offset)
+            finally:
+                system.candidate_cells = cells
+
+
+def test_cells_rank_like_the_full_ranking(system):
+    served = [system.candidate_cells.rank(system.snapshot, pet.location, pet.species, 10.0, 10) for pet in PETS]
+    assert sum(ranked is not None for ranked in served) > len(PETS) // 2
+    _assert_same_as_full_ranking(system)
+
+
+def test_cells_follow_added_and_removed_doctors(system):
+    rng = random.Random(1)
+    for i in range(40):
+        pet = rng.choice(PETS)
+        location = Location(pet.location.latitude + rng.uniform(-0.05, 0.05),
+                            pet.location.longitude + rng.uniform(-0.05, 0.05))
+        system.add_doctor(VetDoctor(f"New {i}", ["Dog"] if i % 2 else ["Cat", "Bird"], rng.randint(0, 30),
+                                    round(rng.uniform(3, 5), 1), location, str(i)))
+    for doctor_id in rng.sample(range(system.snapshot.size), 200):
+        system.remove_doctor(doctor_id)
+
+    assert system.candidate_cells.covers(system.snapshot)
+    _assert_same_as_full_ranking(system)
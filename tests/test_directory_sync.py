@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from models import Location, VetDoctor
+from synthetic_directory import generate_columns, generate_pets
+from vet_core import VetMatchingSystem
+
+COUNT = 3000
+
+
+@pytest.fixture
+def columns():
+    return generate_columns(COUNT, seed=0)
+
+
+@pytest.fixture
+def system(columns):
+    system = VetMatchingSystem(None)
+    system.sync_from_columns(columns)
+    return system
+
+
+def _live(system):
+    return sorted((doctor.name, doctor.contact, doctor.rating) for doctor in system.snapshot.doctors)
+
+
+def _expected(columns):
+    return sorted(zip(columns.names, columns.contacts, np.asarray(columns.rating).tolist()))
+
+
+def _rankings(system, pets):
+    return [[(m.doctor.name, m.doctor.contact) for m in system.rank_doctors(pet, 50, 20)] for pet in pets]
+
+
+def test_sync_applies_additions_updates_and_removals(system, columns):
+    edited = columns.take(np.arange(100, COUNT))
+    edited.rating = edited.rating.copy()
+    edited.rating[:10] = 1.0
+    extra = generate_columns(50, seed=7)
+    sheet = type(columns).concat([edited, extra])
+
+    assert system.sync_from_columns(sheet) == (50, 10, 100)
+    assert _live(system) == _expected(sheet)
+    assert system.sync_from_columns(sheet) == (0, 0, 0)
+
+
+def test_published_snapshots_do_not_see_later_writes(system, columns):
+    before = system.snapshot
+    system.sync_from_columns(columns.take(np.arange(10, COUNT)))
+
+    assert len(before.doctors) == COUNT
+    assert len(system.snapshot.doctors) == COUNT - 10
+
+
+def test_update_and_remove_keep_the_sheet_rows_in_step(system, columns):
+    first = next(iter(system.snapshot.doctors))
+    moved = VetDoctor(first.name, first.specializations, first.experience_years, 1.0,
+                      Location(0.0, 0.0), first.contact)
+    system.update_doctor(first.doctor_id, moved)
+    system.remove_doctor(next(iter(system.snapshot.doctors)).doctor_id)
+
+    # Row 0 comes back with its sheet values, the removed row comes back as new
+    assert system.sync_from_columns(columns) == (1, 1, 0)
+    assert _live(system) == _expected(columns)
+
+
+def test_compaction_keeps_rankings_and_sheet_rows(system, columns):
+    kept = np.arange(0, COUNT, 3)
+    sheet = columns.take(kept)
+    pets = generate_pets(30, seed=2)
+    fresh = VetMatchingSystem(None)
+    fresh.sync_from_columns(sheet)
+
+    # Retiring two thirds of the rows crosses the compaction threshold
+    system.sync_from_columns(sheet)
+
+    snapshot = system.snapshot
+    assert snapshot.size == snapshot.live_count == len(kept)
+    assert _rankings(system, pets) == _rankings(fresh, pets)
+    assert system.sync_from_columns(sheet) == (0, 0, 0)
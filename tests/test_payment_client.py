@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from payment_client import AsyncPaymentClient, GatewayError, PaymentWorker
+from stub_gateway import StubGateway
+
+
+def _run(gateway, scenario):
+    async def main():
+        server = await gateway.start(port=0)
+        client = AsyncPaymentClient(f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}", backoff=0.001)
+        try:
+            return await scenario(client)
+        finally:
+            await client.close()
+            server.close()
+            await server.wait_closed()
+    return asyncio.run(main())
+
+
+def test_retry_after_lost_response_does_not_charge_twice():
+    # Every first response is lost after the charge went through
+    gateway = StubGateway(latency=0, jitter=0, lost_rate=1.0, seed=0)
+    result = _run(gateway, lambda client: client.charge(39900, "upi", None, "key-1"))
+    assert result.succeeded and result.replayed
+    assert result.attempts == 2
+    assert gateway.stats["charges"] == 1
+
+
+def test_transient_errors_are_retried_once_per_key():
+    gateway = StubGateway(latency=0, jitter=0, error_rate=0.5, seed=3)
+
+    async def scenario(client):
+        client.max_retries = 10
+        return await asyncio.gather(*(client.charge(100, "upi", None, f"key-{i}") for i in range(20)))
+
+    results = _run(gateway, scenario)
+    assert all(result.succeeded for result in results)
+    assert gateway.stats["errors"] > 0
+    assert gateway.stats["charges"] == 20
+
+
+def test_duplicate_calls_share_one_charge():
+    gateway = StubGateway(latency=0.02, jitter=0, seed=0)
+
+    async def scenario(client):
+        return await asyncio.gather(*(client.charge(100, "upi", None, "same-key") for _ in range(5)))
+
+    results = _run(gateway, scenario)
+    assert len({result.payment_id for result in results}) == 1
+    assert gateway.stats["charges"] == 1
+
+
+def test_key_reused_for_another_charge_is_rejected():
+    gateway = StubGateway(latency=0, jitter=0, seed=0)
+
+    async def scenario(client):
+        await client.charge(100, "upi", None, "key-1")
+        await client.charge(100, "netbanking", {"bank": "SBI"}, "key-1")
+
+    with pytest.raises(GatewayError) as error:
+        _run(gateway, scenario)
+    assert error.value.status == 409
+    assert gateway.stats["charges"] == 1
+
+
+def test_worker_without_a_gateway_serves_its_own_stub():
+    worker = PaymentWorker(None)
+    try:
+        result = worker.charge(39900, "upi", None, "key-1").result(10)
+        assert result.succeeded
+        assert worker.status(result.payment_id).result(10).payment_id == result.payment_id
+    finally:
+        worker.close()
+    assert not worker._thread.is_alive()
@@ -0,0 +1,84 @@
+import pytest
+
+import query_cache
+from models import Location, Pet, VetDoctor
+from query_cache import QueryCache
+from vet_core import VetMatchingSystem
+
+DELHI = Location(28.61, 77.21)
+MUMBAI = Location(19.07, 72.87)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(query_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_searches_from_the_same_cell_share_an_entry():
+    cache = QueryCache()
+    key = cache.key(DELHI, "Dogs", 25)
+    cache.put(key, ["result"], DELHI, 25)
+
+    assert cache.key(Location(28.6101, 77.2101), "canine", 25) == key
+    assert cache.get(key) == ["result"]
+    assert cache.get(cache.key(DELHI, "dog", 30)) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = QueryCache(max_entries=2)
+    keys = [cache.key(DELHI, "dog", radius) for radius in (10, 20, 30)]
+    cache.put(keys[0], 0, DELHI, 10)
+    cache.put(keys[1], 1, DELHI, 20)
+    cache.get(keys[0])
+    cache.put(keys[2], 2, DELHI, 30)
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == 0 and cache.get(keys[2]) == 2
+    assert cache.evictions == 1
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = QueryCache(ttl=60)
+    key = cache.key(DELHI, "dog", 25)
+    cache.put(key, 1, DELHI, 25)
+    clock[0] += 59
+    assert cache.get(key) == 1
+    clock[0] += 2
+    assert cache.get(key) is None
+    assert cache.expirations == 1
+
+
+def test_invalidate_near_only_drops_searches_that_reach_the_location():
+    cache = QueryCache()
+    delhi, mumbai = cache.key(DELHI, "dog", 25), cache.key(MUMBAI, "dog", 25)
+    cache.put(delhi, 1, DELHI, 25)
+    cache.put(mumbai, 2, MUMBAI, 25)
+
+    cache.invalidate_near(Location(28.7, 77.3))
+
+    assert cache.get(delhi) is None
+    assert cache.get(mumbai) == 2
+
+
+def test_results_from_before_an_invalidation_are_not_stored():
+    cache = QueryCache()
+    key = cache.key(DELHI, "dog", 25)
+    generation = cache.generation
+    cache.invalidate_near(MUMBAI)
+    cache.put(key, 1, DELHI, 25, generation)
+
+    assert cache.get(key) is None
+
+
+def test_adding_a_doctor_refreshes_cached_searches_around_it():
+    system = VetMatchingSystem(None, query_cache=QueryCache())
+    system.add_doctor(VetDoctor("Dr A", ["Dog"], 5, 4.0, Location(28.62, 77.22), "1"))
+    pet = Pet("Rex", "Dog", 3, 20, [], [], DELHI)
+    assert [m.doctor.name for m in system.rank_doctors(pet, 25)] == ["Dr A"]
+
+    system.add_doctor(VetDoctor("Dr B", ["Dog"], 20, 5.0, Location(28.60, 77.20), "2"))
+
+    assert [m.doctor.name for m in system.rank_doctors(pet, 25)] == ["Dr B", "Dr A"]
@@ -0,0 +1,87 @@
+import pytest
+
+from models import Location, Pet, VetDoctor
+from road_graph import RoadGraph, TravelTable
+from vet_core import VetMatchingSystem
+
+LAT, LON, STEP, SIZE = 28.50, 77.00, 0.005, 41
+
+
+def _node(row, col):
+    return 1000 + row * SIZE + col
+
+
+@pytest.fixture(scope="module")
+def graph(tmp_path_factory):
+    # A street grid split by a river between columns 20 and 21, bridged only on row 0
+    lines = ["<osm>"]
+    lines += [f'<node id="{_node(r, c)}" lat="{LAT + r * STEP}" lon="{LON + c * STEP}"/>'
+              for r in range(SIZE) for c in range(SIZE)]
+    streets = [[(r, c) for c in cols] for r in range(SIZE)
+               for cols in ([range(SIZE)] if r == 0 else [range(21), range(21, SIZE)])]
+    streets += [[(r, c) for r in range(SIZE)] for c in range(SIZE)]
+    for way_id, street in enumerate(streets):
+        refs = "".join(f'<nd ref="{_node(r, c)}"/>' for r, c in street)
+        lines.append(f'<way id="{way_id}">{refs}<tag k="highway" v="residential"/></way>')
+    lines.append("</osm>")
+    path = tmp_path_factory.mktemp("osm") / "grid.osm"
+    path.write_text("\n".join(lines))
+    return RoadGraph.from_osm(str(path))
+
+
+def _doctors():
+    return [VetDoctor("Dr East", ["Dog"], 10, 4.5, Location(LAT + 30 * STEP, LON + 22 * STEP), "1"),
+            VetDoctor("Dr West", ["Dog"], 10, 4.5, Location(LAT + 30 * STEP, LON + 14 * STEP), "2"),
+            VetDoctor("Dr Far", ["Dog"], 10, 4.5, Location(30.5, 79.0), "3")]
+
+
+@pytest.fixture
+def system():
+    system = VetMatchingSystem(None)
+    for doctor in _doctors():
+        system.add_doctor(doctor)
+    return system
+
+
+PET = Pet("Rex", "dog", 3, 10, [], [], Location(LAT + 30 * STEP + 0.001, LON + 19 * STEP))
+
+
+def _ranked(system, pet=PET, max_distance=20):
+    return [(m.doctor.name, round(m.distance, 2)) for m in system.rank_doctors(pet, max_distance)]
+
+
+def test_ranking_follows_the_roads(graph, system):
+    assert [name for name, _ in _ranked(system)] == ["Dr East", "Dr West"]
+    system.use_travel_table(TravelTable.build(graph, system.snapshot.table, max_km=25))
+
+    # Dr East is across the river, the detour over the bridge puts it out of range
+    [(name, distance)] = _ranked(system)
+    assert name == "Dr West" and distance > PET.location.distance_to(_doctors()[1].location)
+
+
+def test_uncovered_searches_and_doctors_use_straight_lines(graph, system):
+    system.use_travel_table(TravelTable.build(graph, system.snapshot.table, max_km=25))
+    outside = Pet("Rex", "dog", 3, 10, [], [], Location(29.5, 78.0))
+    straight = VetMatchingSystem(None)
+    for doctor in _doctors():
+        straight.add_doctor(doctor)
+    assert _ranked(system, outside, 200) == _ranked(straight, outside, 200)
+
+    system.add_doctor(VetDoctor("Dr New", ["Dog"], 10, 4.5, Location(LAT + 30 * STEP, LON + 20 * STEP), "4"))
+    assert [name for name, _ in _ranked(system)] == ["Dr New", "Dr West"]
+
+
+def test_saved_table_only_loads_for_its_directory(graph, system, tmp_path):
+    path = str(tmp_path / "travel.npz")
+    table = TravelTable.build(graph, system.snapshot.table, max_km=25)
+    table.save(path)
+
+    loaded = TravelTable.load(path, system.snapshot.table)
+    assert loaded.fingerprint == table.fingerprint
+    assert (loaded.doctor_ids == table.doctor_ids).all() and (loaded.distances == table.distances).all()
+
+    other = VetMatchingSystem(None)
+    for doctor in reversed(_doctors()):
+        other.add_doctor(doctor)
+    with pytest.raises(ValueError):
+        TravelTable.load(path, other.snapshot.table)
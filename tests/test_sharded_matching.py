@@ -0,0 +1,70 @@
+import os
+import signal
+import time
+
+import pytest
+
+from sharded_matching import ShardFailure
+from synthetic_directory import generate_columns, generate_pets
+from vet_core import VetMatchingSystem
+
+pytestmark = pytest.mark.skipif(not hasattr(signal, "SIGKILL"), reason="needs POSIX signals")
+
+
+@pytest.fixture
+def system():
+    system = VetMatchingSystem(None)
+    system.add_doctor_columns(generate_columns(5000, seed=0))
+    yield system
+    system.disable_sharding()
+
+
+def _names(system, pets):
+    return [[match.doctor.name for match in system.rank_doctors(pet, 25, 10)] for pet in pets]
+
+
+def test_dead_worker_falls_back_to_in_process_ranking(system):
+    pets = generate_pets(30, seed=2)
+    expected = _names(system, pets)
+    system.enable_sharding(2)
+    sharded = system._sharded
+    assert _names(system, pets) == expected
+
+    os.kill(sharded._workers[0].pid, signal.SIGKILL)
+    start = time.perf_counter()
+    assert _names(system, pets) == expected
+    assert time.perf_counter() - start < 10
+    assert sharded.failed is not None
+    with pytest.raises(ShardFailure):
+        sharded.rank_many(pets, 25, 10)
+
+    batch = [[doctor.name for doctor in doctors[:10]] for _, doctors in system.find_best_doctors_batch(pets, 25)]
+    assert batch == expected
+
+
+def test_failed_matcher_is_rebuilt(system):
+    pets = generate_pets(10, seed=3)
+    expected = _names(system, pets)
+    system.enable_sharding(2)
+    sharded = system._sharded
+    os.kill(sharded._workers[1].pid, signal.SIGKILL)
+    _names(system, pets)
+
+    deadline = time.time() + 30
+    while (system._sharded is sharded or system._sharded is None) and time.time() < deadline:
+        time.sleep(0.05)
+    assert system._sharded is not sharded and system._sharded.failed is None
+    assert _names(system, pets) == expected
+
+
+def test_stuck_worker_times_out(system):
+    pets = generate_pets(5, seed=4)
+    system.enable_sharding(2)
+    sharded = system._sharded
+    os.kill(sharded._workers[0].pid, signal.SIGSTOP)
+    try:
+        with pytest.raises(ShardFailure):
+            sharded.rank_many(pets, 2000, 5, timeout=0.5)
+        assert sharded.failed is not None
+    finally:
+        os.kill(sharded._workers[0].pid, signal.SIGCONT)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from models import Location
+from spatial_index import GridSpatialIndex
+
+
+def _points(seed=0):
+    rng = np.random.default_rng(seed)
+    spread = [(rng.uniform(-90, 90, 2000), rng.uniform(-180, 180, 2000))]
+    # Dense clusters around both poles and across the antimeridian
+    for latitude, longitude in ((89.5, 0), (-89.5, 0), (0, 180), (65, -180)):
+        spread.append((np.clip(latitude + rng.normal(0, 0.5, 500), -90, 90),
+                       (longitude + rng.normal(0, 0.5, 500) + 180) % 360 - 180))
+    latitudes = np.concatenate([lat for lat, _ in spread])
+    longitudes = np.concatenate([lon for _, lon in spread])
+    return [Location(float(lat), float(lon)) for lat, lon in zip(latitudes, longitudes)]
+
+
+@pytest.fixture(scope="module")
+def points():
+    return _points()
+
+
+@pytest.mark.parametrize("cell_size", [0.1, 1.0])
+@pytest.mark.parametrize("center", [(90, 0), (-90, 45), (89.9, 179.9), (-89.7, -120),
+                                    (0, 179.99), (0, -180), (65.2, 179.5), (-33.9, 151.2), (28.6, 77.2)])
+@pytest.mark.parametrize("radius", [5, 50, 500])
+def test_query_finds_everything_a_haversine_scan_finds(points, cell_size, center, radius):
+    index = GridSpatialIndex(cell_size)
+    for doctor_id, location in enumerate(points):
+        index.insert(doctor_id, location)
+    location = Location(*center)
+
+    candidates = index.query(location, radius)
+    expected = [i for i, point in enumerate(points) if location.distance_to(point) <= radius]
+
+    assert candidates == sorted(candidates)
+    assert set(expected) <= set(candidates)
+
+
+def test_insert_many_matches_insert(points):
+    one_by_one, bulk = GridSpatialIndex(0.5), GridSpatialIndex(0.5)
+    for doctor_id, location in enumerate(points):
+        one_by_one.insert(doctor_id, location)
+    bulk.insert_many(range(len(points)), [p.latitude for p in points], [p.longitude for p in points])
+
+    assert len(bulk) == len(one_by_one) == len(points)
+    for center in ((90, 0), (0, 180), (45.5, -179.9)):
+        assert bulk.query(Location(*center), 300) == one_by_one.query(Location(*center), 300)
@@ -0,0 +1,60 @@
+import pytest
+
+from models import Location, Pet, VetDoctor
+from sqlite_store import SQLiteDoctorStore
+from synthetic_directory import generate_columns, generate_pets, write_directory
+from vet_core import VetMatchingSystem
+
+
+@pytest.fixture(scope="module")
+def directory(tmp_path_factory):
+    path = tmp_path_factory.mktemp("directory") / "vets.csv"
+    write_directory(generate_columns(3000, seed=0), str(path))
+    return path
+
+
+@pytest.fixture
+def store(directory, tmp_path):
+    with SQLiteDoctorStore(str(tmp_path / "vets.db")) as store:
+        assert store.import_spreadsheet(str(directory), chunk_rows=700, processes=1) == 3000
+        yield store
+
+
+@pytest.fixture(scope="module")
+def system(directory):
+    return VetMatchingSystem(str(directory))
+
+
+def _matches(matches):
+    return [(m.doctor.name, m.doctor.contact, round(m.distance, 6), round(m.score, 6), m.is_specialist)
+            for m in matches]
+
+
+def _pets():
+    pets = generate_pets(40, seed=3)
+    pets[0].symptoms = ["limping", "skin rash"]
+    pets[1].symptoms = ["vomiting"]
+    return pets
+
+
+def test_store_ranks_like_the_in_memory_directory(store, system):
+    for pet in _pets():
+        weights = system.symptom_matcher.pet_weights(pet)
+        for limit, offset in ((None, 0), (5, 0), (5, 5)):
+            expected = system.rank_doctors(pet, 60, limit, offset)
+            assert _matches(store.rank_doctors(pet, 60, limit, offset, weights)) == _matches(expected)
+
+
+def test_added_and_removed_doctors_show_up_in_queries(store):
+    pet = Pet("Rex", "dog", 3, 10, [], [], Location(-45.0, 170.0))
+    assert store.rank_doctors(pet, 10) == []
+
+    doctor_id = store.add_doctor(VetDoctor("Dr New", ["Dog"], 12, 4.8, Location(-45.01, 170.01), "555"))
+    assert doctor_id == 3000 and len(store) == 3001
+    [match] = store.rank_doctors(pet, 10)
+    assert (match.doctor.name, match.is_specialist) == ("Dr New", True)
+
+    store.remove_doctor(doctor_id)
+    assert store.rank_doctors(pet, 10) == []
+    with pytest.raises(KeyError):
+        store.remove_doctor(doctor_id)
@@ -0,0 +1,68 @@
+import random
+import re
+
+import pytest
+
+from models import Location, Pet, VetDoctor
+from symptom_matcher import SYMPTOM_SPECIALIZATIONS, SymptomAutomaton, SymptomMatcher
+from vet_core import VetMatchingSystem
+
+KEYWORDS = list(SYMPTOM_SPECIALIZATIONS)
+
+
+def _regex_scan(text):
+    found = set()
+    for keyword_id, keyword in enumerate(KEYWORDS):
+        word = re.escape(keyword.rstrip("*"))
+        end = "" if keyword.endswith("*") else r"(?![^\W_])"
+        if re.search(r"(?<![^\W_])" + word + end, text):
+            found.add(keyword_id)
+    return found
+
+
+def test_automaton_finds_what_a_regex_scan_finds():
+    automaton = SymptomAutomaton(KEYWORDS)
+    rng = random.Random(0)
+    words = [keyword.rstrip("*") for keyword in KEYWORDS] + ["ing", "s", "dog", "not", "hair", "the", "x"]
+    for _ in range(500):
+        text = "".join(rng.choice(words) + rng.choice(["", " ", " ", ", ", "\n"]) for _ in range(rng.randint(1, 8)))
+        assert set(automaton.scan(text)) == _regex_scan(text), text
+
+
+def test_keywords_match_whole_words_unless_starred():
+    automaton = SymptomAutomaton(["fever", "vomit*"])
+    assert automaton.scan("high fever") == [0]
+    assert automaton.scan("feverish") == []
+    assert automaton.scan("vomiting since monday") == [1]
+    assert automaton.scan("nonvomiting") == []
+
+
+def test_weights_ignore_order_case_and_repeats():
+    matcher = SymptomMatcher()
+    weights = matcher.weights(["Vomiting", "itchy skin"])
+    assert weights == (("dermatology", 0.8), ("gastroenterology", 0.8))
+    assert matcher.weights(["ITCHY   skin", "vomiting", "vomiting"]) is weights
+    assert matcher.weights([], []) == ()
+
+
+def test_history_counts_less_and_the_strongest_hint_wins():
+    matcher = SymptomMatcher()
+    assert matcher.weights([], ["hair loss"]) == (("dermatology", 0.5),)
+    assert matcher.weights(["scratching"], ["hair loss"]) == (("dermatology", 0.6),)
+
+
+def test_cache_stays_bounded():
+    matcher = SymptomMatcher(max_entries=3)
+    for day in range(10):
+        matcher.weights([f"vomiting on day {day}"])
+    assert len(matcher._cache) == 3
+
+
+@pytest.mark.parametrize("symptoms, first", [([], "Dr Skin"), (["diarrhoea"], "Dr Gut")])
+def test_symptoms_lift_matching_specialists(symptoms, first):
+    system = VetMatchingSystem(None)
+    system.add_doctor(VetDoctor("Dr Skin", ["Dog", "Dermatology"], 10, 4.6, Location(28.60, 77.20), "1"))
+    system.add_doctor(VetDoctor("Dr Gut", ["Dog", "Gastroenterology"], 10, 4.5, Location(28.60, 77.20), "2"))
+    pet = Pet("Rex", "dog", 3, 10, symptoms, [], Location(28.61, 77.21))
+
+    assert [match.doctor.name for match in system.rank_doctors(pet, 25)][0] == first
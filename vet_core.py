@@ -0,0 +1,651 @@
+from typing import Iterable, Iterator, List, Optional, Tuple
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from models import DoctorMatch, Pet, VetDoctor
+from doctor_table import DoctorTable
+from spatial_index import GridSpatialIndex
+from ranking import rank_matches, rank_scored, score_candidates
+from batch_matching import chunked, iter_batch_rankings
+from doctor_cache import load_doctor_columns
+from diagnostics import TraceSampler, logger
+from query_cache import QueryCache
+from directory import DirectorySnapshot, DirectoryView, DirectoryWatcher, sheet_keys
+from instrumentation import Instrumentation
+from road_graph import rank_matches_by_travel
+from candidate_cells import DEFAULT_CELL_SIZE_DEG, DEFAULT_RADII, DEFAULT_SPECIES, CandidateCells
+from sqlite_store import SQLiteDoctorStore, is_sqlite_path
+from symptom_matcher import SymptomMatcher, SymptomWeights
+from appointments import AVAILABILITY_BONUS, AVAILABILITY_HORIZON, AppointmentInventory, AvailabilityView
+
+class VetMatchingSystem:
+    # Retired rows are compacted away once they outnumber live rows by this much
+    COMPACT_MIN_RETIRED = 1024
+
+    def __init__(self, database_path: Optional[str] = 'vets_database.xlsx', query_cache: Optional[QueryCache] = None,
+                 instrumentation: Optional[Instrumentation] = None,
+                 symptom_matcher: Optional[SymptomMatcher] = None):
+        self.trace_sampler = TraceSampler()
+        # Metrics and profiler hook, off unless VET_TRACKER_METRICS is set or enable() is called
+        self.instrumentation = instrumentation or Instrumentation.from_env()
+        # Optional result cache, searches from the same geohash cell share ranked results
+        self.query_cache = query_cache
+        # Boosts doctors whose specializations fit the pet's symptoms, set to None to rank without it
+        self.symptom_matcher = symptom_matcher or SymptomMatcher()
+        # Set when the database could not be loaded, front ends decide how to report it
+        self.load_error = None
+        
+        # Writers serialize on this lock and publish a new snapshot, queries read one snapshot
+        self._write_lock = threading.RLock()
+        self._alive = np.zeros(1024, dtype=bool)
+        # Spreadsheet row key -> doctor id, for diffing reloads
+        self._sheet_rows = {}
+        # The reverse, doctor id -> spreadsheet row key, kept in step with _sheet_rows
+        self._sheet_keys = {}
+        # Array-backed table, indexing it yields lightweight VetDoctor-like row views
+        self._snapshot = DirectorySnapshot(DoctorTable(), GridSpatialIndex(), 0, self._alive[:0], 0, 0)
+        # Multi-process matcher for the current snapshot, see enable_sharding
+        self._sharded = None
+        self._shard_count = 0
+        self._shard_lock = threading.Lock()
+        self._shard_refreshing = False
+        # Optional road_graph.TravelTable, ranks by road distance instead of the straight line
+        self.travel_table = None
+        # Pre-ranked candidates per grid cell for popular searches, see enable_candidate_cells
+        self.candidate_cells = None
+        self._cells_lock = threading.Lock()
+        self._cells_refreshing = False
+        # SQLite-backed directory, when set queries are answered from disk instead of the snapshot
+        self.store = None
+        # Appointment slots to filter on or boost near-term availability with, see use_appointments
+        self.appointments = None
+        self._availability = None
+        self._booked = None
+        self.availability_boost = 0.0
+        self.availability_horizon = AVAILABILITY_HORIZON
+        # None starts with an empty directory, e.g. for add_doctor_columns
+        if database_path is None:
+            pass
+        elif is_sqlite_path(database_path):
+            self.open_store(database_path)
+        else:
+            self.load_doctors_from_excel(database_path)
+
+    @property
+    def doctor_count(self) -> int:
+        return len(self.store) if self.store is not None else self._snapshot.live_count
+
+    @property
+    def snapshot(self) -> DirectorySnapshot:
+        return self._snapshot
+
+    @property
+    def doctors(self) -> DirectoryView:
+        return self._snapshot.doctors
+
+    @property
+    def doctor_arrays(self) -> DoctorTable:
+        return self._snapshot.table
+
+    @property
+    def spatial_index(self) -> GridSpatialIndex:
+        return self._snapshot.spatial_index
+
+    @property
+    def specialization_index(self):
+        return self._snapshot.table.specialization_index
+        
+    def load_doctors_from_excel(self, path: str = 'vets_database.xlsx'):
+        try:
+            self.reload_doctors_from_excel(path)
+        except Exception as e:
+            logger.exception("Error loading doctors")
+            self.load_error = e
+
+    def open_store(self, path: str, pool_size: int = 4):
+        try:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"{path} does not exist, create it with sqlite_store.py")
+            self.store = SQLiteDoctorStore(path, pool_size)
+            logger.info("Serving %d doctors from %s", len(self.store), path)
+        except (OSError, sqlite3.Error) as e:
+            logger.exception("Error opening doctor store")
+            self.load_error = e
+
+    def reload_doctors_from_excel(self, path: str = 'vets_database.xlsx'):
+        # Applies only the differences between the spreadsheet and the loaded directory
+        instrumentation = self.instrumentation
+        with instrumentation.call():
+            start = time.perf_counter()
+            columns = load_doctor_columns(path)
+            source = "cache" if columns.from_cache else "spreadsheet"
+            if instrumentation.enabled:
+                instrumentation.load_stage_seconds.observe(time.perf_counter() - start, source)
+            logger.info("Found %d doctors in database (%s)", len(columns), source)
+            # A fresh parse already logged its IngestReport, the compiled cache only keeps the count
+            if columns.rejected_rows and columns.from_cache:
+                logger.warning("Skipped %d rows with missing or invalid values", columns.rejected_rows)
+            instrumentation.record_load(len(columns), columns.rejected_rows)
+            with instrumentation.stage("sync"):
+                return self.sync_from_columns(columns)
+
+    def sync_from_columns(self, columns):
+        with self._write_lock:
+            table = self._snapshot.table
+            keys = sheet_keys(columns.names, columns.contacts)
+            new_positions, kept_ids, kept_positions = [], [], []
+            for position, key in enumerate(keys):
+                doctor_id = self._sheet_rows.get(key)
+                if doctor_id is None:
+                    new_positions.append(position)
+                else:
+                    kept_ids.append(doctor_id)
+                    kept_positions.append(position)
+            
+            changed = ~table.same_rows(kept_ids, columns, kept_positions)
+            changed_positions = np.asarray(kept_positions, dtype=np.intp)[changed].tolist()
+            retired = np.asarray(kept_ids, dtype=np.intp)[changed].tolist()
+            present = set(keys)
+            removed_keys = [key for key in self._sheet_rows if key not in present]
+            retired.extend(self._sheet_rows.pop(key) for key in removed_keys)
+            for doctor_id in retired:
+                del self._sheet_keys[doctor_id]
+            
+            appended = new_positions + changed_positions
+            ids = self._append_columns(columns.take(appended)) if appended else []
+            for position, doctor_id in zip(appended, np.asarray(ids).tolist()):
+                self._sheet_rows[keys[position]] = doctor_id
+                self._sheet_keys[doctor_id] = keys[position]
+            self._publish(retired, ids)
+            logger.info("Directory sync: %d added, %d updated, %d removed",
+                        len(new_positions), len(changed_positions), len(removed_keys))
+            self.instrumentation.record_sync(len(new_positions), len(changed_positions), len(removed_keys))
+            return len(new_positions), len(changed_positions), len(removed_keys)
+            
+    def add_doctor_columns(self, columns):
+        # Bulk version of add_doctor for column data from doctor_cache
+        with self._write_lock:
+            ids = self._append_columns(columns)
+            self._publish([], ids)
+            return ids
+            
+    def add_doctor(self, doctor: VetDoctor) -> int:
+        if self.store is not None:
+            doctor_id = self.store.add_doctor(doctor)
+            if self.query_cache is not None:
+                self.query_cache.invalidate_near(doctor.location)
+            return doctor_id
+        with self._write_lock:
+            doctor_id = self._append(doctor)
+            self._publish([], [doctor_id])
+            return doctor_id
+
+    def update_doctor(self, doctor_id: int, doctor: VetDoctor) -> int:
+        # Rows are immutable, an update retires the old row and returns the new doctor id
+        if self.store is not None:
+            self.remove_doctor(doctor_id)
+            return self.add_doctor(doctor)
+        with self._write_lock:
+            self._check_live(doctor_id)
+            new_id = self._append(doctor)
+            key = self._sheet_keys.pop(doctor_id, None)
+            if key is not None:
+                self._sheet_rows[key] = new_id
+                self._sheet_keys[new_id] = key
+            self._publish([doctor_id], [new_id])
+            return new_id
+
+    def remove_doctor(self, doctor_id: int):
+        if self.store is not None:
+            self.store.remove_doctor(doctor_id)
+            # The store does not hand back the old location, so drop every cached page
+            if self.query_cache is not None:
+                self.query_cache.clear()
+            return
+        with self._write_lock:
+            self._check_live(doctor_id)
+            key = self._sheet_keys.pop(doctor_id, None)
+            if key is not None:
+                del self._sheet_rows[key]
+            self._publish([doctor_id], [])
+
+    def watch_database(self, path: str = 'vets_database.xlsx', interval: float = 2.0) -> DirectoryWatcher:
+        return DirectoryWatcher(self, path, interval).start()
+
+    def _check_live(self, doctor_id: int):
+        if doctor_id not in self._snapshot.doctors:
+            raise KeyError(f"no live doctor with id {doctor_id}")
+
+    def _append(self, doctor: VetDoctor) -> int:
+        snapshot = self._snapshot
+        doctor_id = snapshot.table.append(doctor)
+        snapshot.spatial_index.insert(doctor_id, doctor.location)
+        return doctor_id
+
+    def _append_columns(self, columns):
+        snapshot = self._snapshot
+        ids = snapshot.table.extend_columns(columns)
+        snapshot.spatial_index.insert_many(ids, columns.latitude, columns.longitude)
+        return ids
+
+    def _publish(self, retired, added):
+        # Makes appended rows visible and retires rows, without touching published snapshots
+        old = self._snapshot
+        table = old.table
+        size = table.size
+        if len(self._alive) < size:
+            grown = np.zeros(max(size, 2 * len(self._alive)), dtype=bool)
+            grown[:old.size] = self._alive[:old.size]
+            self._alive = grown
+        if len(retired):
+            # Copy on write, older snapshots keep their alive mask
+            self._alive = self._alive.copy()
+            self._alive[retired] = False
+        self._alive[old.size:size] = True
+        live_count = old.live_count + (size - old.size) - len(retired)
+        self._snapshot = DirectorySnapshot(table, old.spatial_index, size, self._alive[:size],
+                                           live_count, old.version + 1)
+        self._invalidate_cache(old, retired, added)
+        
+        if size - live_count > max(self.COMPACT_MIN_RETIRED, live_count):
+            self.compact()
+            return
+        if self._shard_count:
+            self._refresh_shards()
+        cells = self.candidate_cells
+        if cells is not None and not cells.add(self._snapshot, added):
+            self._refresh_candidate_cells()
+
+    def _invalidate_cache(self, old, retired, added):
+        cache = self.query_cache
+        if cache is None:
+            return
+        changed = len(retired) + len(added)
+        if changed > 256:
+            cache.clear()
+            return
+        table = self._snapshot.table
+        for doctor_id in list(retired) + list(np.asarray(added).tolist()):
+            cache.invalidate_near(table[doctor_id].location)
+
+    def compact(self):
+        # Rebuilds the table and index from live rows only, doctor ids are renumbered
+        with self._write_lock, self.instrumentation.stage("compact"):
+            old = self._snapshot
+            live_ids = np.flatnonzero(old.alive)
+            table = DoctorTable(max(1024, len(live_ids)))
+            spatial_index = GridSpatialIndex(old.spatial_index.cell_size_deg)
+            columns = old.table.columns(live_ids)
+            ids = table.extend_columns(columns)
+            spatial_index.insert_many(ids, columns.latitude, columns.longitude)
+            
+            renumber = dict(zip(live_ids.tolist(), np.asarray(ids).tolist()))
+            self._sheet_rows = {key: renumber[doctor_id] for key, doctor_id in self._sheet_rows.items()}
+            self._sheet_keys = {doctor_id: key for key, doctor_id in self._sheet_rows.items()}
+            self._alive = np.ones(max(1024, len(live_ids)), dtype=bool)
+            self._snapshot = DirectorySnapshot(table, spatial_index, len(live_ids), self._alive[:len(live_ids)],
+                                               len(live_ids), old.version + 1)
+            if self.query_cache is not None:
+                self.query_cache.clear()
+            logger.info("Compacted directory to %d doctors", len(live_ids))
+            if self.travel_table is not None:
+                # The table is keyed on doctor ids, which compaction renumbers
+                logger.warning("Dropped the travel table after compaction, rebuild it to rank by road distance")
+                self.travel_table = None
+            if self._shard_count:
+                self._refresh_shards()
+            if self.candidate_cells is not None:
+                self._refresh_candidate_cells()
+
+    def use_travel_table(self, travel_table):
+        # None goes back to straight-line distances
+        self.travel_table = travel_table
+        if self.query_cache is not None:
+            self.query_cache.clear()
+
+    def enable_sharding(self, shards: Optional[int] = None):
+        # Serves rank_doctors from worker processes that each own a geographic shard
+        from sharded_matching import ShardedMatcher
+        with self._write_lock:
+            self.disable_sharding()
+            self._sharded = ShardedMatcher(self._snapshot, shards)
+            self._shard_count = self._sharded.shard_count
+
+    def disable_sharding(self):
+        self._shard_count = 0
+        sharded, self._sharded = self._sharded, None
+        if sharded is not None:
+            sharded.close()
+
+    def _refresh_shards(self):
+        # Shard workers are rebuilt in the background, queries rank in-process until they catch up
+        with self._shard_lock:
+            if self._shard_refreshing:
+                return
+            self._shard_refreshing = True
+        threading.Thread(target=self._refresh_shards_loop, name="vet-shard-refresh", daemon=True).start()
+
+    def _refresh_shards_loop(self):
+        from sharded_matching import ShardedMatcher
+        try:
+            while self._shard_count:
+                snapshot = self._snapshot
+                current = self._sharded
+                if current is not None and current.version == snapshot.version and current.failed is None:
+                    break
+                matcher = ShardedMatcher(snapshot, self._shard_count)
+                old, self._sharded = self._sharded, matcher
+                if old is not None:
+                    old.close()
+        except Exception:
+            logger.exception("Could not rebuild shard workers")
+            return
+        finally:
+            with self._shard_lock:
+                self._shard_refreshing = False
+        # A write may have landed after the last version check
+        sharded = self._sharded
+        if self._shard_count and sharded is not None and (sharded.version != self._snapshot.version
+                                                          or sharded.failed is not None):
+            self._refresh_shards()
+        
+    def enable_candidate_cells(self, species: Iterable[str] = DEFAULT_SPECIES,
+                               radii: Iterable[float] = DEFAULT_RADII,
+                               cell_size_deg: float = DEFAULT_CELL_SIZE_DEG) -> CandidateCells:
+        # Precomputes candidate lists for these species and radii, other searches are unaffected.
+        # The build reads one snapshot without the write lock, so writers aren't held up meanwhile.
+        with self.instrumentation.stage("cells"):
+            snapshot = self._snapshot
+            cells = CandidateCells(species, radii, cell_size_deg).build(snapshot)
+        with self._write_lock:
+            current = self._snapshot
+            self.candidate_cells = cells
+            if not cells.add(current, range(snapshot.size, current.size)):
+                # Compacted or bulk loaded during the build, queries skip the cells until rebuilt
+                self._refresh_candidate_cells()
+        return cells
+
+    def disable_candidate_cells(self):
+        self.candidate_cells = None
+
+    def _refresh_candidate_cells(self):
+        # Bulk changes rebuild the cells in the background, queries skip them until they catch up
+        with self._cells_lock:
+            if self._cells_refreshing:
+                return
+            self._cells_refreshing = True
+        threading.Thread(target=self._refresh_candidate_cells_loop, name="vet-cells-refresh", daemon=True).start()
+
+    def _refresh_candidate_cells_loop(self):
+        try:
+            while True:
+                cells = self.candidate_cells
+                snapshot = self._snapshot
+                if cells is None or cells.covers(snapshot):
+                    break
+                rebuilt = cells.like().build(snapshot)
+                with self._write_lock:
+                    # Catch up on rows added during the build, or go round again after bulk changes
+                    current = self._snapshot
+                    if self.candidate_cells is cells and rebuilt.add(current, range(snapshot.size, current.size)):
+                        self.candidate_cells = rebuilt
+        except Exception:
+            logger.exception("Could not rebuild candidate cells")
+        finally:
+            with self._cells_lock:
+                self._cells_refreshing = False
+        # A write may have landed after the last coverage check
+        cells = self.candidate_cells
+        if cells is not None and not cells.covers(self._snapshot):
+            self._refresh_candidate_cells()
+
+    def use_appointments(self, inventory: Optional[AppointmentInventory], boost: float = AVAILABILITY_BONUS,
+                         horizon: float = AVAILABILITY_HORIZON):
+        # Doctors with a free slot within horizon seconds score boost points more, and
+        # rank_doctors(available_within=...) can filter on free slots. None switches it off.
+        # Cells and shards don't know about slots, so they step aside while boost is on.
+        self.appointments = inventory
+        self._availability = AvailabilityView(inventory) if inventory is not None else None
+        # Change feed token for dropping cached searches around doctors whose slots moved
+        self._booked = inventory.subscribe() if inventory is not None else None
+        self.availability_boost = boost
+        self.availability_horizon = horizon
+        if self.query_cache is not None:
+            self.query_cache.clear()
+
+    def _availability_bonus(self, snapshot, now: float):
+        # Score term for rank_matches, None when availability doesn't change scores
+        view, boost = self._availability, self.availability_boost
+        if view is None or not boost:
+            return None
+        deadline = now + self.availability_horizon
+        return lambda ids: boost * (view.earliest(snapshot, ids, now) <= deadline)
+
+    def _invalidate_booked(self, cache: QueryCache):
+        # Holds, bookings and releases only touch the searches that could reach their doctor
+        changed = self.appointments.changes(self._booked)
+        if changed:
+            for location in self._availability.locations(changed):
+                cache.invalidate_near(location)
+
+    @property
+    def filters_availability(self) -> bool:
+        # Whether rank_doctors accepts available_within
+        return self._availability is not None and self.store is None
+
+    def rank_doctors(self, pet: Pet, max_distance: float, limit: Optional[int] = None,
+                     offset: int = 0, available_within: Optional[float] = None) -> List[DoctorMatch]:
+        # available_within keeps only doctors with a free appointment slot starting within
+        # that many seconds, it needs use_appointments and the in-memory directory
+        instrumentation = self.instrumentation
+        if not instrumentation.active:
+            return self._rank_doctors(pet, max_distance, limit, offset, available_within=available_within)
+        stats = {}
+        start = time.perf_counter()
+        with instrumentation.call():
+            matches = self._rank_doctors(pet, max_distance, limit, offset, stats, available_within)
+        instrumentation.record_query(stats, time.perf_counter() - start)
+        return matches
+
+    def _pet_weights(self, pet: Pet) -> SymptomWeights:
+        matcher = self.symptom_matcher
+        return matcher.pet_weights(pet) if matcher is not None else ()
+
+    def _rank_doctors(self, pet: Pet, max_distance: float, limit: Optional[int], offset: int,
+                      stats: Optional[dict] = None, available_within: Optional[float] = None) -> List[DoctorMatch]:
+        # stats, when given, collects per-query numbers for the instrumentation
+        weights = self._pet_weights(pet)
+        if available_within is not None and not self.filters_availability:
+            raise ValueError("available_within needs use_appointments and an in-memory directory")
+        now = time.time()
+        view = self._availability if self.store is None else None
+        slots = None
+        if view is not None and (self.availability_boost or available_within is not None):
+            # Slot changes invalidate the searches around their doctor, and slot starts
+            # slip into the past minute by minute
+            slots = (available_within, int(now // 60))
+        cache = self.query_cache
+        if cache is not None:
+            if slots is not None:
+                self._invalidate_booked(cache)
+            key = cache.key(pet.location, pet.species, max_distance, limit, offset, self.travel_table is not None,
+                            weights, slots)
+            cached = cache.get(key)
+            if cached is not None:
+                if stats is not None:
+                    stats.update(cache="hit", results=len(cached))
+                return list(cached)
+            generation = cache.generation
+        # Taken after the generation, so a snapshot replaced in between never gets cached
+        snapshot = self._snapshot
+        bonus = self._availability_bonus(snapshot, now) if view is not None else None
+        
+        if self.store is not None:
+            matches = self.store.rank_doctors(pet, max_distance, limit, offset, weights)
+            if stats is not None:
+                stats.update(cache="miss" if cache is not None else "off", results=len(matches))
+            if cache is not None:
+                cache.put(key, matches, pet.location, max_distance, generation)
+            return list(matches)
+        
+        # One snapshot for the whole query, concurrent updates publish new ones
+        table = snapshot.table
+        
+        ranked = None
+        cells = self.candidate_cells
+        # Lists hold at most max_list_length matches per cell, so only pages can come from them
+        if cells is not None and limit is not None and not weights and slots is None and self.travel_table is None:
+            ranked = cells.rank(snapshot, pet.location, pet.species, max_distance, limit, offset)
+        if ranked is None and slots is None:
+            ranked = self._rank_sharded(snapshot, pet, max_distance, limit, offset, weights)
+        if ranked is not None:
+            ids, distances, scores, specialist = ranked
+            if stats is not None:
+                stats.update(cache="miss" if cache is not None else "off", results=len(ids))
+        else:
+            ids, distances, scores, specialist = self._rank_local(snapshot, pet, max_distance, limit, offset,
+                                                                  stats, weights, bonus, available_within, now)
+            if stats is not None:
+                stats.update(cache="miss" if cache is not None else "off")
+        
+        matches = [DoctorMatch(table[i], distance, score, is_specialist)
+                   for i, distance, score, is_specialist in zip(ids.tolist(), distances.tolist(),
+                                                                scores.tolist(), specialist.tolist())]
+        if cache is not None:
+            cache.put(key, matches, pet.location, max_distance, generation)
+        return list(matches)
+
+    def _rank_sharded(self, snapshot, pet: Pet, max_distance: float, limit: Optional[int], offset: int,
+                      weights: SymptomWeights = ()):
+        # None when no shard workers serve this snapshot
+        sharded = self._sharded
+        if (sharded is None or sharded.version != snapshot.version or sharded.failed is not None
+                or self.travel_table is not None):
+            return None
+        stop = None if limit is None else offset + limit
+        try:
+            ranked = sharded.rank(pet, max_distance, stop, weights)
+        except RuntimeError:
+            # Replaced and closed while this query was in flight, or a worker died
+            self._shard_failed(sharded)
+            return None
+        return tuple(column[offset:] for column in ranked)
+
+    def _shard_failed(self, sharded):
+        # Queries rank in-process while a failed matcher is rebuilt
+        if sharded.failed is not None and sharded is self._sharded:
+            self._refresh_shards()
+
+    def _rank_batch_sharded(self, sharded, snapshot, pets: Iterable[Pet], max_distance: float,
+                            limit: Optional[int], chunk_size: int):
+        for chunk in chunked(pets, chunk_size):
+            weights = [self._pet_weights(pet) for pet in chunk]
+            try:
+                ranked = sharded.rank_many(chunk, max_distance, limit, weights)
+            except RuntimeError:
+                self._shard_failed(sharded)
+                ranked = [self._rank_local(snapshot, pet, max_distance, limit, 0, weights=pet_weights)
+                          for pet, pet_weights in zip(chunk, weights)]
+            yield from zip(chunk, ranked)
+
+    def _rank_local(self, snapshot, pet: Pet, max_distance: float, limit: Optional[int], offset: int,
+                    stats: Optional[dict] = None, weights: SymptomWeights = (), bonus=None,
+                    available_within: Optional[float] = None, now: Optional[float] = None):
+        table = snapshot.table
+        # Only score doctors whose grid cells can fall within max_distance
+        candidates = snapshot.candidates(pet.location, max_distance)
+        if available_within is not None:
+            now = time.time() if now is None else now
+            candidates = candidates[self._availability.earliest(snapshot, candidates, now) <= now + available_within]
+        travel_table = self.travel_table
+        if travel_table is not None:
+            start = time.perf_counter()
+            ids, distances, scores, specialist = rank_matches_by_travel(
+                table, travel_table, pet.location, pet.species, max_distance, candidates, limit, offset, weights,
+                bonus)
+            if stats is not None:
+                stats.update(candidates=len(candidates), in_radius=len(ids),
+                             scoring_seconds=time.perf_counter() - start, results=len(ids))
+        elif stats is None:
+            ids, distances, scores, specialist = rank_matches(table, pet.location, pet.species, max_distance,
+                                                              candidates, limit, offset, weights, bonus)
+        else:
+            start = time.perf_counter()
+            ids, distances, scores = score_candidates(table, pet.location, max_distance, candidates)
+            if weights:
+                scores = scores + table.symptom_bonus(ids, weights)
+            if bonus is not None:
+                scores = scores + bonus(ids)
+            in_radius = len(ids)
+            ids, distances, scores, specialist = rank_scored(ids, distances, scores,
+                                                             table.specialist_mask(pet.species, ids),
+                                                             limit, offset)
+            stats.update(candidates=len(candidates), in_radius=in_radius,
+                         scoring_seconds=time.perf_counter() - start, results=len(ids))
+        logger.debug("Searched for %s doctors: %d of %d checked, %d returned within %skm",
+                     pet.species, len(candidates), snapshot.live_count, len(ids), max_distance)
+        if self.trace_sampler.should_trace():
+            self.trace_sampler.trace_query(table, pet, max_distance, candidates, (ids, distances, scores, specialist))
+        return ids, distances, scores, specialist
+
+    def find_best_doctor(self, pet: Pet, max_distance: float, limit: Optional[int] = None,
+                         offset: int = 0, available_within: Optional[float] = None) -> List[VetDoctor]:
+        # Specialists first, then by score; limit/offset select one page of that ranking
+        return [match.doctor for match in self.rank_doctors(pet, max_distance, limit, offset, available_within)]
+
+    def rank_doctors_batch(self, pets: Iterable[Pet], max_distance: float, limit: Optional[int] = None,
+                           offset: int = 0, chunk_size: int = 256,
+                           processes: Optional[int] = None) -> Iterator[Tuple[Pet, List[DoctorMatch]]]:
+        # Streams (pet, ranked matches) per pet, in input order, with the same ranking and page as rank_doctors
+        count, start = 0, time.perf_counter()
+        if self.store is not None:
+            for pet in pets:
+                count += 1
+                yield pet, self.store.rank_doctors(pet, max_distance, limit, offset, self._pet_weights(pet))
+        else:
+            snapshot = self._snapshot
+            table = snapshot.table
+            for pet, (ids, distances, scores, specialist) in self._batch_rankings(snapshot, pets, max_distance, limit,
+                                                                                   offset, chunk_size, processes):
+                count += 1
+                yield pet, [DoctorMatch(table[i], distance, score, is_specialist)
+                            for i, distance, score, is_specialist in zip(ids.tolist(), distances.tolist(),
+                                                                         scores.tolist(), specialist.tolist())]
+        self.instrumentation.record_batch(count, time.perf_counter() - start)
+
+    def find_best_doctors_batch(self, pets: Iterable[Pet], max_distance: float,
+                                chunk_size: int = 256,
+                                processes: Optional[int] = None) -> Iterator[Tuple[Pet, List[VetDoctor]]]:
+        # Streams (pet, ranked doctors) per pet, in input order, with the same ranking as find_best_doctor
+        count, start = 0, time.perf_counter()
+        if self.store is not None:
+            for pet in pets:
+                count += 1
+                yield pet, self.store.find_best_doctor(pet, max_distance, weights=self._pet_weights(pet))
+        else:
+            snapshot = self._snapshot
+            for pet, ranked in self._batch_rankings(snapshot, pets, max_distance, None, 0, chunk_size, processes):
+                count += 1
+                yield pet, [snapshot.table[i] for i in ranked[0].tolist()]
+        self.instrumentation.record_batch(count, time.perf_counter() - start)
+
+    def _batch_rankings(self, snapshot, pets: Iterable[Pet], max_distance: float, limit: Optional[int],
+                        offset: int, chunk_size: int, processes: Optional[int]):
+        # (pet, (ids, distances, scores, specialist)) for the in-memory directory
+        sharded = self._sharded
+        stop = None if limit is None else offset + limit
+        bonus = self._availability_bonus(snapshot, time.time())
+        if self.travel_table is not None or bonus is not None:
+            # The matrix batch path only knows straight-line distances and symptom bonuses
+            return ((pet, self._rank_local(snapshot, pet, max_distance, limit, offset,
+                                           weights=self._pet_weights(pet), bonus=bonus)) for pet in pets)
+        if sharded is not None and sharded.version == snapshot.version and sharded.failed is None:
+            rankings = self._rank_batch_sharded(sharded, snapshot, pets, max_distance, stop, chunk_size)
+        else:
+            rankings = iter_batch_rankings(snapshot, pets, max_distance, chunk_size, processes, stop,
+                                           self.symptom_matcher)
+        if not offset:
+            return rankings
+        return ((pet, tuple(column[offset:] for column in ranked)) for pet, ranked in rankings)
@@ -1,110 +1,23 @@
-from dataclasses import dataclass
-from typing import List
-import math
-import pandas as pd
-import geocoder
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import threading
+import time
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
-from ttkthemes import ThemedTk
-from PIL import Image, ImageTk 
+from models import Location, Pet, VetDoctor
+from vet_core import VetMatchingSystem
+from query_cache import QueryCache
+from location_provider import LocationProvider
+from diagnostics import configure_logging, logger
+from appointments import AppointmentInventory, HoldExpired, SlotUnavailable, doctor_key
 
-@dataclass
-class Location:
-    latitude: float
-    longitude: float
+APPOINTMENTS_PATH = "appointments.db"
+# Only slots this far ahead are offered when a doctor is clicked
+BOOKING_WINDOW_SECONDS = 7 * 24 * 3600
 
-    def distance_to(self, other: 'Location') -> float:
-        R = 6371
-        lat1, lon1 = math.radians(float(self.latitude)), math.radians(float(self.longitude))
-        lat2, lon2 = math.radians(float(other.latitude)), math.radians(float(other.longitude))
-        
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        
-        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-        return R * c
-
-@dataclass
-class Pet:
-    name: str
-    species: str
-    age: float
-    weight: float
-    symptoms: List[str]
-    medical_history: List[str]
-    location: Location
-
-@dataclass
-class VetDoctor:
-    name: str
-    specializations: List[str]
-    experience_years: int
-    rating: float
-    location: Location
-    contact: str
-
-class VetMatchingSystem:
-    def __init__(self):
-        self.doctors = [] 
-        self.load_doctors_from_excel()
-        
-    def load_doctors_from_excel(self):
-        try:
-            df = pd.read_excel('vets_database.xlsx')
-            print(f"Found {len(df)} doctors in database")
-            for _, row in df.iterrows():
-                try:
-                    specializations = [s.strip() for s in row['Specializations'].split(',')]
-                    doctor = VetDoctor(
-                        name=row['Name'],
-                        specializations=specializations,
-                        experience_years=int(row['Experience_Years']),
-                        rating=float(row['Rating']),
-                        location=Location(float(row['Latitude']), float(row['Longitude'])),
-                        contact=str(row['Contact'])
-                    )
-                    self.add_doctor(doctor)
-                    print(f"Loaded doctor: {doctor.name}, Specializations: {doctor.specializations}")
-                except Exception as e:
-                    print(f"Error loading doctor from row {row}: {e}")
-        except Exception as e:
-            print(f"Error loading doctors: {e}")
-            messagebox.showerror("Database Error", f"Could not load doctors database: {e}")
-            
-    def add_doctor(self, doctor: VetDoctor):
-        self.doctors.append(doctor)
-        
-    def find_best_doctor(self, pet: Pet, max_distance: float) -> List[VetDoctor]:
-        specialists = []
-        non_specialists = []
-        print(f"\nSearching for doctors for {pet.species}")
-        print(f"Total doctors in system: {len(self.doctors)}")
-        
-        for doctor in self.doctors:
-            distance = pet.location.distance_to(doctor.location)
-            print(f"Checking {doctor.name} - Distance: {distance}km, Specializations: {doctor.specializations}")
-            if distance <= max_distance:
-               
-                rating_score = doctor.rating
-                experience_score = min(5, doctor.experience_years * 0.2)
-                distance_penalty = -0.1 * distance
-                score = rating_score + experience_score + distance_penalty
-                
-               
-                if pet.species.lower().strip() in [s.lower().strip() for s in doctor.specializations]:
-                    specialists.append((doctor, score))
-                    print(f"Specialist found: {doctor.name} with score {score}")
-                else:
-                    non_specialists.append((doctor, score))
-                    print(f"Non-specialist found: {doctor.name} with score {score}")
-        
-     
-        sorted_specialists = sorted(specialists, key=lambda x: x[1], reverse=True)
-        sorted_non_specialists = sorted(non_specialists, key=lambda x: x[1], reverse=True)
-        
-      
-        return [doctor for doctor, _ in sorted_specialists + sorted_non_specialists]
+# Results are ranked and rendered a page at a time, the next page loads when scrolling near the end
+RESULTS_PAGE_SIZE = 25
 
 class VetSystemGUI:
     def __init__(self, root):
@@ -136,13 +49,37 @@ class VetSystemGUI:
         self.main_frame = ttk.Frame(self.scrollable_frame, padding="20")
         self.main_frame.pack(fill="both", expand=True)
         
+        # Searches run on a worker thread and report back through this queue
+        self.search_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vet-search")
+        self.search_results = queue.Queue()
+        self.search_generation = 0
+        self.search_cancel = None
+        self.polling_results = False
+        self.research_after_id = None
+        self.has_searched = False
+        
+        # Cached current location, refreshed in the background
+        self.location_provider = LocationProvider.from_env()
+        self.location_provider.prefetch()
+        
         # Rest of the initialization
-        self.system = VetMatchingSystem()
+        self.system = VetMatchingSystem(query_cache=QueryCache())
+        # Slots come from `python appointments.py appointments.db`, without them clicking goes straight to payment
+        self.appointments = None
+        # (doctor, hold) being paid for, hold is None for doctors without a schedule
+        self.current_booking = None
+        # Built on the first click and reused, see show_payment_window
+        self.payment_gui = None
+        if os.path.exists(APPOINTMENTS_PATH):
+            self.appointments = AppointmentInventory(APPOINTMENTS_PATH)
+            self.system.use_appointments(self.appointments)
         self.create_header()
         self.create_pet_info_section()
         self.create_medical_section()
         self.create_search_section()
         self.create_results_section()
+        if self.system.load_error is not None:
+            messagebox.showerror("Database Error", f"Could not load doctors database: {self.system.load_error}")
 
     def _on_mousewheel(self, event):
         self.main_canvas.yview_scroll(int(-1*(event.delta/120)), "units")
@@ -152,12 +89,13 @@ class VetSystemGUI:
         header_frame.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=10)
         
         try:
+            from PIL import Image, ImageTk
             image = Image.open("pet_icon.png") 
             image = image.resize((50, 50), Image.ANTIALIAS)
             self.pet_icon = ImageTk.PhotoImage(image)
             ttk.Label(header_frame, image=self.pet_icon).grid(row=0, column=0, padx=10)
         except Exception as e:
-            print(f"Error loading image: {e}")
+            logger.warning("Error loading image: %s", e)
         
         
         ttk.Label(header_frame, text="Veterinary Doctor Matching System", font=("Helvetica", 20, "bold"), foreground="#4CAF50").grid(row=0, column=1, sticky=tk.W)
@@ -295,6 +233,16 @@ class VetSystemGUI:
             bd=0
         )
         self.search_button.pack(pady=5)
+        
+        self.search_progress = ttk.Progressbar(button_frame, mode="indeterminate", length=200)
+        self.search_status = ttk.Label(button_frame, text="", font=("Helvetica", 10))
+        self.search_status.pack()
+        
+        # Re-run the last search shortly after the inputs change
+        for widget in (self.species, self.max_distance, self.age, self.weight):
+            widget.bind("<KeyRelease>", self.schedule_research)
+        for var in self.symptoms_vars.values():
+            var.trace_add("write", lambda *args: self.schedule_research())
 
     def create_results_section(self):
         results_frame = ttk.LabelFrame(
@@ -333,7 +281,17 @@ class VetSystemGUI:
             command=self.results_area.yview
         )
         scrollbar.grid(row=0, column=1, sticky="ns")
-        self.results_area.configure(yscrollcommand=scrollbar.set)
+        self.results_scrollbar = scrollbar
+        self.results_area.configure(yscrollcommand=self.on_results_scroll)
+        # Matches fetched so far, the next page is ranked with rank_doctors(limit, offset) on demand
+        # by the search thread, like the first one
+        self.result_matches = []
+        self.result_pet = None
+        self.result_distance = None
+        self.more_results = False
+        self.fetching_page = False
+        self.rendered_results = 0
+        self.selected_doctor = None
         
         # Configure clickable text styling
         self.results_area.tag_configure(
@@ -345,25 +303,147 @@ class VetSystemGUI:
         self.results_area.tag_bind("clickable", "<Button-1>", self.open_payment_page)
         self.results_area.tag_bind("clickable", "<Enter>", lambda e: self.results_area.configure(cursor="hand2"))
         self.results_area.tag_bind("clickable", "<Leave>", lambda e: self.results_area.configure(cursor=""))
+        self.results_area.tag_configure("more_results", foreground="#757575", font=("Helvetica", 11, "italic"))
+
+    def on_results_scroll(self, first, last):
+        self.results_scrollbar.set(first, last)
+        if float(last) > 0.9 and (self.rendered_results < len(self.result_matches) or self.more_results):
+            self.root.after_idle(self.render_next_page)
+
+    def fetch_page(self, pet, max_distance, offset):
+        # One extra match tells whether there is a page after this one
+        matches = self.system.rank_doctors(pet, max_distance, RESULTS_PAGE_SIZE + 1, offset)
+        return matches[:RESULTS_PAGE_SIZE], len(matches) > RESULTS_PAGE_SIZE
+
+    def render_next_page(self):
+        start = self.rendered_results
+        if start >= len(self.result_matches) and self.more_results:
+            if not self.fetching_page:
+                self.fetching_page = True
+                self.search_executor.submit(self.run_page_fetch, self.search_generation, self.result_pet,
+                                            self.result_distance, start)
+                self.poll_for_results()
+            return
+        if self.results_area.tag_ranges("more_results"):
+            self.results_area.delete("more_results.first", "more_results.last")
+        page = self.result_matches[start:start + RESULTS_PAGE_SIZE]
+        if not page:
+            return
+        
+        # One insert call per page: alternating text and tag lists
+        chunks = []
+        for i, match in enumerate(page, start):
+            doctor = match.doctor
+            chunks.extend(("\nDoctor: ", ()))
+            chunks.extend((doctor.name, ("clickable", f"doctor-{i}")))
+            chunks.extend((
+                f"\nSpecializations: {', '.join(doctor.specializations)}\n"
+                f"Experience: {doctor.experience_years} years\n"
+                f"Rating: {doctor.rating}\n"
+                f"Distance: {match.distance:.2f} km\n"
+                f"Contact: {doctor.contact}\n"
+                f"{self.next_slot_line(doctor)}"
+                f"{'='*40}\n",
+                ()
+            ))
+        self.rendered_results = start + len(page)
+        
+        if self.more_results:
+            chunks.extend(("\nScroll down for more doctors...\n", ("more_results",)))
+        self.results_area.insert(tk.END, *chunks)
 
     def open_payment_page(self, event=None):
-        payment_window = tk.Toplevel(self.root)
-        from payment import PaymentGUI
-        PaymentGUI(payment_window)
+        if self.payment_gui is not None and self.payment_gui.pending_payment is not None:
+            # Finish the payment in flight before holding a slot with someone else
+            self.payment_gui.show()
+            return
+        # Remember which rendered doctor was clicked
+        if event is not None:
+            for tag in self.results_area.tag_names(f"@{event.x},{event.y}"):
+                if tag.startswith("doctor-"):
+                    self.selected_doctor = self.result_matches[int(tag[len("doctor-"):])].doctor
+        booking = self.hold_appointment(self.selected_doctor)
+        if booking is None:
+            return
+        self.current_booking = booking
+        self.show_payment_window()
+
+    def show_payment_window(self):
+        if self.payment_gui is None:
+            from payment import PaymentGUI
+            self.payment_gui = PaymentGUI(tk.Toplevel(self.root))
+        self.payment_gui.show(on_paid=self.payment_completed, on_cancel=self.release_hold)
 
-    def get_current_location(self):
+    def payment_completed(self, result):
+        # Runs in Tk once the gateway confirms the charge
+        booking, self.current_booking = self.current_booking, None
+        # The doctor paid for, the results and selection may have changed since
+        doctor, hold = booking if booking is not None else (None, None)
+        if hold is None:
+            messagebox.showinfo("Payment Received", f"Payment {result.payment_id} received"
+                                                    f"{f' for {doctor.name}' if doctor is not None else ''}.")
+            return
         try:
-            g = geocoder.ip('me')
-            if g.ok:
-                return Location(g.lat, g.lng)
-            else:
-                raise Exception("Could not detect location")
-        except Exception as e:
-            messagebox.showerror("Location Error", 
-                               "Could not detect location automatically. Using default location.")
-            return Location(28.2487, -77.0635)  
+            booking = self.appointments.confirm(hold.hold_id, customer=result.payment_id)
+        except HoldExpired:
+            messagebox.showwarning("Appointment Expired",
+                                   f"Payment {result.payment_id} went through, but the held slot expired before "
+                                   "it did. Please contact the clinic to rebook or get a refund.")
+            return
+        messagebox.showinfo("Appointment Booked",
+                            f"Booked {time.strftime('%A %d %B, %H:%M', time.localtime(booking.start))} "
+                            f"with {doctor.name}.\nPayment {result.payment_id}.")
+
+    def release_hold(self):
+        booking, self.current_booking = self.current_booking, None
+        if booking is not None and booking[1] is not None:
+            self.appointments.release(booking[1].hold_id)
 
-    def find_doctors(self):
+    def next_slot_line(self, doctor):
+        if self.appointments is None:
+            return ""
+        start = self.appointments.earliest_free(doctor_key(doctor))
+        if start == float("inf"):
+            return ""
+        return f"Next free slot: {time.strftime('%a %d %b %H:%M', time.localtime(start))}\n"
+
+    def hold_appointment(self, doctor):
+        # Holds the doctor's next free slot while the user pays. Returns the (doctor, hold) booking,
+        # with no hold for doctors without a schedule, or None when the doctor has no free slot.
+        # Clicking another doctor gives up the slot held for the previous one
+        self.release_hold()
+        if self.appointments is None or doctor is None or not self.appointments.has_schedule(doctor_key(doctor)):
+            return doctor, None
+        try:
+            hold = self.appointments.hold_next(doctor_key(doctor), within=BOOKING_WINDOW_SECONDS)
+        except SlotUnavailable:
+            messagebox.showinfo("No Appointments", f"{doctor.name} has no free appointment slots this week.")
+            return None
+        minutes = round((hold.expires_at - time.time()) / 60)
+        messagebox.showinfo("Appointment Held",
+                            f"{time.strftime('%A %d %B, %H:%M', time.localtime(hold.start))} with {doctor.name} "
+                            f"is held for {minutes} minutes while you pay.")
+        return doctor, hold
+
+    def lookup_location(self):
+        # Runs on the search thread, so it must not touch any widgets
+        return self.location_provider.get()
+
+    def show_location_error(self):
+        messagebox.showerror("Location Error", 
+                           "Could not detect location automatically. Using default location.")
+
+    def schedule_research(self, event=None):
+        # Debounce edits so a search only starts once typing pauses
+        if not self.has_searched:
+            return
+        if self.research_after_id is not None:
+            self.root.after_cancel(self.research_after_id)
+        self.research_after_id = self.root.after(500, self.find_doctors, False)
+
+    def find_doctors(self, report_errors=True):
+        # Automatic re-searches pass report_errors=False, half-typed values just skip them
+        self.research_after_id = None
         try:
             # Get selected symptoms
             selected_symptoms = [
@@ -383,42 +463,120 @@ class VetSystemGUI:
                 weight=float(self.weight.get()),
                 symptoms=selected_symptoms,
                 medical_history=self.medical_history.get("1.0", tk.END).strip().split('\n'),
-                location=self.get_current_location()
+                location=None
             )
             
             max_distance = float(self.max_distance.get())
-            
-            best_doctors = self.system.find_best_doctor(pet, max_distance)
-            
-            self.results_area.delete("1.0", tk.END)
-            if not best_doctors:
-                self.results_area.insert(tk.END, f"No doctors found within {max_distance} km matching your criteria.")
-            else:
-                for doctor in best_doctors:
-                    distance = pet.location.distance_to(doctor.location)
-                    
-                    self.results_area.insert(tk.END, "\nDoctor: ")
-                    self.results_area.insert(tk.END, doctor.name, "clickable")
-                    
-                    result_text = (
-                        f"\nSpecializations: {', '.join(doctor.specializations)}\n"
-                        f"Experience: {doctor.experience_years} years\n"
-                        f"Rating: {doctor.rating}\n"
-                        f"Distance: {distance:.2f} km\n"
-                        f"Contact: {doctor.contact}\n"
-                        f"{'='*40}\n"
-                    )
-                    self.results_area.insert(tk.END, result_text)
-                    
-        except ValueError as e:
-            messagebox.showerror("Input Error", "Please check your input values. Age and weight must be numbers.")
+        except ValueError:
+            if report_errors:
+                messagebox.showerror("Input Error", "Please check your input values. Age and weight must be numbers.")
+            return
+        
+        # Supersede any search still in flight
+        if self.search_cancel is not None:
+            self.search_cancel.set()
+        self.search_generation += 1
+        self.search_cancel = threading.Event()
+        self.has_searched = True
+        
+        self.search_status.configure(text="Searching...")
+        self.search_progress.pack(pady=5)
+        self.search_progress.start(10)
+        self.search_executor.submit(self.run_search, self.search_generation, self.search_cancel,
+                                    pet, max_distance)
+        self.poll_for_results()
+
+    def poll_for_results(self):
+        if not self.polling_results:
+            self.polling_results = True
+            self.root.after(50, self.poll_search_results)
+
+    def run_search(self, generation, cancel, pet, max_distance):
+        # Results are (generation, offset, pet, max_distance, page, location detected, error)
+        try:
+            pet.location, detected = self.lookup_location()
+            if cancel.is_set():
+                return
+            matches = self.fetch_page(pet, max_distance, 0)
+            if not cancel.is_set():
+                self.search_results.put((generation, 0, pet, max_distance, matches, detected, None))
         except Exception as e:
-            messagebox.showerror("Error", f"An error occurred: {str(e)}")
+            self.search_results.put((generation, 0, pet, max_distance, None, True, e))
+
+    def run_page_fetch(self, generation, pet, max_distance, offset):
+        try:
+            matches = self.fetch_page(pet, max_distance, offset)
+            self.search_results.put((generation, offset, pet, max_distance, matches, True, None))
+        except Exception as e:
+            self.search_results.put((generation, offset, pet, max_distance, None, True, e))
+
+    def poll_search_results(self):
+        try:
+            while True:
+                generation, offset, pet, max_distance, matches, detected, error = self.search_results.get_nowait()
+                if generation != self.search_generation:
+                    continue
+                if offset:
+                    self.show_page(offset, matches, error)
+                    continue
+                self.finish_search()
+                if error is not None:
+                    messagebox.showerror("Error", f"An error occurred: {str(error)}")
+                    continue
+                self.show_results(pet, max_distance, matches)
+                if not detected:
+                    self.show_location_error()
+        except queue.Empty:
+            pass
+        if self.search_cancel is not None or self.fetching_page:
+            self.root.after(50, self.poll_search_results)
+        else:
+            self.polling_results = False
+
+    def finish_search(self):
+        self.search_cancel = None
+        self.search_progress.stop()
+        self.search_progress.pack_forget()
+        self.search_status.configure(text="")
+
+    def show_results(self, pet, max_distance, matches):
+        # matches is the first page and whether more follow, as returned by fetch_page
+        self.results_area.delete("1.0", tk.END)
+        self.result_matches, self.more_results = matches
+        self.result_pet = pet
+        self.result_distance = max_distance
+        self.rendered_results = 0
+        self.fetching_page = False
+        self.selected_doctor = None
+        if not self.result_matches:
+            self.results_area.insert(tk.END, f"No doctors found within {max_distance} km matching your criteria.")
+        else:
+            self.render_next_page()
+            self.results_area.yview_moveto(0)
+
+    def show_page(self, offset, matches, error):
+        self.fetching_page = False
+        if error is not None:
+            self.more_results = False
+            self.render_next_page()
+            messagebox.showerror("Error", f"An error occurred: {str(error)}")
+            return
+        if offset != len(self.result_matches):
+            return
+        page, self.more_results = matches
+        self.result_matches.extend(page)
+        self.render_next_page()
 
 def main():
+    from ttkthemes import ThemedTk
+    configure_logging()
     root = ThemedTk(theme="arc") 
     app = VetSystemGUI(root)
     root.mainloop()
+    if app.appointments is not None:
+        app.appointments.close()
+    if app.payment_gui is not None:
+        app.payment_gui.payments.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file